@@ -51,5 +51,6 @@ setup(
         ],
         extras_require={
             'test': ['nose'],
+            'store': ['pyarrow'],
         },
 )
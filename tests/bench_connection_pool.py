@@ -0,0 +1,34 @@
+'''
+Benchmark: retrieving many time series with and without reusing keep-alive connections.
+
+Runs against a local StubVeneer, so it measures client and loopback overhead rather than Source itself.
+With idle_timeout=0, every request is made on a new connection, as it was before connection pooling.
+
+python tests/bench_connection_pool.py [number of time series]
+'''
+import os
+import sys
+import time
+
+sys.path.insert(0,os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stub_veneer import StubVeneer,make_run
+from veneer import Veneer
+
+def benchmark(stub,n,**kwargs):
+    v = Veneer(port=stub.port,**kwargs)
+    run_data = v.retrieve_run('1')
+    connections = stub.connections
+    start = time.time()
+    v.retrieve_multiple_time_series(run_data=run_data)
+    elapsed = time.time()-start
+    return n/elapsed,stub.connections-connections
+
+if __name__=='__main__':
+    n = int(sys.argv[1]) if len(sys.argv)>1 else 5000
+    with StubVeneer([make_run(1,['Node%d'%i for i in range(n)])]) as stub:
+        for label,kwargs in [('New connection per request',{'idle_timeout':0}),
+                             ('Pooled keep-alive connections',{})]:
+            rate,connections = benchmark(stub,n,**kwargs)
+            print('%-30s %8.0f requests/s  %6d new connections'%(label,rate,connections))
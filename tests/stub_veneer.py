@@ -0,0 +1,241 @@
+'''
+A minimal, in-process stand in for the Veneer web service, for tests and benchmarks.
+
+StubVeneer serves a set of runs (results summaries and time series) over HTTP/1.1 with keep-alive,
+from a background thread. Counts of requests and connections are kept for checking connection reuse.
+'''
+try:
+    from http.server import BaseHTTPRequestHandler,HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler,HTTPServer
+    from SocketServer import ThreadingMixIn
+
+try:
+    from urllib.parse import unquote
+except ImportError:
+    from urllib import unquote
+
+import json
+import threading
+import time
+from datetime import date,timedelta
+
+def daily_events(n,start=date(2000,1,1),value=lambda i:float(i)):
+    return [{'Date':(start+timedelta(days=i)).strftime('%m/%d/%Y 00:00:00'),'Value':value(i)} for i in range(n)]
+
+def make_run(run,elements,variable='Downstream Flow Volume',days=10,value=lambda i:float(i)):
+    '''
+    Build a run (results summary and time series) with one time series for each of elements
+    '''
+    results = []
+    series = {}
+    for el in elements:
+        url = '/runs/%d/location/%s/element/%s/variable/%s'%(run,el,variable,variable)
+        results.append({'NetworkElement':el,'RecordingElement':variable,'RecordingVariable':variable,
+                        'TimeSeriesName':'%s:%s'%(el,variable),'TimeSeriesUrl':url,'Units':'m3'})
+        series[url] = {'Name':'%s:%s'%(el,variable),'Units':'m3','Events':daily_events(days,value=value)}
+    summary = {'DateRun':'01/01/2017 00:00:%02d'%run,'Name':'Run%d'%run,'RunUrl':'/runs/%d'%run,'Results':results}
+    return summary,series
+
+def make_network(nodes=5):
+    '''
+    Build a GeoJSON network, as returned by /network, with a chain of nodes joined by links, each with a catchment
+    '''
+    features = []
+    for i in range(nodes):
+        features.append({'type':'Feature','id':'/network/nodes/%d'%i,
+                         'geometry':{'type':'Point','coordinates':[float(i),0.0]},
+                         'properties':{'feature_type':'node','name':'Node %d'%i,'icon':'/resources/%s'%('Outlet' if i==nodes-1 else 'Confluence'),
+                                       'id':'/network/nodes/%d'%i}})
+    for i in range(nodes-1):
+        features.append({'type':'Feature','id':'/network/link/%d'%i,
+                         'geometry':{'type':'LineString','coordinates':[[float(i),0.0],[float(i+1),0.0]]},
+                         'properties':{'feature_type':'link','name':'Reach %d'%i,'id':'/network/link/%d'%i,
+                                       'from_node':'/network/nodes/%d'%i,'to_node':'/network/nodes/%d'%(i+1),
+                                       'length':1000*(i+1)}})
+        features.append({'type':'Feature','id':'/network/catchments/%d'%i,
+                         'geometry':{'type':'Polygon','coordinates':[[[float(i),0.0],[float(i),1.0],[float(i+1),1.0]]]},
+                         'properties':{'feature_type':'catchment','name':'Catchment %d'%i,'id':'/network/catchments/%d'%i,
+                                       'link':'/network/link/%d'%i,'areaInSquareMeters':None if i==0 else 1e6*i}})
+    return {'type':'FeatureCollection','features':features}
+
+DOCUMENTS={'/':{},'/functions':[],'/variables':[],'/inputSets':[],'/network':{'features':[]}}
+
+class _Server(ThreadingMixIn,HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class StubVeneer(object):
+    '''
+    Stub Veneer service on localhost.
+
+    runs: List of (summary,series) tuples, as returned by make_run
+
+    chunked: Send responses with chunked transfer encoding rather than Content-Length
+
+    Set delay (seconds) to slow down every response. max_active records the most requests handled at once.
+
+    Use as a context manager, or call start() and stop().
+    '''
+    def __init__(self,runs=[],chunked=False,documents=None):
+        self.runs = list(runs)
+        self.documents = DOCUMENTS if documents is None else documents
+        self.chunked = chunked
+        self.requests = []
+        self.connections = 0
+        self.fail = {}
+        self.delay = 0
+        self.max_active = 0
+        self._active = 0
+        self._lock = threading.Lock()
+
+        stub = self
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Send each response in one piece, so small responses aren't held up by Nagle's algorithm
+            wbufsize = -1
+            disable_nagle_algorithm = True
+
+            def setup(self):
+                BaseHTTPRequestHandler.setup(self)
+                with stub._lock:
+                    stub.connections += 1
+
+            def log_message(self,*args):
+                pass
+
+            def _respond(self,code,body=None,headers={}):
+                data = b'' if body is None else json.dumps(body).encode('utf-8')
+                self.send_response(code)
+                self.send_header('Content-Type','application/json')
+                for k,v in headers.items():
+                    self.send_header(k,v)
+                if stub.chunked:
+                    self.send_header('Transfer-Encoding','chunked')
+                    self.end_headers()
+                    for i in range(0,len(data),7):
+                        piece = data[i:i+7]
+                        self.wfile.write(('%x\r\n'%len(piece)).encode('ascii')+piece+b'\r\n')
+                    self.wfile.write(b'0\r\n\r\n')
+                else:
+                    self.send_header('Content-Length',str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+
+            def _handle(self,method):
+                path = unquote(self.path)
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else None
+                with stub._lock:
+                    stub.requests.append((method,path))
+                    stub._active += 1
+                    stub.max_active = max(stub.max_active,stub._active)
+                try:
+                    if stub.delay:
+                        time.sleep(stub.delay)
+                    if (method,path) in stub.fail:
+                        return self._respond(stub.fail[(method,path)],{'Message':'Failed','StackTrace':''})
+                    code,resp,headers = stub.handle(method,path,body)
+                    self._respond(code,resp,headers)
+                finally:
+                    with stub._lock:
+                        stub._active -= 1
+
+            def do_GET(self):
+                self._handle('GET')
+
+            def do_POST(self):
+                self._handle('POST')
+
+            def do_DELETE(self):
+                self._handle('DELETE')
+
+            def do_PUT(self):
+                self._handle('PUT')
+
+        self._server = _Server(('127.0.0.1',0),Handler)
+        self.port = self._server.server_address[1]
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self,*args):
+        self.stop()
+
+    def _run_list(self):
+        return [{k:v for k,v in summary.items() if k!='Results'} for summary,_ in self.runs]
+
+    def handle(self,method,path,body):
+        '''
+        Return (code,response body,headers) for a request
+        '''
+        parts = path.rstrip('/').split('/')
+        if method=='GET' and path in self.documents:
+            return 200,self.documents[path],{}
+        if method=='GET' and path=='/runs':
+            return 200,self._run_list(),{}
+        if method=='POST' and path=='/runs':
+            params = json.loads(body.decode('utf-8')) if body else {}
+            run = len(self.runs)+1
+            self.runs.append(make_run(run,params.get('_Elements',['Outlet'])))
+            return 302,None,{'Location':'/runs/%d'%run}
+        if len(parts)>=3 and parts[1]=='runs' and (parts[2]=='latest' or parts[2].isdigit()):
+            runs = self.runs
+            index = len(runs)-1 if parts[2]=='latest' else int(parts[2])-1
+            if index<0 or index>=len(runs):
+                return 404,None,{}
+            summary,series = runs[index]
+            if method=='DELETE' and len(parts)==3:
+                del self.runs[index]
+                for i,(s,ts) in enumerate(self.runs):
+                    self.runs[i] = _renumber(s,ts,i+1)
+                return 200,None,{}
+            if method=='GET' and len(parts)==3:
+                return 200,summary,{}
+            if method=='GET' and len(parts)>4 and parts[4]=='__all__':
+                return 200,_wildcard(summary,series,parts[6],parts[8]),{}
+            if method=='GET':
+                url = '/'.join(['','runs',str(index+1)]+parts[3:])
+                if url in series:
+                    return 200,series[url],{}
+        return 404,None,{}
+
+def _wildcard(summary,series,element,variable):
+    '''
+    Slim time series for all locations, as Veneer returns for location/__all__
+    '''
+    result = []
+    for r in summary['Results']:
+        if r['RecordingElement']!=element or r['RecordingVariable']!=variable:
+            continue
+        events = series[r['TimeSeriesUrl']]['Events']
+        ts = {k:r[k] for k in ['NetworkElement','RecordingElement','RecordingVariable','TimeSeriesName','Units']}
+        ts.update({'StartDate':events[0]['Date'],'EndDate':events[-1]['Date'],'TimeStep':'Daily',
+                   'Values':[e['Value'] for e in events]})
+        result.append(ts)
+    return {'TimeSeries':result}
+
+def _renumber(summary,series,run):
+    '''
+    Veneer numbers runs by position: renumber a run after an earlier run is dropped
+    '''
+    def renumber_url(url):
+        parts = url.split('/')
+        parts[2] = str(run)
+        return '/'.join(parts)
+    summary = dict(summary,RunUrl='/runs/%d'%run,
+                   Results=[dict(r,TimeSeriesUrl=renumber_url(r['TimeSeriesUrl'])) for r in summary['Results']])
+    series = {renumber_url(url):ts for url,ts in series.items()}
+    return summary,series
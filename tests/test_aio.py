@@ -0,0 +1,81 @@
+import asyncio
+import os
+import sys
+import unittest
+
+sys.path.insert(0,os.path.dirname(os.path.abspath(__file__)))
+
+import pandas as pd
+
+from stub_veneer import StubVeneer,make_run
+from veneer import Veneer
+from veneer.aio import AsyncVeneer
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+class TestAsyncVeneer(unittest.TestCase):
+    def runs(self):
+        return [make_run(1,['A','B','C'],days=20),make_run(2,['A','B'],days=20,value=lambda i:2.0*i)]
+
+    def check_matches_blocking_client(self,chunked):
+        with StubVeneer(self.runs(),chunked=chunked) as stub:
+            expected = Veneer(port=stub.port).retrieve_multiple_time_series(run='1',criteria={'NetworkElement':'.*'})
+            client = AsyncVeneer(port=stub.port)
+            actual = run(client.retrieve_multiple_time_series(run=1,criteria={'NetworkElement':'.*'}))
+            client.close()
+        pd.testing.assert_frame_equal(actual,expected,check_freq=False,check_frame_type=False)
+
+    def test_matches_blocking_client(self):
+        self.check_matches_blocking_client(chunked=False)
+
+    def test_chunked_responses(self):
+        self.check_matches_blocking_client(chunked=True)
+
+    def test_reuses_connections(self):
+        with StubVeneer(self.runs()) as stub:
+            client = AsyncVeneer(port=stub.port,pool_size=2)
+            async def many():
+                return await asyncio.gather(*[client.retrieve_run(1) for _ in range(10)])
+            summaries = run(many())
+            client.close()
+            self.assertEqual(len(summaries),10)
+            self.assertLessEqual(stub.connections,2)
+
+    def test_separate_event_loops(self):
+        with StubVeneer(self.runs()) as stub:
+            client = AsyncVeneer(port=stub.port)
+            first = run(client.retrieve_runs())
+            second = run(client.retrieve_runs())
+            client.close()
+        self.assertEqual(first,second)
+        self.assertEqual(len(first),2)
+
+    def test_error_status_raises(self):
+        with StubVeneer(self.runs()) as stub:
+            client = AsyncVeneer(port=stub.port)
+            with self.assertRaises(Exception):
+                run(client.retrieve_json('/runs/9'))
+            stub.fail[('GET','/runs')] = 500
+            with self.assertRaises(Exception):
+                run(client.retrieve_runs())
+            client.close()
+
+    def test_run_model_and_drop_run(self):
+        with StubVeneer() as stub:
+            client = AsyncVeneer(port=stub.port)
+            code,location = run(client.run_model(_Elements=['X','Y']))
+            self.assertEqual(code,302)
+            self.assertEqual(location,'/runs/1')
+            summary = run(client.retrieve_run(location))
+            self.assertEqual(len(summary['Results']),2)
+            self.assertEqual(run(client.drop_run(1)),200)
+            self.assertEqual(len(stub.runs),0)
+            client.close()
+
+if __name__=='__main__':
+    unittest.main()
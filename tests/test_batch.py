@@ -0,0 +1,34 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0,os.path.dirname(os.path.abspath(__file__)))
+
+import pandas as pd
+
+from stub_veneer import StubVeneer
+from veneer import Veneer
+from veneer.batch import BatchRunner
+
+class TestBatchRunner(unittest.TestCase):
+    def test_failed_run_doesnt_stop_batch(self):
+        with StubVeneer() as good, StubVeneer() as bad:
+            bad.fail[('POST','/runs')] = 500
+            runner = BatchRunner([Veneer(port=good.port),Veneer(port=bad.port)])
+            runner.retrieve('runs').retrieve_runs()
+            parameter_sets = pd.DataFrame({'x':[1,2,3,4]})
+            jobs,results = runner.run(parameter_sets)
+
+        self.assertEqual(len(jobs),4)
+        failed = [i for i,job in enumerate(jobs) if isinstance(job[2],Exception)]
+        self.assertTrue(len(failed)>0)
+        for i,(_,_,ticket,endpoint) in enumerate(jobs):
+            if i in failed:
+                self.assertIsNone(results[i])
+                self.assertEqual(endpoint.port,bad.port)
+            else:
+                self.assertIsNone(ticket)
+                self.assertEqual(len(results[i]['runs']),1)
+
+if __name__=='__main__':
+    unittest.main()
@@ -0,0 +1,282 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+import zipfile
+
+sys.path.insert(0,os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+import pandas as pd
+
+from stub_veneer import StubVeneer,make_run,daily_events
+from veneer import Veneer
+from veneer.bulk import MANIFEST,PruneVeneer,SeriesRules,VeneerRetriever,_ZipWriter,aggregate_time_series
+
+class TestZipWriter(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_parallel_writes(self):
+        fn = os.path.join(self.directory,'archive.zip')
+        data = {'runs/1/ts%d.json'%i:(('value %d,'%i)*2000).encode('utf-8') for i in range(100)}
+        data['empty.json'] = b''
+        items = list(data.items())
+        writer = _ZipWriter(fn)
+        threads = [threading.Thread(target=lambda part: [writer.write(k,v) for k,v in part],args=(items[i::8],))
+                   for i in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        writer.close()
+
+        with zipfile.ZipFile(fn) as archive:
+            self.assertIsNone(archive.testzip())
+            self.assertEqual(sorted(archive.namelist()),sorted(data.keys()))
+            for name,content in data.items():
+                self.assertEqual(archive.read(name),content)
+            self.assertTrue(all(i.compress_type==zipfile.ZIP_DEFLATED for i in archive.infolist()))
+
+class TestAggregates(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_aggregate_events(self):
+        ts = {'Events':daily_events(366,value=lambda i:1.0)}
+        monthly = aggregate_time_series(ts,'monthly')
+        self.assertEqual(len(monthly['Events']),12)
+        self.assertEqual(monthly['Events'][1],{'Date':'02/29/2000 00:00:00','Value':29.0})
+        self.assertEqual((monthly['StartDate'],monthly['EndDate']),('01/31/2000 00:00:00','12/31/2000 00:00:00'))
+        annual = aggregate_time_series(ts,'annual')
+        self.assertEqual(annual['Events'],[{'Date':'12/31/2000 00:00:00','Value':366.0}])
+
+    def test_only_daily_slim_series(self):
+        ts = {'StartDate':'01/31/2000 00:00:00','EndDate':'12/31/2000 00:00:00','TimeStep':'Monthly','Values':[1.0]*12}
+        with self.assertRaises(Exception):
+            aggregate_time_series(ts,'annual')
+
+    def test_derived_aggregates_can_be_read(self):
+        dest = os.path.join(self.directory,'archive')
+        runs = [make_run(1,['Outlet','Headwater'],days=366,value=lambda i:float(i%10))]
+        with StubVeneer(runs) as stub:
+            retriever = VeneerRetriever(dest,port=stub.port,derive_aggregates=True)
+            retriever.retrieve_all()
+
+        daily = pd.Series([float(i%10) for i in range(366)],index=pd.date_range('2000-01-01',periods=366))
+        v = Veneer(protocol='file',prefix=dest,live=False)
+        for timestep,freq in [('monthly','M'),('annual','A')]:
+            expected = daily.resample(freq).sum()
+            for slim in [False,True]:
+                df = v.retrieve_multiple_time_series(run='1',timestep=timestep,slim=slim)
+                self.assertEqual(list(df.columns),['Outlet:Downstream Flow Volume','Headwater:Downstream Flow Volume'])
+                self.assertEqual(list(df.index),list(expected.index))
+                np.testing.assert_array_equal(df['Outlet:Downstream Flow Volume'].values,expected.values)
+
+class TestPlanDownloads(unittest.TestCase):
+    def test_skips_failed_runs(self):
+        runs = [make_run(1,['A','B']),make_run(2,['A','B'])]
+        with StubVeneer(runs) as stub:
+            stub.fail[('GET','/runs/1')] = 500
+            retriever = VeneerRetriever(tempfile.gettempdir(),port=stub.port,retrieve_slim_ts=False,
+                                        retrieve_monthly=False,retrieve_annual=False)
+            plan = retriever.plan_downloads()
+        self.assertEqual(plan['failed'],['/runs/1'])
+        self.assertEqual(len(plan['time_series']),2)
+        self.assertTrue(all(url.startswith('/runs/2/') for url in plan['time_series']))
+
+    def test_retrieve_all_skips_failed_runs(self):
+        runs = [make_run(1,['A','B']),make_run(2,['A','B'])]
+        with tempfile.TemporaryDirectory() as tmp:
+            dest = os.path.join(tmp,'archive')
+            with StubVeneer(runs) as stub:
+                stub.fail[('GET','/runs/1')] = 500
+                retriever = VeneerRetriever(dest,port=stub.port,retrieve_slim_ts=False,derive_aggregates=True)
+                messages = []
+                retriever.log = messages.append
+                retriever.retrieve_all()
+            self.assertFalse(os.path.exists(os.path.join(dest,'runs','1')))
+            self.assertEqual(sorted(os.listdir(os.path.join(dest,'runs','2','location'))),['A','B'])
+            self.assertTrue(any('/runs/1' in m for m in messages))
+
+class TestParallelRetrieval(unittest.TestCase):
+    def retrieve(self,dest,max_workers):
+        runs = [make_run(1,['A','B','C'],days=30),make_run(2,['A','B','C'],days=30,value=lambda i:2.0*i)]
+        with StubVeneer(runs) as stub:
+            stub.delay = 0.01
+            retriever = VeneerRetriever(dest,port=stub.port,max_workers=max_workers,retrieve_slim_ts=False,
+                                        retrieve_monthly=False,retrieve_annual=False,retrieve_ts_csv=True)
+            retriever.retrieve_all()
+        self.assertEqual(retriever.requests,len(stub.requests))
+        return stub
+
+    def contents(self,dest):
+        found = {}
+        for directory,_,filenames in os.walk(dest):
+            for fn in filenames:
+                if fn==MANIFEST:
+                    continue
+                path = os.path.join(directory,fn)
+                with open(path,'rb') as f:
+                    found[os.path.relpath(path,dest)] = f.read()
+        return found
+
+    def test_overlapping_requests_give_the_same_archive(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            serial = self.retrieve(os.path.join(tmp,'serial'),max_workers=1)
+            parallel = self.retrieve(os.path.join(tmp,'parallel'),max_workers=4)
+            self.assertEqual(serial.max_active,1)
+            self.assertGreater(parallel.max_active,1)
+            self.assertEqual(sorted(serial.requests),sorted(parallel.requests))
+            expected = self.contents(os.path.join(tmp,'serial'))
+            self.assertTrue(any(path.endswith('.csv') for path in expected))
+            self.assertEqual(self.contents(os.path.join(tmp,'parallel')),expected)
+
+def renamed_run():
+    '''
+    A run where the url of one time series doesn't use the name of its NetworkElement
+    '''
+    summary,series = make_run(1,['Gauge 1','Outlet'],days=5)
+    summary['Results'][0]['NetworkElement'] = 'Gauge #1'
+    return summary,series
+
+class TestSeriesRules(unittest.TestCase):
+    def test_unknown_keys_warn(self):
+        import warnings
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            rules = SeriesRules([{'NetworkElement':'A*','Colour':'blue'}])
+        self.assertEqual(len(caught),1)
+        self.assertTrue(rules.matches(('Ab','X','Y')))
+        self.assertFalse(rules.matches(('B','X','Y')))
+
+    def test_wildcards_match_whole_fields(self):
+        rules = SeriesRules([{'NetworkElement':'Gauge*','RecordingVariable':'?low'}])
+        self.assertTrue(rules.matches(('Gauge 1/North','X','Flow')))
+        self.assertTrue(rules.matches(('Gauge','X','Slow')))
+        self.assertFalse(rules.matches(('Gauge 1','X','Outflow')))
+        self.assertFalse(rules.matches(('The Gauge','X','Flow')))
+        exact = SeriesRules([{'NetworkElement':'Storage [A]'}])
+        self.assertTrue(exact.matches(('Storage [A]','X','Y')))
+        self.assertFalse(exact.matches(('Storage A','X','Y')))
+
+    def test_include_and_exclude(self):
+        summary,series = make_run(1,['Gauge A','Gauge B','Outlet'],days=5)
+        summary['Results'][0]['NetworkElement'] = 'Gauge A/North'
+        with tempfile.TemporaryDirectory() as tmp:
+            dest = os.path.join(tmp,'archive')
+            with StubVeneer([(summary,series)]) as stub:
+                retriever = VeneerRetriever(dest,port=stub.port,retrieve_slim_ts=False,derive_aggregates=True,
+                                            include=[{'NetworkElement':'Gauge*'}],
+                                            exclude=[{'NetworkElement':'*B'}])
+                retriever.retrieve_all()
+            series_dir = os.path.join(dest,'runs','1','location')
+            self.assertEqual(sorted(os.listdir(series_dir)),['Gauge A'])
+
+    def test_daily_wildcards_match_result_fields(self):
+        summary,series = renamed_run()
+        summary['Results'][0]['NetworkElement'] = 'Gauge #1/North'
+        with tempfile.TemporaryDirectory() as tmp:
+            dest = os.path.join(tmp,'archive')
+            with StubVeneer([(summary,series)]) as stub:
+                retriever = VeneerRetriever(dest,port=stub.port,retrieve_daily=False,retrieve_slim_ts=False,
+                                            retrieve_monthly=False,retrieve_annual=False,
+                                            retrieve_daily_for=[{'NetworkElement':'Gauge #*North'}])
+                retriever.retrieve_all()
+                # The url segment (Gauge 1) doesn't match the rule: Only the result field does
+                ts_url = summary['Results'][0]['TimeSeriesUrl']
+                self.assertTrue(retriever.retrieve_this_daily(ts_url))
+                self.assertFalse(retriever.retrieve_this_daily(summary['Results'][1]['TimeSeriesUrl']))
+            series_dir = os.path.join(dest,'runs','1','location')
+            self.assertEqual(sorted(os.listdir(series_dir)),['Gauge 1'])
+
+    def test_daily_rules_match_result_fields(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            dest = os.path.join(tmp,'archive')
+            with StubVeneer([renamed_run()]) as stub:
+                retriever = VeneerRetriever(dest,port=stub.port,retrieve_daily=False,retrieve_slim_ts=False,
+                                            retrieve_monthly=False,retrieve_annual=False,
+                                            retrieve_daily_for=[{'NetworkElement':'Gauge #1'}])
+                retriever.retrieve_all()
+            series_dir = os.path.join(dest,'runs','1','location')
+            self.assertEqual(sorted(os.listdir(series_dir)),['Gauge 1'])
+
+def two_variable_run():
+    flow,flow_series = make_run(1,['A','B'],variable='Flow',days=40)
+    storage,storage_series = make_run(1,['A','B'],variable='Storage',days=40)
+    flow['Results'] += storage['Results']
+    flow_series.update(storage_series)
+    return flow,flow_series
+
+class TestPruneThenResume(unittest.TestCase):
+    def retrieve(self,dest,stub,resume=False):
+        retriever = VeneerRetriever(dest,port=stub.port,retrieve_slim_ts=False,derive_aggregates=True)
+        retriever.retrieve_all(resume=resume)
+        return retriever
+
+    def files(self,dest):
+        found = []
+        for directory,_,filenames in os.walk(dest):
+            relative = os.path.relpath(directory,dest).replace(os.sep,'/')
+            found += [relative+'/'+f for f in filenames]
+        return found
+
+    def test_resume_skips_pruned_series(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            dest = os.path.join(tmp,'archive')
+            with StubVeneer([two_variable_run()]) as stub:
+                self.retrieve(dest,stub)
+                self.assertTrue(any('/Storage' in f for f in self.files(dest)))
+
+                pruner = PruneVeneer(dest)
+                pruner.remove_variable('Storage')
+                pruner.prune()
+                self.assertFalse(any('/Storage' in f for f in self.files(dest)))
+
+                stub.requests[:] = []
+                retriever = self.retrieve(dest,stub,resume=True)
+
+            self.assertFalse(any('Storage' in path for _,path in stub.requests))
+            self.assertFalse(any('/Storage' in f for f in self.files(dest)))
+            # Everything else was complete
+            self.assertFalse(any('/location/' in path for _,path in stub.requests))
+            with open(os.path.join(dest,'runs','1.json')) as f:
+                summary = json.load(f)
+            self.assertEqual([r['RecordingVariable'] for r in summary['Results']],['Flow','Flow'])
+            with open(os.path.join(dest,MANIFEST)) as f:
+                self.assertTrue(any('prune' in json.loads(line) for line in f))
+            self.assertEqual(retriever.requests,len(stub.requests))
+
+    def test_resume_skips_pruned_daily_series(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            dest = os.path.join(tmp,'archive')
+            with StubVeneer([two_variable_run()]) as stub:
+                self.retrieve(dest,stub)
+
+                pruner = PruneVeneer(dest)
+                pruner.remove_variable('Storage',aggregate=False)
+                pruner.prune()
+                daily = 'runs/1/location/A/element/Storage/variable/Storage.json'
+                monthly = 'runs/1/location/A/element/Storage/variable/Storage/aggregated/monthly.json'
+                self.assertNotIn(daily,self.files(dest))
+                self.assertIn(monthly,self.files(dest))
+
+                self.retrieve(dest,stub,resume=True)
+
+            self.assertNotIn(daily,self.files(dest))
+            self.assertIn(monthly,self.files(dest))
+            with open(os.path.join(dest,'runs','1.json')) as f:
+                summary = json.load(f)
+            self.assertEqual(len(summary['Results']),4)
+
+if __name__=='__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0,os.path.dirname(os.path.abspath(__file__)))
+
+from stub_veneer import StubVeneer,make_run
+from veneer import Veneer
+from veneer.cache import ResultCache
+
+URL = '/runs/2/location/Outlet/element/Downstream Flow Volume/variable/Downstream Flow Volume'
+
+class TestResultCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_reuses_results(self):
+        with StubVeneer([make_run(1,['Outlet']),make_run(2,['Outlet'])]) as stub:
+            v = Veneer(port=stub.port,cache=ResultCache())
+            first = v.retrieve_json(URL)
+            count = len(stub.requests)
+            self.assertEqual(v.retrieve_json(URL),first)
+            self.assertEqual(len(stub.requests),count)
+
+    def test_shared_between_sessions(self):
+        with StubVeneer([make_run(1,['Outlet']),make_run(2,['Outlet'])]) as stub:
+            Veneer(port=stub.port,cache=ResultCache(directory=self.directory)).retrieve_json(URL)
+            v = Veneer(port=stub.port,cache=ResultCache(directory=self.directory))
+            v.retrieve_json(URL)
+            self.assertEqual([r for r in stub.requests if r[1]==URL],[('GET',URL)])
+
+    def test_run_number_reused_by_another_client(self):
+        runs = [make_run(1,['Outlet']),make_run(2,['Outlet']),make_run(3,['Outlet'],value=lambda i:100.0+i)]
+        runs[2][0]['Name'] = 'Later run'
+        with StubVeneer(runs) as stub:
+            first = Veneer(port=stub.port,cache=ResultCache(directory=self.directory)).retrieve_json(URL)
+            self.assertEqual(first['Events'][0]['Value'],0.0)
+
+            # Run 1 dropped elsewhere (eg from Source). Run 3 becomes run 2
+            Veneer(port=stub.port).drop_run(1)
+
+            v = Veneer(port=stub.port,cache=ResultCache(directory=self.directory))
+            self.assertEqual(v.retrieve_json(URL)['Events'][0]['Value'],100.0)
+
+    def test_dropped_run_not_cached(self):
+        with StubVeneer([make_run(1,['Outlet'])]) as stub:
+            cache = ResultCache()
+            v = Veneer(port=stub.port,cache=cache)
+            v.retrieve_json(URL.replace('/runs/2/','/runs/1/'))
+            self.assertEqual(len(cache),1)
+            v.drop_run(1)
+            self.assertEqual(len(cache),0)
+
+if __name__=='__main__':
+    unittest.main()
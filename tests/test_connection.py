@@ -0,0 +1,46 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0,os.path.dirname(os.path.abspath(__file__)))
+
+from stub_veneer import StubVeneer,make_run
+from veneer import Veneer
+from veneer.connection import ConnectionPool
+
+class TestConnectionPool(unittest.TestCase):
+    def test_reuses_connection(self):
+        with StubVeneer([make_run(1,['A'])]) as stub:
+            pool = ConnectionPool('127.0.0.1',stub.port)
+            for _ in range(10):
+                resp,body = pool.request('GET','/runs')
+                self.assertEqual(resp.getcode(),200)
+            self.assertEqual(stub.connections,1)
+
+    def test_new_connection_after_idle_timeout(self):
+        with StubVeneer([make_run(1,['A'])]) as stub:
+            pool = ConnectionPool('127.0.0.1',stub.port,idle_timeout=0)
+            for _ in range(3):
+                pool.request('GET','/runs')
+            self.assertEqual(stub.connections,3)
+
+class TestDropAllRuns(unittest.TestCase):
+    def runs(self):
+        return [make_run(i,['A']) for i in range(1,4)]
+
+    def test_drops_all_runs(self):
+        with StubVeneer(self.runs()) as stub:
+            Veneer(port=stub.port).drop_all_runs()
+            self.assertEqual(len(stub.runs),0)
+            self.assertEqual(stub.connections,1)
+
+    def test_failed_drop_raises(self):
+        with StubVeneer(self.runs()) as stub:
+            stub.fail[('DELETE','/runs/2')] = 500
+            with self.assertRaises(Exception) as raised:
+                Veneer(port=stub.port).drop_all_runs()
+            self.assertIn('/runs/2',str(raised.exception))
+            self.assertEqual(len(stub.runs),2)
+
+if __name__=='__main__':
+    unittest.main()
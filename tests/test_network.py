@@ -0,0 +1,32 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0,os.path.dirname(os.path.abspath(__file__)))
+
+from stub_veneer import DOCUMENTS,StubVeneer,make_network
+from veneer import Veneer
+
+class TestNetworkTopology(unittest.TestCase):
+    def setUp(self):
+        documents = dict(DOCUMENTS)
+        documents['/network'] = make_network()
+        with StubVeneer(documents=documents) as stub:
+            self.network = Veneer(port=stub.port).network()
+
+    def test_links(self):
+        self.assertEqual(self.network.downstream_links('/network/nodes/1')._all_values('name'),['Reach 1'])
+        self.assertEqual(self.network.upstream_links('/network/nodes/1')._all_values('name'),['Reach 0'])
+
+    def test_refresh_after_modifying_features(self):
+        topology = self.network.topology()
+        link = self.network['features'].find_one_by_name('Reach 0')
+        link['properties']['to_node'] = '/network/nodes/2'
+        self.assertEqual(self.network.upstream_links('/network/nodes/1')._all_values('name'),['Reach 0'])
+
+        self.assertIs(self.network.refresh_topology(),topology)
+        self.assertEqual(len(self.network.upstream_links('/network/nodes/1')),0)
+        self.assertEqual(sorted(self.network.upstream_links('/network/nodes/2')._all_values('name')),['Reach 0','Reach 1'])
+
+if __name__=='__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import os
+import re
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0,os.path.dirname(os.path.abspath(__file__)))
+
+import pandas as pd
+
+from stub_veneer import DOCUMENTS,StubVeneer,make_network,make_run
+from veneer import Veneer
+from veneer.offline import OfflineVeneer,create_archive
+
+class TestOfflineVeneer(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.TemporaryDirectory()
+        cls.fn = os.path.join(cls.tmp.name,'archive.db')
+        documents = dict(DOCUMENTS)
+        documents['/network'] = make_network()
+        runs = [make_run(1,['Gauge 1','Gauge 2','Outlet'],days=60),
+                make_run(2,['Gauge 1','Gauge 2','Outlet'],days=60,value=lambda i:2.0*i)]
+        with StubVeneer(runs,documents=documents) as stub:
+            v = Veneer(port=stub.port)
+            cls.live = {
+                'gauges':v.retrieve_multiple_time_series(run='1',criteria={'NetworkElement':'Gauge.*'}),
+                'latest':v.retrieve_multiple_time_series(criteria={'NetworkElement':'Outlet'}),
+                'run':v.retrieve_run('1'),
+                'network':v.retrieve_json('/network'),
+                'runs':v.retrieve_runs()
+            }
+            create_archive(v,cls.fn)
+        cls.offline = OfflineVeneer(cls.fn)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.offline.close()
+        cls.tmp.cleanup()
+
+    def assertFramesEqual(self,actual,expected):
+        pd.testing.assert_frame_equal(actual,expected,check_freq=False,check_frame_type=False)
+
+    def test_retrieve_multiple_time_series(self):
+        self.assertFramesEqual(self.offline.retrieve_multiple_time_series(run=1,criteria={'NetworkElement':'Gauge.*'}),
+                               self.live['gauges'])
+        self.assertFramesEqual(self.offline.retrieve_multiple_time_series(criteria={'NetworkElement':'Outlet'}),
+                               self.live['latest'])
+
+    def test_compiled_pattern(self):
+        criteria = {'NetworkElement':re.compile('gauge',re.IGNORECASE)}
+        self.assertFramesEqual(self.offline.retrieve_multiple_time_series(run=1,criteria=criteria),self.live['gauges'])
+
+    def test_run_data(self):
+        run_data = self.offline.retrieve_run(1)
+        actual = self.offline.retrieve_multiple_time_series(run_data=run_data,criteria={'NetworkElement':'Gauge.*'})
+        self.assertFramesEqual(actual,self.live['gauges'])
+
+    def test_retrieve_run(self):
+        run = self.offline.retrieve_run('/runs/1')
+        self.assertEqual(run['Name'],self.live['run']['Name'])
+        self.assertEqual([r['TimeSeriesUrl'] for r in run['Results']],
+                         [r['TimeSeriesUrl'] for r in self.live['run']['Results']])
+        self.assertEqual(self.offline.retrieve_run()['Name'],'Run2')
+
+    def test_retrieve_json(self):
+        self.assertEqual(self.offline.retrieve_json('/network'),self.live['network'])
+        self.assertEqual(self.offline.retrieve_runs(),self.live['runs'])
+        self.assertEqual(self.offline.retrieve_json('/runs/1')['Name'],'Run1')
+
+    def test_aggregated(self):
+        monthly = self.offline.retrieve_multiple_time_series(run=1,criteria={'NetworkElement':'Gauge.*'},timestep='monthly')
+        self.assertFramesEqual(monthly,self.live['gauges'].resample('M').sum())
+
+    def test_criteria_miss(self):
+        self.assertEqual(len(self.offline.retrieve_multiple_time_series(criteria={'NetworkElement':'Nowhere'}).columns),0)
+        self.assertEqual(len(self.offline.retrieve_multiple_time_series(criteria={'RecordingVariable':'Storage.*'}).columns),0)
+
+    def test_missing(self):
+        with self.assertRaises(Exception):
+            self.offline.retrieve_json('/functions/missing')
+        with self.assertRaises(Exception):
+            self.offline.retrieve_run(3)
+        run_data = {'Results':[{'NetworkElement':'Gauge 9','TimeSeriesUrl':'/runs/1/location/Gauge 9/element/Flow/variable/Flow'}]}
+        with self.assertRaises(Exception) as raised:
+            self.offline.retrieve_multiple_time_series(run_data=run_data)
+        self.assertIn('Gauge 9',str(raised.exception))
+
+    def test_read_only(self):
+        with self.assertRaises(Exception):
+            self.offline.run_model()
+
+if __name__=='__main__':
+    unittest.main()
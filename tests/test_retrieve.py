@@ -0,0 +1,54 @@
+import os
+import sys
+import unittest
+
+import pandas as pd
+
+sys.path.insert(0,os.path.dirname(os.path.abspath(__file__)))
+
+from stub_veneer import StubVeneer,make_run
+from veneer import Veneer
+from veneer.general import _chunk_results
+
+ELEMENTS = ['Node%d'%i for i in range(12)]
+
+def stub_runs():
+    summary,series = make_run(1,ELEMENTS,days=30,value=lambda i:i*0.5)
+    other,other_series = make_run(1,ELEMENTS[:4],variable='Storage Volume',days=30)
+    summary['Results'] += other['Results']
+    series.update(other_series)
+    return [(summary,series)]
+
+class TestRetrieveMultipleTimeSeries(unittest.TestCase):
+    def retrieve(self,**kwargs):
+        with StubVeneer(stub_runs()) as stub:
+            v = Veneer(port=stub.port)
+            df = v.retrieve_multiple_time_series(**kwargs)
+            return df,list(stub.requests)
+
+    def test_slim_and_chunked_match_individual(self):
+        expected,_ = self.retrieve()
+        self.assertEqual(len(expected.columns),16)
+        for kwargs in [{'slim':True},{'chunk_size':5},{'slim':True,'chunk_size':5},{'chunk_size':3,'max_workers':4}]:
+            df,_ = self.retrieve(**kwargs)
+            pd.testing.assert_frame_equal(df,expected,check_freq=False,check_frame_type=False)
+
+    def test_urls(self):
+        urls = [r['TimeSeriesUrl'] for r in stub_runs()[0][0]['Results']][::-3]
+        df,requests = self.retrieve(urls=urls,slim=True)
+        self.assertEqual(list(df.columns),['%s:%s'%(u.split('/')[4],u.split('/')[-1]) for u in urls])
+        self.assertEqual(len([r for r in requests if '__all__' in r[1]]),1)
+
+    def test_unknown_url(self):
+        with self.assertRaises(Exception):
+            self.retrieve(urls=['/runs/1/location/Nowhere/element/X/variable/X'])
+
+    def test_chunks_keep_wildcard_groups_together(self):
+        results,_ = stub_runs()[0]
+        chunks = _chunk_results(results['Results'],5,True)
+        self.assertEqual([len(c) for c in chunks],[12,4])
+        chunks = _chunk_results(results['Results'],5,False)
+        self.assertEqual([len(c) for c in chunks],[5,5,5,1])
+
+if __name__=='__main__':
+    unittest.main()
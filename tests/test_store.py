@@ -0,0 +1,55 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0,os.path.dirname(os.path.abspath(__file__)))
+
+import pandas as pd
+
+from stub_veneer import StubVeneer,make_run
+from veneer import Veneer
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+if pyarrow is not None:
+    from veneer.store import load_run,save_run
+
+@unittest.skipUnless(pyarrow,'pyarrow not installed')
+class TestStoredRun(unittest.TestCase):
+    def round_trip(self,ext):
+        criteria = {'NetworkElement':'Gauge.*'}
+        with tempfile.TemporaryDirectory() as tmp:
+            fn = os.path.join(tmp,'run'+ext)
+            with StubVeneer([make_run(1,['Gauge 1','Gauge 2','Outlet'],days=30)]) as stub:
+                v = Veneer(port=stub.port)
+                expected = v.retrieve_multiple_time_series(criteria=criteria)
+                save_run(v,fn,criteria=criteria)
+
+            stored = load_run(fn)
+            self.assertEqual(len(stored.results),2)
+            self.assertEqual(stored.run_info['Name'],'Run1')
+            self.assertEqual(stored.run_info['TimeStep'],'daily')
+            actual = stored.retrieve_multiple_time_series(criteria=criteria)
+            pd.testing.assert_frame_equal(actual,expected,check_freq=False,check_frame_type=False)
+
+            outlet = stored.retrieve_multiple_time_series(criteria={'NetworkElement':'Gauge 2'})
+            self.assertEqual(list(outlet.columns),['Gauge 2:Downstream Flow Volume'])
+
+            column = stored.results.find_one_by_NetworkElement('Gauge 1')['Column']
+            single = stored.time_series([column])
+            self.assertEqual(list(single.columns),[column])
+            self.assertEqual(list(single[column]),list(expected['Gauge 1:Downstream Flow Volume']))
+            self.assertTrue((single.index==expected.index).all())
+
+    def test_parquet(self):
+        self.round_trip('.parquet')
+
+    def test_feather(self):
+        self.round_trip('.feather')
+
+if __name__=='__main__':
+    unittest.main()
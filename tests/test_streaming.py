@@ -0,0 +1,96 @@
+import io
+import json
+import os
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.insert(0,os.path.dirname(os.path.abspath(__file__)))
+
+from stub_veneer import daily_events
+from veneer.streaming import decode_json_stream
+
+def encode(doc):
+    return json.dumps(doc).replace('Infinity','INF').encode('utf-8')
+
+class TestStreamingDecoder(unittest.TestCase):
+    def check(self,doc,**kwargs):
+        text = encode(doc)
+        for chunk_size in list(range(1,65))+[1<<16]:
+            result = decode_json_stream(io.BytesIO(text),chunk_size=chunk_size,**kwargs)
+            yield chunk_size,result
+
+    def test_general_json(self):
+        doc = {'a':[1,2.5,-3e4,None,True,False],'b':{'c':'esc\\"aped é','d':[]},'e':float('inf')}
+        for chunk_size,result in self.check(doc):
+            self.assertEqual(result,doc,chunk_size)
+
+    def test_values(self):
+        doc = {'TimeSeries':[{'Name':'a','Values':[1.0,float('inf'),None,-2.5]},{'Name':'b','Values':[]}]}
+        for chunk_size,result in self.check(doc):
+            values = result['TimeSeries'][0]['Values']
+            self.assertEqual(values.dtype,np.float64)
+            self.assertEqual(list(values[[0,1,3]]),[1.0,float('inf'),-2.5])
+            self.assertTrue(np.isnan(values[2]))
+            self.assertEqual(len(result['TimeSeries'][1]['Values']),0)
+
+    def test_events(self):
+        events = daily_events(50,value=lambda i:float('-inf') if i==3 else (None if i==4 else i*1.5))
+        doc = {'Name':'x','Events':events,'Empty':{'Events':[]}}
+        for chunk_size,result in self.check(doc):
+            self.assertEqual(result['Events']['Date'],[e['Date'] for e in events])
+            values = result['Events']['Value']
+            self.assertEqual(values[3],float('-inf'))
+            self.assertTrue(np.isnan(values[4]))
+            self.assertEqual(values[10],15.0)
+            self.assertEqual(len(result['Empty']['Events']['Value']),0)
+
+    def test_events_in_other_layout(self):
+        events = [{'Value':1.0,'Date':'01/01/2000 00:00:00'},{'Date':'01/02/2000 00:00:00','Value':2.0,'Flag':1}]
+        for chunk_size,result in self.check({'Events':events}):
+            self.assertEqual(result['Events']['Date'],[e['Date'] for e in events])
+            self.assertEqual(list(result['Events']['Value']),[1.0,2.0])
+
+    def test_events_use_bounded_memory(self):
+        import tracemalloc
+        text = encode({'Events':daily_events(20000)})
+        tracemalloc.start()
+        try:
+            result = decode_json_stream(io.BytesIO(text),chunk_size=1024)
+            retained,peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        self.assertEqual(len(result['Events']['Value']),20000)
+        # Beyond the result itself, only a chunk or so of the response is held at once
+        self.assertLess(peak-retained,len(text)//4)
+
+    def test_results_summary(self):
+        results = [{'NetworkElement':'Node %d'%i,'TimeSeriesUrl':'/runs/1/location/Node %d'%i,'Value':float(i)}
+                   for i in range(200)]
+        results[50]['Value'] = float('inf')
+        results[120]['TimeSeries'] = [{'Name':'a','Values':[1.0,2.0]}]
+        doc = {'Name':'Run1','Results':results,'Other':[[1,2],[],{}]}
+        for block_size in [8,64,1<<14]:
+            for chunk_size in [1,7,64,1<<16]:
+                result = decode_json_stream(io.BytesIO(encode(doc)),chunk_size=chunk_size,block_size=block_size)
+                values = result['Results'][120].pop('TimeSeries')[0]['Values']
+                self.assertEqual(values.dtype,np.float64)
+                self.assertEqual(list(values),[1.0,2.0])
+                expected = dict(doc,Results=[dict(r) for r in results])
+                expected['Results'][120].pop('TimeSeries')
+                self.assertEqual(result,expected,(block_size,chunk_size))
+
+    def test_whitespace(self):
+        text = b' { "Results" : [ {"a" : 1} ,\n\t{"b":[ 2 , 3 ]} , INF , "c" ] ,"Values":[ 1 , 2 ] } '
+        for chunk_size in [1,3,1<<16]:
+            result = decode_json_stream(io.BytesIO(text),chunk_size=chunk_size,block_size=4)
+            self.assertEqual(result['Results'],[{'a':1},{'b':[2,3]},float('inf'),'c'])
+            self.assertEqual(list(result['Values']),[1.0,2.0])
+
+    def test_truncated(self):
+        with self.assertRaises(ValueError):
+            decode_json_stream(io.BytesIO(encode({'Events':daily_events(3)})[:-10]))
+
+if __name__=='__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import os
+import sys
+import unittest
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0,os.path.dirname(os.path.abspath(__file__)))
+
+from stub_veneer import daily_events
+from veneer import Veneer
+from veneer.general import _events_to_dataframe
+
+def baseline_dataframe(data_dict):
+    '''
+    DataFrame as built before date parsing and assembly were vectorised
+    '''
+    first = list(data_dict.values())[0]
+    index = [datetime.strptime(e['Date'],'%m/%d/%Y %H:%M:%S') for e in first]
+    data = {k:[e['Value'] for e in result] for k,result in data_dict.items()}
+    return pd.DataFrame(data=data,index=index)
+
+class TestTimeSeriesDataFrame(unittest.TestCase):
+    def setUp(self):
+        self.v = Veneer()
+
+    def test_matches_baseline(self):
+        series = {
+            'ints':daily_events(400,value=lambda i:i),
+            'floats':daily_events(400,value=lambda i:i/2.0),
+            'gaps':daily_events(400,value=lambda i:None if i%7 else float(i)),
+        }
+        df = self.v._create_timeseries_dataframe(series)
+        expected = baseline_dataframe(series)
+        pd.testing.assert_frame_equal(df,expected,check_freq=False,check_frame_type=False)
+        self.assertEqual(df['ints'].dtype,np.int64)
+
+    def test_columnar_and_series_input(self):
+        events = daily_events(10,value=lambda i:i)
+        columnar = {'Date':[e['Date'] for e in events],'Value':np.arange(10)}
+        df = self.v._create_timeseries_dataframe({'a':events,'b':columnar})
+        self.assertEqual(list(df['a']),list(df['b']))
+        self.assertEqual(df['b'].dtype,np.arange(10).dtype)
+
+    def test_irregular_dates(self):
+        events = [e for i,e in enumerate(daily_events(10)) if i!=3]
+        df = self.v._create_timeseries_dataframe({'a':events})
+        self.assertEqual(len(df),9)
+        self.assertEqual(df.index[3],pd.Timestamp(2000,1,5))
+
+    def test_mismatched_lengths(self):
+        with self.assertRaises(ValueError):
+            _events_to_dataframe({'a':daily_events(10),'b':daily_events(9)})
+
+if __name__=='__main__':
+    unittest.main()
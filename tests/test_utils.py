@@ -0,0 +1,263 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0,os.path.dirname(os.path.abspath(__file__)))
+
+import re
+
+import numpy as np
+
+from stub_veneer import DOCUMENTS,StubVeneer,make_network
+from veneer import Veneer
+from veneer.utils import ColumnarList,ResultsIndex,SearchableList,_literal_prefix
+
+FEATURES = [
+    {'type':'Feature','properties':{'feature_type':'node','name':'Inflow'}},
+    {'type':'Feature','properties':{'feature_type':'node','name':'Outlet','icon':'outlet'}},
+    {'type':'Feature','properties':{'feature_type':'link','name':'Reach'}},
+    {'type':'Feature','properties':{'name':'Unknown'}},
+]
+
+class TestGroupBy(unittest.TestCase):
+    def features(self):
+        return SearchableList(FEATURES,['properties'])
+
+    def test_group_by(self):
+        grouped = self.features().group_by('feature_type')
+        self.assertEqual(sorted(grouped['node']._select(['name'])),['Inflow','Outlet'])
+        self.assertEqual(grouped['link']._select(['name']),['Reach'])
+
+    def test_missing_property(self):
+        features = self.features()
+        for key in ['feature_type','icon']:
+            grouped = getattr(features,'group_by_'+key)()
+            # As built from find_by_X for each unique value
+            expected = {v:getattr(features,'find_by_'+key)(v) for v in features._unique_values(key)}
+            self.assertEqual(set(grouped.keys()),set(expected.keys()))
+            for v,entries in expected.items():
+                self.assertEqual(list(grouped[v]),list(entries))
+            self.assertEqual(len(grouped[None]),0)
+
+    def test_explicit_none(self):
+        features = SearchableList(FEATURES+[{'type':'Feature','properties':{'name':'Plain','icon':None}}],['properties'])
+        self.assertEqual(features.group_by('icon')[None]._select(['name']),['Plain'])
+
+    def test_group_by_several_properties(self):
+        grouped = self.features().group_by(['feature_type','icon'])
+        self.assertEqual(set(grouped.keys()),{('node',None),('node','outlet'),('link',None),(None,None)})
+        self.assertEqual(grouped[('node','outlet')]._select(['name']),['Outlet'])
+        self.assertEqual(sum(len(g) for g in grouped.values()),1)
+
+class TestSearchableList(unittest.TestCase):
+    def features(self):
+        return SearchableList(FEATURES,['properties'])
+
+    def test_reversed(self):
+        backwards = reversed(self.features())
+        self.assertIsInstance(backwards,SearchableList)
+        self.assertEqual(len(backwards),len(FEATURES))
+        self.assertEqual(backwards[0],FEATURES[-1])
+        self.assertEqual(list(backwards),FEATURES[::-1])
+        self.assertEqual(backwards.find_by_feature_type('node')._select(['name']),['Outlet','Inflow'])
+
+    def test_less_than(self):
+        # '<' used to be evaluated as '>'
+        entries = SearchableList([{'name':'a','length':1},{'name':'b','length':2},{'name':'c','length':3}])
+        for source in [entries,entries.columnar()]:
+            self.assertEqual(source.find_by_length(2,'<')._select(['name']),['a'])
+            self.assertEqual(source.find_by_length(2,'>')._select(['name']),['c'])
+            self.assertEqual(source.find_one_by_length(3,'<')['name'],'a')
+
+    def test_indexes_invalidated(self):
+        entries = [dict(f) for f in FEATURES]
+        features = SearchableList(entries,['properties'])
+        self.assertEqual(len(features.find_by_feature_type('node')),2)
+        self.assertIn('feature_type',features._indexes)
+
+        entries.append({'type':'Feature','properties':{'feature_type':'node','name':'Added'}})
+        self.assertEqual(features.find_by_feature_type('node')._select(['name']),['Inflow','Outlet','Added'])
+        entries.pop(0)
+        self.assertEqual(features.find_by_feature_type('node')._select(['name']),['Outlet','Added'])
+
+        features._list = [dict(f) for f in FEATURES[2:]]
+        self.assertEqual(features._indexes,{})
+        self.assertEqual(len(features.find_by_feature_type('node')),0)
+        self.assertEqual(features.find_by_feature_type('link')._select(['name']),['Reach'])
+
+        # Same length: Needs an explicit reset
+        features._list[0]['properties'] = {'feature_type':'node','name':'Changed'}
+        features._reset_indexes()
+        self.assertEqual(features.find_by_feature_type('node')._select(['name']),['Changed'])
+
+class TestColumnarList(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        documents = dict(DOCUMENTS)
+        documents['/network'] = make_network()
+        with StubVeneer(documents=documents) as stub:
+            cls.network = Veneer(port=stub.port).network()
+
+    def setUp(self):
+        self.rows = self.network['features']
+        self.columns = self.rows.columnar()
+
+    def assertSameEntries(self,columnar,rows):
+        self.assertIsInstance(columnar,ColumnarList)
+        self.assertEqual(len(columnar),len(rows))
+        self.assertEqual([id(e) for e in columnar],[id(e) for e in rows])
+
+    def test_filters_match_rows(self):
+        filters = [
+            ('type','Point','='),('type','Feature','='),('type','Polygon','!='),('feature_type','link','='),
+            ('name','Node 1','='),('name','Reach','STARTS'),('name',' 3','ENDS'),('icon','Outlet','LIKE'),
+            ('length',2000,'>'),('length',2000,'<='),('length',2000.0,'='),('areaInSquareMeters',None,'='),
+            ('areaInSquareMeters',1e6,'!='),('id','/network/nodes/0','='),('coordinates',[0.0,0.0],'='),
+            ('missing','x','='),('missing','x','!=')
+        ]
+        for key,val,op in filters:
+            with self.subTest(key=key,val=val,op=op):
+                self.assertSameEntries(self.columns._filter(key,val,op),self.rows._filter(key,val,op))
+
+    def test_find_by(self):
+        self.assertEqual(len(self.rows.find_by_type('Point')),5)
+        self.assertSameEntries(self.columns.find_by_type('Point'),self.rows.find_by_type('Point'))
+        self.assertSameEntries(self.columns.find_by_type('LineString'),self.rows.find_by_type('LineString'))
+
+    def test_chained_filters_match_rows(self):
+        columnar = self.columns.find_by_feature_type('link').find_by_length(1000,'>').find_by_type('LineString')
+        rows = self.rows.find_by_feature_type('link').find_by_length(1000,'>').find_by_type('LineString')
+        self.assertSameEntries(columnar,rows)
+
+    def test_values_match_rows(self):
+        for key in ['type','name','length','areaInSquareMeters','coordinates','missing','properties']:
+            with self.subTest(key=key):
+                self.assertEqual(self.columns._all_values(key),self.rows._all_values(key))
+        links = self.columns.find_by_feature_type('link')
+        self.assertEqual(links._all_values('length'),[1000,2000,3000,4000])
+        self.assertTrue(all(type(v)==int for v in links._all_values('length')))
+        self.assertEqual(self.columns._unique_values('type'),self.rows._unique_values('type'))
+
+    def test_select_matches_rows(self):
+        keys = ['name','length','type']
+        self.assertEqual(list(self.columns._select(keys)),list(self.rows._select(keys)))
+
+    def test_as_dataframe(self):
+        df = self.columns.find_by_feature_type('link').as_dataframe()
+        self.assertEqual(list(df['geometry.type']),['LineString']*4)
+        self.assertEqual(list(df['type']),['Feature']*4)
+        self.assertEqual(df['length'].dtype,np.int64)
+
+def results(elements):
+    return [{'NetworkElement':e,'RecordingVariable':v} for e in elements for v in ['Flow','Storage Volume']]
+
+class TestQuery(unittest.TestCase):
+    OPS = {'=':lambda a,b:a==b,'!=':lambda a,b:a!=b,'>':lambda a,b:a>b,'>=':lambda a,b:a>=b,
+           '<':lambda a,b:a<b,'<=':lambda a,b:a<=b,'LIKE':lambda a,b:b in a,
+           'STARTS':lambda a,b:a.startswith(b),'ENDS':lambda a,b:a.endswith(b)}
+
+    def lists(self):
+        rows = SearchableList(make_network()['features'],['properties'])
+        return [rows,rows.columnar()]
+
+    def names(self,entries):
+        return [e['properties']['name'] for e in entries]
+
+    def test_each_op(self):
+        for entries in self.lists():
+            for key,value in [('length',2000),('name','Reach 1'),('name','Reach')]:
+                for op,fn in self.OPS.items():
+                    if isinstance(value,int) and op in ('LIKE','STARTS','ENDS'):
+                        continue
+                    if value=='Reach' and not op in ('LIKE','STARTS','ENDS'):
+                        continue
+                    expected = [e for e in entries if key in e['properties'] and fn(e['properties'][key],value)]
+                    with self.subTest(type=type(entries).__name__,key=key,op=op):
+                        self.assertEqual(self.names(entries.where(key,value,op)),self.names(expected))
+
+    def test_chaining(self):
+        for entries in self.lists():
+            links = entries.where(feature_type='link')
+            long_links = links.where('length',2000,'>')
+            self.assertEqual(self.names(links),['Reach 0','Reach 1','Reach 2','Reach 3'])
+            self.assertEqual(self.names(long_links),['Reach 2','Reach 3'])
+            self.assertEqual(self.names(long_links.where(to_node='/network/nodes/4')),['Reach 3'])
+            self.assertEqual(self.names(long_links.where('name','1','ENDS')),[])
+            self.assertEqual(self.names(links.where('name','Reach 1').where(feature_type='link')),['Reach 1'])
+            self.assertEqual(long_links.first()['properties']['name'],'Reach 2')
+            self.assertIsNone(long_links.where(feature_type='node').first())
+            self.assertEqual(long_links.select(['name']),['Reach 2','Reach 3'])
+
+    def test_keywords_are_properties(self):
+        entries = SearchableList([{'key':'a','value':1,'op':'<'},{'key':'b','value':2,'op':'='}])
+        for source in [entries,entries.columnar()]:
+            self.assertEqual(list(source.where(key='b')),[entries[1]])
+            self.assertEqual(list(source.where(value=1)),[entries[0]])
+            self.assertEqual(list(source.where(op='<')),[entries[0]])
+            self.assertEqual(list(source.where('value',1,'>')),[entries[1]])
+            with self.assertRaises(TypeError):
+                source.where('value')
+
+    def test_equality_uses_index(self):
+        rows = self.lists()[0]
+        self.assertEqual(len(rows.where('length',2000,'>')),2)
+        self.assertEqual(rows._indexes,{})
+        self.assertEqual(len(rows.where(feature_type='link').where('length',2000,'>')),2)
+        self.assertEqual(set(rows._indexes),{'feature_type'})
+        # Entries are only checked against the remaining conditions: Modified in place, the index is out of date
+        rows[0]['properties']['feature_type'] = 'link'
+        self.assertEqual(len(rows.where(feature_type='link')),4)
+        rows._reset_indexes()
+        self.assertEqual(len(rows.where(feature_type='link')),5)
+
+class TestResultsIndex(unittest.TestCase):
+    def setUp(self):
+        self.index = ResultsIndex(results(['Gauge 1','Gauge 2','Gauge 10','Outlet','Storage 1']))
+
+    def elements(self,criteria):
+        return [r['NetworkElement'] for r in self.index.matching(criteria)]
+
+    def test_literal_prefix(self):
+        self.assertEqual(_literal_prefix('Outlet'),('Outlet',True))
+        self.assertEqual(_literal_prefix('^Gauge .*'),('Gauge ',False))
+        self.assertEqual(_literal_prefix('Gauges?'),('Gauge',False))
+        self.assertEqual(_literal_prefix('A|B'),('',False))
+        self.assertEqual(_literal_prefix(re.compile('Gauge')),('',False))
+
+    def test_literal(self):
+        # As with re.match, literals match the start of the value
+        self.assertEqual(self.elements({'NetworkElement':'Gauge 1'}),['Gauge 1','Gauge 1','Gauge 10','Gauge 10'])
+        self.assertEqual(self.elements({'NetworkElement':'Outlet','RecordingVariable':'Flow'}),['Outlet'])
+        self.assertEqual(self.elements({'NetworkElement':'Nowhere'}),[])
+
+    def test_pattern(self):
+        self.assertEqual(self.elements({'NetworkElement':'Gauge \\d$','RecordingVariable':'Storage'}),['Gauge 1','Gauge 2'])
+        self.assertEqual(self.elements({'NetworkElement':'.*1','RecordingVariable':'F'}),['Gauge 1','Gauge 10','Storage 1'])
+        self.assertEqual(self.elements({'NetworkElement':'Outlet|Storage','RecordingVariable':'Flow'}),['Outlet','Storage 1'])
+
+    def test_compiled_pattern(self):
+        pattern = re.compile('gauge \\d$',re.IGNORECASE)
+        self.assertEqual(self.elements({'NetworkElement':pattern,'RecordingVariable':'Flow'}),['Gauge 1','Gauge 2'])
+        expected = [r for r in self.index if re.match(pattern,r['NetworkElement'])]
+        self.assertEqual(self.index.matching({'NetworkElement':pattern}),expected)
+
+    def test_matches_scan(self):
+        for pattern in ['Gauge','G.*0','Storage 1','.*','[GO]','Gauge (1|2)$']:
+            expected = [r for r in self.index if re.match(pattern,r['NetworkElement'])]
+            self.assertEqual(self.index.matching({'NetworkElement':pattern}),expected)
+
+    def test_invalidated_when_list_changes(self):
+        self.assertEqual(self.elements({'NetworkElement':'Outlet','RecordingVariable':'Flow'}),['Outlet'])
+        self.index._list.append({'NetworkElement':'Outlet','RecordingVariable':'Flow Rate'})
+        self.assertEqual(len(self.elements({'NetworkElement':'Outlet','RecordingVariable':'Flow'})),2)
+
+        self.index._list = results(['Outlet'])
+        self.assertEqual(len(self.elements({'NetworkElement':'Outlet','RecordingVariable':'Flow'})),1)
+        self.assertEqual(self.elements({'NetworkElement':'Gauge'}),[])
+
+        self.index[0]['NetworkElement'] = 'Inlet'
+        self.index._reset_indexes()
+        self.assertEqual(self.elements({'NetworkElement':'Inlet'}),['Inlet'])
+
+if __name__=='__main__':
+    unittest.main()
@@ -0,0 +1,361 @@
+'''
+Asyncio client for Veneer.
+
+AsyncVeneer mirrors the main methods of veneer.Veneer as coroutines, over a pool of keep-alive connections
+managed by the event loop. A single event loop can then drive many Source instances, and many requests to each,
+at once.
+
+Requires Python 3.5+.
+
+Example:
+
+import asyncio
+from veneer.aio import AsyncVeneer
+
+async def run_all(ports):
+    clients = [AsyncVeneer(port=p) for p in ports]
+    await asyncio.gather(*[v.run_model(start='01/01/2000',end='31/12/2000') for v in clients])
+    results = await asyncio.gather(*[v.retrieve_multiple_time_series(criteria={'RecordingVariable':'Downstream Flow Volume'})
+                                     for v in clients])
+    for v in clients:
+        v.close()
+    return results
+
+results = asyncio.get_event_loop().run_until_complete(run_all([9876,9877,9878]))
+'''
+try:
+    from urllib2 import quote
+except:
+    from urllib.request import quote
+
+import asyncio
+import json
+import time
+import weakref
+
+from .general import name_element_variable,to_source_date,_decode_json,_assemble_time_series
+from . import general
+from .connection import IDEMPOTENT_METHODS
+from .utils import SearchableList,ResultsIndex,objdict
+from . import extensions
+
+class AsyncConnectionPool(object):
+    '''
+    A pool of persistent (keep-alive) HTTP/1.1 connections to a single Veneer server, for use from asyncio.
+
+    Parameters are as for veneer.connection.ConnectionPool. Requests beyond size wait (without blocking the
+    event loop) for a connection to be returned to the pool.
+
+    Connections belong to the event loop that opened them, so the pool keeps separate connections (and a separate
+    limit of size requests) for each event loop that uses it.
+    '''
+    def __init__(self,host,port,size=4,idle_timeout=30.0,reconnect=True):
+        self.host = host
+        self.port = port
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.reconnect = reconnect
+        self._loops = weakref.WeakKeyDictionary()
+
+    async def _connect(self):
+        return await asyncio.open_connection(self.host,self.port)
+
+    def _for_loop(self):
+        '''
+        Return the (semaphore,idle connections) for the current event loop, creating them on first use
+        '''
+        loop = asyncio.get_event_loop()
+        state = self._loops.get(loop)
+        if state is None:
+            state = (asyncio.Semaphore(self.size),[])
+            self._loops[loop] = state
+        return state
+
+    def _take_idle(self,idle):
+        now = time.time()
+        while len(idle):
+            reader,writer,last_used = idle.pop()
+            if (now-last_used)<self.idle_timeout and not reader.at_eof():
+                return reader,writer
+            writer.close()
+        return None
+
+    def clear(self):
+        '''
+        Close all idle connections
+        '''
+        for loop,(_,idle) in list(self._loops.items()):
+            while len(idle):
+                writer = idle.pop()[1]
+                if not loop.is_closed():
+                    writer.close()
+
+    async def _send(self,reader,writer,method,url,body,headers):
+        lines = ['%s %s HTTP/1.1'%(method,url),'Host: %s:%d'%(self.host,self.port)]
+        lines += ['%s: %s'%(k,v) for k,v in headers.items()]
+        if body is not None or method in ['POST','PUT']:
+            lines.append('Content-Length: %d'%len(body or b''))
+        writer.write(('\r\n'.join(lines)+'\r\n\r\n').encode('latin-1'))
+        if body:
+            writer.write(body)
+        await writer.drain()
+
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionResetError('Connection closed by server')
+        version,code = status_line.decode('latin-1').split(' ',2)[:2]
+        code = int(code)
+
+        resp_headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n',b'\n',b''):
+                break
+            key,val = line.decode('latin-1').split(':',1)
+            resp_headers[key.strip().lower()] = val.strip()
+
+        keep_alive = version=='HTTP/1.1' and resp_headers.get('connection','').lower()!='close'
+        if 'chunked' in resp_headers.get('transfer-encoding','').lower():
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b';')[0].strip(),16)
+                if size==0:
+                    # Trailers, up to a blank line
+                    while (await reader.readline()) not in (b'\r\n',b'\n',b''):
+                        pass
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            resp_body = b''.join(chunks)
+        elif 'content-length' in resp_headers:
+            resp_body = await reader.readexactly(int(resp_headers['content-length']))
+        elif code in (204,304) or method=='HEAD':
+            resp_body = b''
+        else:
+            resp_body = await reader.read()
+            keep_alive = False
+        return code,resp_headers,resp_body,keep_alive
+
+    async def request(self,method,url,body=None,headers={}):
+        '''
+        Make a request on a pooled connection.
+
+        Returns a tuple of (status code, response headers (with lower case names), response body as bytes)
+        '''
+        slots,idle = self._for_loop()
+        if isinstance(body,str):
+            body = body.encode('utf-8')
+
+        async with slots:
+            conn = self._take_idle(idle)
+            reused = conn is not None
+            if not reused:
+                conn = await self._connect()
+            try:
+                code,resp_headers,resp_body,keep_alive = await self._send(conn[0],conn[1],method,url,body,headers)
+            except (ConnectionError,asyncio.IncompleteReadError):
+                conn[1].close()
+                if not (reused and self.reconnect and method in IDEMPOTENT_METHODS):
+                    raise
+                # Server closed an idle connection: Try once more on a fresh connection
+                conn = await self._connect()
+                try:
+                    code,resp_headers,resp_body,keep_alive = await self._send(conn[0],conn[1],method,url,body,headers)
+                except:
+                    conn[1].close()
+                    raise
+            except:
+                conn[1].close()
+                raise
+
+            if keep_alive:
+                idle.append((conn[0],conn[1],time.time()))
+            else:
+                conn[1].close()
+            return code,resp_headers,resp_body
+
+class AsyncVeneer(object):
+    '''
+    Asyncio client for the Veneer web service within eWater Source.
+
+    Mirrors the main methods of veneer.Veneer (eg run_model, retrieve_run, retrieve_multiple_time_series, network,
+    run_server_side_script, update_json) as coroutines. Use asyncio.gather to run many requests, or to work with
+    many Source instances, concurrently.
+    '''
+    def __init__(self,port=9876,host='localhost',prefix='',pool_size=8,idle_timeout=30.0,reconnect=True):
+        '''
+        Instantiate a new asyncio Veneer client.
+
+        port, host: Connection information for running Veneer service (default 9876, localhost)
+
+        prefix: path prefix for all queries. Useful if Veneer is running behind some kind of proxy
+
+        pool_size: Maximum number of requests in flight to the Veneer service at once (each on its own
+                   keep-alive connection). Default: 8
+
+        idle_timeout, reconnect: See veneer.Veneer
+        '''
+        self.port = port
+        self.host = host
+        self.prefix = prefix
+        self._pool = AsyncConnectionPool(host,port,size=pool_size,idle_timeout=idle_timeout,reconnect=reconnect)
+
+    def close(self):
+        '''
+        Close any idle connections to the Veneer service
+        '''
+        self._pool.clear()
+
+    async def retrieve_json(self,url):
+        '''
+        Retrieve data from the Veneer service at the given url path.
+
+        url: Path to required resource, relative to the root of the Veneer service.
+        '''
+        query_url = self.prefix+url
+        if general.PRINT_URLS:
+            print("*** %s - %s ***" % (url, query_url))
+        code,_,body = await self._pool.request('GET',quote(query_url))
+        if code!=200:
+            raise Exception('Error retrieving %s: HTTP %d\n%s'%(url,code,body[:100].decode('utf-8','replace')))
+        return _decode_json(url,body)
+
+    async def send(self,url,method,payload=None,headers={}):
+        code,resp_headers,body = await self._pool.request(method,url,payload,headers=headers)
+        if code==302:
+            return code,resp_headers.get('location')
+        elif code==200:
+            resp_body = body.decode('utf-8')
+            return code,(json.loads(resp_body) if len(resp_body) else None)
+        else:
+            return code,body.decode('utf-8')
+
+    async def send_json(self,url,data,method):
+        payload = json.dumps(data)
+        headers={'Content-type':'application/json','Accept':'application/json'}
+        return await self.send(url,method,payload,headers)
+
+    async def post_json(self,url,data=None):
+        return await self.send_json(url,data,'POST')
+
+    async def update_json(self,url,data):
+        '''
+        Issue a PUT request to the Veneer service to update the data held at url. See Veneer.update_json
+        '''
+        return await self.send_json(url,data,'PUT')
+
+    async def status(self):
+        return await self.retrieve_json('/')
+
+    async def run_server_side_script(self,script):
+        '''
+        Run an IronPython script within Source. See Veneer.run_server_side_script
+        '''
+        if general.PRINT_SCRIPTS: print(script)
+        code,data = await self.post_json('/ironpython',{'Script':script})
+        if code == 403:
+            raise Exception('Script disabled. Enable scripting in Veneer')
+        return data
+
+    async def run_model(self,params=None,start=None,end=None,name=None,**kwargs):
+        '''
+        Trigger a run of the Source model and wait (without blocking the event loop) for it to finish.
+
+        Parameters are as for Veneer.run_model. Returns (code,url of the results set). To run several
+        models at once, gather run_model coroutines from several clients.
+        '''
+        if params is None:
+            params = {}
+
+        params.update(kwargs)
+
+        if not start is None:
+            params['StartDate'] = to_source_date(start)
+        if not end is None:
+            params['EndDate'] = to_source_date(end)
+
+        if not name is None:
+            params['_RunName'] = name
+
+        payload = json.dumps(params)
+        headers = {'Content-type':'application/json','Accept':'application/json'}
+        code,resp_headers,body = await self._pool.request('POST','/runs',payload,headers=headers)
+        if code==302:
+            return code,resp_headers.get('location')
+        elif code==200:
+            return code,None
+        elif code==500:
+            error = json.loads(body.decode('utf-8'))
+            raise Exception('\n'.join([error['Message'],error['StackTrace']]))
+        else:
+            return code,body.decode('utf-8')
+
+    async def drop_run(self,run='latest'):
+        '''
+        Tell Source to drop/delete a specific set of results from memory. See Veneer.drop_run
+        '''
+        code,_,_ = await self._pool.request('DELETE','/runs/%s'%str(run))
+        return code
+
+    async def retrieve_runs(self):
+        '''
+        Retrieve the list of available runs.
+        '''
+        return await self.retrieve_json('/runs')
+
+    async def retrieve_run(self,run='latest'):
+        '''
+        Retrieve a results summary for a particular run. See Veneer.retrieve_run
+        '''
+        run = str(run).split('/')[-1]
+        result = await self.retrieve_json('/runs/%s'%run)
+        result['Results'] = ResultsIndex(result['Results'])
+        return result
+
+    async def retrieve_multiple_time_series(self,run='latest',run_data=None,criteria={},timestep='daily',
+                                            name_fn=name_element_variable):
+        '''
+        Retrieve multiple time series from a run according to some criteria.
+
+        Return all time series in a single Pandas DataFrame with date time index. See Veneer.retrieve_multiple_time_series
+
+        All matching time series are requested at once, up to the pool_size of the client.
+        '''
+        if timestep=="daily":
+            suffix = ""
+        else:
+            suffix = "/aggregated/%s"%timestep
+
+        if run_data is None:
+            run_data = await self.retrieve_run(run)
+
+        matching = ResultsIndex._of(run_data['Results']).matching(criteria)
+        responses = await asyncio.gather(*[self.retrieve_json(result['TimeSeriesUrl']+suffix) for result in matching])
+        return _assemble_time_series(matching,responses,name_fn)
+
+    async def network(self):
+        '''
+        Retrieve the network from Veneer. See Veneer.network
+        '''
+        result = objdict(await self.retrieve_json('/network'))
+        result['features'] = SearchableList(result['features'],['geometry','properties'])
+        extensions.add_network_methods(result)
+        return result
+
+    async def functions(self):
+        '''
+        Return a SearchableList of the functions in the Source model.
+        '''
+        return SearchableList(await self.retrieve_json('/functions'))
+
+    async def variables(self):
+        '''
+        Return a SearchableList of the function variables in the Source model
+        '''
+        return SearchableList(await self.retrieve_json('/variables'))
+
+    async def input_sets(self):
+        '''
+        Return a SearchableList of the input sets in the Source model
+        '''
+        return SearchableList(await self.retrieve_json('/inputSets'))
@@ -1,4 +1,4 @@
-
+from concurrent.futures import wait, FIRST_COMPLETED
 from .utils import DeferredActionCollection
 
 class BatchRunner(object):
@@ -16,7 +16,7 @@ class BatchRunner(object):
   def _run_single(self,parameter_set,endpoint,**kwargs):
     self.parameters.eval_script(parameter_set,{'v':endpoint})
     endpoint.drop_all_runs()
-    ticket = endpoint.run_model(async=True,**kwargs)
+    ticket = endpoint.run_model(future=True,**kwargs)
     return (ticket,endpoint)
 
   def retrieve(self,var_name='y'):
@@ -24,12 +24,25 @@ class BatchRunner(object):
     return self._retrieval
 
   def _retrieve(self,ticket,endpoint):
-    resp = ticket.getresponse()
+    ticket.result()
     results = {}
     self._retrieval.eval_script({},{'v':endpoint,'results':results})
     return results
 
   def run(self,parameter_sets,**kwargs):
+    '''
+    Run the model for each row of parameter_sets (a DataFrame), spread across the endpoints.
+
+    Returns (jobs,results):
+
+    jobs: List of (index,row,ticket,endpoint) for each parameter set. ticket is the Future returned by
+          run_model(future=True) for a run still in progress, None once results have been retrieved, or the
+          exception raised if the run (or retrieving its results) failed.
+
+    results: List of results (see retrieve) for each parameter set, or None where the run failed.
+
+    A failed run is reported and doesn't stop the rest of the batch.
+    '''
     if not len(self.endpoints):
       raise Exception('No model runners available')
 
@@ -37,28 +50,36 @@ class BatchRunner(object):
 
     available_endpoints = self.endpoints[:]
     jobs = []
+    pending = {}
     results = [None]*len(parameter_sets)
 
+    def harvest(finished):
+      for ticket in finished:
+        i = pending.pop(ticket)
+        jx,row,_,endpoint = jobs[i]
+        available_endpoints.append(endpoint)
+        try:
+          results[i] = self._retrieve(ticket,endpoint)
+        except Exception as e:
+          print('Run %s failed: %s'%(str(jx),str(e)))
+          jobs[i] = (jx,row,e,endpoint)
+          continue
+        jobs[i] = (jx,row,None,endpoint)
+
     for ix,row in parameter_sets.iterrows():
       print(ix,row)
       if len(available_endpoints)==0:
-        # Wait for something to be finished
-        for i,(jx,row,ticket,endpoint) in enumerate(jobs):
-          if not ticket:
-            continue
-          results[i] = self._retrieve(ticket,endpoint)
-          # print(ix,row,results[i])
-          # print('Recycling %d',endpoint.port)
-          available_endpoints.append(endpoint)
-          jobs[i] = (jx,row,None,endpoint)
-          break
+        # Wait for any run to finish
+        finished,_ = wait(list(pending),return_when=FIRST_COMPLETED)
+        harvest(finished)
 
       endpoint_to_use = available_endpoints.pop()
 
       ticket,endpoint = self._run_single(row,endpoint_to_use,**kwargs)
+      pending[ticket] = len(jobs)
       jobs.append((ix,row,ticket,endpoint))
 
-    for i,(jx,row,ticket,endpoint) in enumerate(jobs):
-      if not ticket: continue
-      results[i] = self._retrieve(ticket,endpoint)
+    while len(pending):
+      finished,_ = wait(list(pending),return_when=FIRST_COMPLETED)
+      harvest(finished)
     return jobs,results
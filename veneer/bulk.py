@@ -1,25 +1,155 @@
 
 try:
-    from urllib2 import urlopen, quote
+    from urllib2 import quote
 except:
-    from urllib.request import urlopen, quote, Request
+    from urllib.request import quote
+import fnmatch
+import hashlib
 import json
+import numpy as np
 import shutil
 import os
-from glob import glob
+import re
+import threading
+import time
+import warnings
+import zipfile
+
+MANIFEST='.veneer-manifest.jsonl'
+
+VENEER_DATE_FORMAT='%m/%d/%Y %H:%M:%S'
+AGGREGATE_PERIODS={'monthly':('M','Monthly'),'annual':('Y','Annual')}
+
+def _format_dates(dates):
+    return [d.strftime(VENEER_DATE_FORMAT) for d in dates.astype('datetime64[s]').tolist()]
+
+def _parse_dates(dates):
+    '''
+    Parse Veneer date strings (mm/dd/yyyy hh:mm:ss) to an array of datetime64[D]
+    '''
+    n = len(dates)
+    start = _parse_dates_slow(dates[:1])[0]
+    if n>1 and _parse_dates_slow(dates[-1:])[0]==start+np.timedelta64(n-1,'D'):
+        # Regular daily series: No need to parse every date
+        return start + np.arange(n)
+    return _parse_dates_slow(dates)
+
+def _parse_dates_slow(dates):
+    return np.array(['%s-%s-%s'%(d[6:10],d[0:2],d[3:5]) for d in dates],dtype='datetime64[D]')
+
+def _aggregate_values(dates,values,timestep):
+    '''
+    Sum daily values to each month or year. Returns the end date of each period and the totals.
+    '''
+    periods = dates.astype('datetime64[%s]'%AGGREGATE_PERIODS[timestep][0])
+    starts = np.concatenate([[0],np.flatnonzero(periods[1:]!=periods[:-1])+1])
+    ends = (periods[starts]+1).astype('datetime64[D]')-1
+    return ends,np.add.reduceat(values,starts)
+
+def aggregate_time_series(ts,timestep):
+    '''
+    Aggregate a daily time series, as retrieved from Veneer, to monthly or annual totals.
+
+    Follows the Veneer plugin (the /aggregated/monthly and /aggregated/annual urls), which ALWAYS SUMS values,
+    regardless of units. Each aggregated value is dated at the end of its month or year, which is how slim monthly
+    and annual time series are read (see Veneer.retrieve_multiple_time_series).
+
+    ts: Time series as retrieved from Veneer, with either Events (list of Date and Value) or Values (slim format).
+        Slim time series must be daily. A response with several time series (under TimeSeries) is aggregated
+        series by series.
+
+    timestep: 'monthly' or 'annual'
+
+    Returns a copy of ts with aggregated values, and updated dates, TimeStep and summary statistics
+    '''
+    if 'TimeSeries' in ts and isinstance(ts['TimeSeries'],list):
+        result = dict(ts)
+        result['TimeSeries'] = [aggregate_time_series(t,timestep) for t in ts['TimeSeries']]
+        return result
+
+    result = dict(ts)
+    if 'Values' in ts:
+        if ts.get('TimeStep','Daily')!='Daily':
+            raise Exception('Cannot aggregate %s time series (%s). Expected daily values'%(
+                ts['TimeStep'],ts.get('Name',ts.get('TimeSeriesName',''))))
+        if not len(ts['Values']):
+            return result
+        values = np.asarray(ts['Values'],dtype=np.float64)
+        start = _parse_dates([ts['StartDate']])[0]
+        periods,totals = _aggregate_values(start+np.arange(len(values)),values,timestep)
+        result['Values'] = totals.tolist()
+    else:
+        events = ts['Events']
+        if not len(events):
+            return result
+        dates = _parse_dates([e['Date'] for e in events])
+        values = np.array([e['Value'] for e in events],dtype=np.float64)
+        periods,totals = _aggregate_values(dates,values,timestep)
+        result['Events'] = [{'Date':d,'Value':v} for d,v in zip(_format_dates(periods),totals.tolist())]
+
+    if len(totals):
+        result['StartDate'],result['EndDate'] = _format_dates(periods[[0,-1]])
+        for key,fn in [('Min',np.min),('Max',np.max),('Mean',np.mean),('Sum',np.sum)]:
+            if key in result:
+                result[key] = float(fn(totals))
+    result['TimeStep'] = AGGREGATE_PERIODS[timestep][1]
+    return result
+
+class _ZipWriter(object):
+    '''
+    Write entries to a new zip file from several threads.
+
+    ZipFile can't write more than one entry at a time, so each entry is written, with ZipFile.writestr, under a lock.
+    '''
+    def __init__(self,fn):
+        self.zip = zipfile.ZipFile(fn,'w',zipfile.ZIP_DEFLATED)
+        self._lock = threading.Lock()
+
+    def write(self,name,data):
+        info = zipfile.ZipInfo(name,time.localtime(time.time())[:6])
+        info.compress_type = zipfile.ZIP_DEFLATED
+        info.external_attr = 0o600 << 16
+        with self._lock:
+            self.zip.writestr(info,data)
+
+    def close(self):
+        self.zip.close()
 
 class VeneerRetriever(object):
     '''
     Retrieve all information from a Veneer web service and write it out to disk in the same path structure.
 
     Typically used for creating/archiving static dashboards from an existing Veneer web application.
+
+    Time series, variable details and icons can be downloaded (and written to disk) in parallel, using
+    max_workers threads, over a shared pool of keep-alive connections.
+
+    Each file written is recorded, with its size and SHA1 hash, in a manifest in the destination directory.
+    This allows an interrupted or out of date archive to be brought up to date with retrieve_all(resume=True).
+
+    include and exclude are lists of rules (see SeriesRules) on NetworkElement, RecordingElement and
+    RecordingVariable. Time series are only retrieved if they match an include rule (when include is given)
+    and don't match any exclude rule. For example:
+
+    VeneerRetriever(dest,include=[{'RecordingVariable':'*Flow*'}],exclude=[{'NetworkElement':re.compile('^Gauge')}])
+
+    retrieve_daily_for can use the same patterns.
+
+    With derive_aggregates=True, monthly and annual time series are computed from the daily time series
+    (see aggregate_time_series), rather than being retrieved separately, and are written to the same paths.
+    This avoids two of the three requests for each time series. (Applies to JSON, not CSV)
+
+    If destination ends with .zip, everything is written, compressed, to a single zip file rather than to a
+    directory of files. The zip file can be read with Veneer(protocol='file',live=False,prefix=destination)
+    and pruned with PruneVeneer.
     '''
     def __init__(self,destination,port=9876,host='localhost',protocol='http',
                  retrieve_daily=True,retrieve_monthly=True,retrieve_annual=True,
                  retrieve_slim_ts=True,retrieve_single_ts=True,
                  retrieve_single_runs=True,retrieve_daily_for=[],
                  retrieve_ts_json=True,retrieve_ts_csv=False,
-                 print_all = False, print_urls = False):
+                 print_all = False, print_urls = False, max_workers=1,
+                 derive_aggregates=False,include=None,exclude=[]):
         from .general import Veneer,log
         self.destination = destination
         self.port = port
@@ -32,39 +162,216 @@ class VeneerRetriever(object):
         self.retrieve_single_ts = retrieve_single_ts
         self.retrieve_single_runs = retrieve_single_runs
         self.retrieve_daily_for = retrieve_daily_for
+        self._daily_rules = SeriesRules(retrieve_daily_for)
+        self._series_keys = {}
+        self.include = None if include is None else SeriesRules(include)
+        self.exclude = SeriesRules(exclude)
         self.retrieve_ts_json=retrieve_ts_json
         self.retrieve_ts_csv=retrieve_ts_csv
         self.print_all = print_all
         self.print_urls = print_urls
+        self.max_workers = max_workers
+        self.derive_aggregates = derive_aggregates
         self.base_url = "%s://%s:%d" % (protocol,host,port)
-        self._veneer = Veneer(host=self.host,port=self.port,protocol=self.protocol)
+        self._veneer = Veneer(host=self.host,port=self.port,protocol=self.protocol,pool_size=max(4,max_workers))
         self.log = log
+        self._executor = None
+        self._pending = []
+        self._stats_lock = threading.Lock()
+        self._manifest = {}
+        self._manifest_file = None
+        self._prune = []
+        self._prune_rules = []
+        self._verify = False
+        self._zip = None
+        self._reset_stats()
+
+    def _reset_stats(self):
+        self.requests = 0
+        self.bytes_retrieved = 0
+        self.skipped = 0
+
+    def _load_manifest(self):
+        '''
+        Read the manifest of previously written files. Later entries replace earlier ones.
+
+        Also reads the rules applied by PruneVeneer, so that pruned time series aren't retrieved again.
+        '''
+        self._manifest = {}
+        self._set_prune_rules([])
+        fn = os.path.join(self.destination,MANIFEST)
+        if not os.path.exists(fn):
+            return
+        prune = []
+        with open(fn,'r') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Incomplete entry, from an interrupted archive
+                    continue
+                if 'prune' in entry:
+                    prune.append(entry['prune'])
+                elif entry.get('removed'):
+                    self._manifest.pop(entry['file'],None)
+                else:
+                    self._manifest[entry['file']] = entry
+        self._set_prune_rules(prune)
+
+    def _set_prune_rules(self,prune):
+        self._prune = prune
+        self._prune_rules = [(SeriesRules([_decode_rule(p['rule'])]),p) for p in prune]
+
+    def _pruned(self,ts_url):
+        '''
+        Return a tuple of (daily,aggregate,deindex): whether the daily and aggregated files for a time series
+        have been removed by PruneVeneer, and whether it has been removed from its run summary
+        '''
+        daily = aggregate = deindex = False
+        if not len(self._prune_rules):
+            return daily,aggregate,deindex
+        key = self._series_key(ts_url)
+        for rules,opt in self._prune_rules:
+            if rules.matches(key):
+                daily = daily or opt['daily']
+                aggregate = aggregate or opt['aggregate']
+                deindex = deindex or (opt['daily'] and opt['aggregate'])
+        return daily,aggregate,deindex
+
+    def _open_manifest(self):
+        '''
+        Rewrite the manifest with the current entries and open it for appending
+        '''
+        if self._zip is not None:
+            # Zip file has its own index
+            return
+        fn = os.path.join(self.destination,MANIFEST)
+        with open(fn,'w') as f:
+            for prune in self._prune:
+                f.write(json.dumps({'prune':prune})+'\n')
+            for entry in self._manifest.values():
+                f.write(json.dumps(entry)+'\n')
+        self._manifest_file = open(fn,'a')
+
+    def _close_manifest(self):
+        if self._manifest_file is not None:
+            self._manifest_file.close()
+            self._manifest_file = None
+
+    def _write_manifest(self,entry):
+        # Called with _stats_lock held
+        if self._manifest_file is not None:
+            self._manifest_file.write(json.dumps(entry)+'\n')
+            self._manifest_file.flush()
+
+    def _record(self,path,data):
+        entry = {'file':path,'size':len(data),'sha1':hashlib.sha1(data).hexdigest()}
+        with self._stats_lock:
+            self._manifest[path] = entry
+            self._write_manifest(entry)
+
+    def _invalidate(self,prefix):
+        '''
+        Remove manifest entries for files under prefix, so that they will be retrieved again
+        '''
+        with self._stats_lock:
+            for path in [p for p in self._manifest if p.startswith(prefix)]:
+                del self._manifest[path]
+                self._write_manifest({'file':path,'removed':True})
+
+    def _is_complete(self,path):
+        '''
+        Has path been written, in full, according to the manifest?
+        '''
+        entry = self._manifest.get(path)
+        if entry is None:
+            return False
+        fn = os.path.join(self.destination,path)
+        if not os.path.exists(fn) or os.path.getsize(fn)!=entry['size']:
+            return False
+        if self._verify:
+            with open(fn,'rb') as f:
+                return hashlib.sha1(f.read()).hexdigest()==entry['sha1']
+        return True
+
+    def _request(self,url,headers={}):
+        '''
+        Retrieve url over the shared connection pool. Returns the response body (bytes) or raises an Exception.
+        '''
+        resp,body = self._veneer._pool.request('GET',quote(url),headers=headers)
+        code = resp.getcode()
+        if code!=200:
+            raise Exception('HTTP %d'%code)
+        with self._stats_lock:
+            self.requests += 1
+            self.bytes_retrieved += len(body)
+        return body
+
+    def _submit(self,fn,*args):
+        '''
+        Run fn(*args) in the worker pool, if there is one, or immediately
+        '''
+        if self._executor is None:
+            fn(*args)
+            return
+        self._pending.append(self._executor.submit(fn,*args))
+
+    def _submit_missing(self,path,fn,*args):
+        '''
+        Run fn(*args), as for _submit, unless path is already complete in the destination
+        '''
+        if self._is_complete(path):
+            self.skipped += 1
+            return
+        self._submit(fn,*args)
+
+    def _wait(self):
+        pending = self._pending
+        self._pending = []
+        for f in pending:
+            f.result()
 
     def mkdirs(self,directory):
         import os
         if not os.path.exists(directory):
-            os.makedirs(directory)
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # Created by another worker
+                if not os.path.isdir(directory):
+                    raise
 
     def save_data(self,base_name,data,ext,mode="b"):
         import os
+        if self._zip is not None:
+            path = base_name + "." + ext
+            if not isinstance(data,bytes):
+                data = data.encode('utf-8')
+            self._zip.write(path,data)
+            self._record(path,data)
+            return
+
         base_name = os.path.join(self.destination,base_name + "."+ext)
         directory = os.path.dirname(base_name)
         self.mkdirs(directory)
         f = open(base_name,"w"+mode)
         f.write(data)
         f.close()
+        self._record(os.path.relpath(base_name,self.destination).replace(os.sep,'/'),data)
     
-    def retrieve_json(self,url,**kwargs):
+    def retrieve_json(self,url,save=True,**kwargs):
         if self.print_urls:
             print("*** %s ***" % (url))
     
         try:
-            text = urlopen(self.base_url + quote(url)).read().decode('utf-8')
+            body = self._request(url)
         except:
             self.log("Couldn't retrieve %s"%url)
             return None
 
-        self.save_data(url[1:],bytes(text,'utf-8'),"json")
+        if save:
+            self.save_data(url[1:],body,"json")
+        text = body.decode('utf-8')
     
         if self.print_all:
             print(json.loads(text))
@@ -72,46 +379,149 @@ class VeneerRetriever(object):
         return json.loads(text)
     
     def retrieve_csv(self,url):
-        text = self._veneer.retrieve_csv(url)
-        self.save_data(url[1:],bytes(text,'utf-8'),"csv")
+        if self.print_urls:
+            print("*** %s ***" % (url))
+
+        try:
+            body = self._request(url,headers={'Accept':'text/csv'})
+        except:
+            self.log("Couldn't retrieve %s"%url)
+            return
+        self.save_data(url[1:],body,"csv")
 
     def retrieve_resource(self,url,ext):
         if self.print_urls:
             print("*** %s ***" % (url))
     
-        self.save_data(url[1:],urlopen(self.base_url+quote(url)).read(),ext,mode="b")
+        self.save_data(url[1:],self._request(url),ext,mode="b")
 
     # Process Run list and results
     def retrieve_runs(self):
         run_list = self.retrieve_json("/runs")
-        all_results = []
+        results_per_run = []
+        any_changed = False
         for run in run_list:
-            run_results = self.retrieve_json(run['RunUrl'])
-            ts_results = run_results['Results']
+            run_path = run['RunUrl'][1:]
+            previous = self._manifest.get(run_path+'.json')
+            run_results = self.retrieve_run_summary(run['RunUrl'])
+            if run_results is None:
+                self.log("Skipping %s: Couldn't retrieve run summary"%run['RunUrl'])
+                continue
+            if previous is None or previous['sha1']!=self._manifest[run_path+'.json']['sha1']:
+                # New run, or run number reused: Retrieve all its time series again
+                self._invalidate(run_path+'/')
+                any_changed = True
+            results_per_run.append(run_results['Results'])
+
+        if any_changed:
+            self._invalidate('runs/__all__/')
+
+        for ts_url in self.plan_time_series(results_per_run):
+            self.retrieve_ts(ts_url)
+
+    def retrieve_run_summary(self,url):
+        '''
+        Retrieve and save a run summary, leaving out any results removed from the archive by PruneVeneer
+        '''
+        if not len(self._prune_rules):
+            return self.retrieve_json(url)
+        if self.print_urls:
+            print("*** %s ***" % (url))
+        try:
+            body = self._request(url)
+        except:
+            self.log("Couldn't retrieve %s"%url)
+            return None
+
+        run = json.loads(body.decode('utf-8'))
+        self._series_keys.update(_series_keys(run['Results']))
+        kept = [r for r in run['Results'] if not self._pruned(r['TimeSeriesUrl'])[2]]
+        if len(kept)<len(run['Results']):
+            # Written as PruneVeneer does, so that an unchanged run matches the manifest
+            run['Results'] = kept
+            body = json.dumps(run).encode('utf-8')
+        self.save_data(url[1:],body,'json')
+        return run
+
+    def plan_time_series(self,results_per_run):
+        '''
+        List the time series to retrieve, given the results summary (list of results) of each run.
+
+        Includes the time series from each run (if retrieve_single_ts), the wildcard (location/__all__) requests
+        for each recorder in each run and across runs, and each time series across runs (if retrieve_slim_ts).
+        Each time series url is further expanded into daily, monthly and/or annual requests by retrieve_ts.
+
+        Results not selected by the include and exclude rules are left out. A wildcard request is planned for a
+        recorder if any of its results are selected (the response will include all locations for that recorder).
+        '''
+        plan = []
+        all_results = []
+        for ts_results in results_per_run:
             all_results += ts_results
+            self._series_keys.update(_series_keys(ts_results))
 
             if not self.retrieve_single_runs:
                 continue
 
+            ts_results = [result for result in ts_results if self.included(result)]
             if self.retrieve_single_ts:
-                for result in ts_results:
-                    self.retrieve_ts(result['TimeSeriesUrl'])
+                plan += [result['TimeSeriesUrl'] for result in ts_results]
 
             if self.retrieve_slim_ts:
-                self.retrieve_multi_ts(ts_results)
+                plan += self.multi_ts_urls(ts_results)
+
+        if self.retrieve_slim_ts and len(results_per_run):
+            all_results = self.unique_results_across_runs([r for r in all_results if self.included(r)])
+            plan += self.multi_ts_urls(all_results,run="__all__")
+            plan += [self.translate_url(option['TimeSeriesUrl'],run='__all__') for option in all_results]
+        return plan
+
+    def plan_downloads(self):
+        '''
+        Dry run of retrieve_all: Retrieve the run list and run summaries (without saving) and plan the
+        time series requests that retrieve_all would make.
 
-        if self.retrieve_slim_ts and len(run_list):
-            all_results = self.unique_results_across_runs(all_results)
-            self.retrieve_multi_ts(all_results,run="__all__")
-            self.retrieve_across_runs(all_results)
+        Returns a dictionary with the number of runs, the planned time series urls ('time_series') and the
+        individual requests for those time series ('requests': list of (url,ext)). 'total_requests' estimates the
+        total number of requests, including run summaries and model information, but excluding variable details
+        and icons, which depend on the model.
+
+        Runs whose summary couldn't be retrieved are left out of the plan and listed (by RunUrl) under 'failed'.
+        '''
+        run_list = self.retrieve_json("/runs",save=False)
+        if run_list is None:
+            raise Exception("Couldn't retrieve run list from %s"%self.base_url)
+        results_per_run = []
+        failed = []
+        for run in run_list:
+            run_results = self.retrieve_json(run['RunUrl'],save=False)
+            if run_results is None:
+                failed.append(run['RunUrl'])
+                continue
+            results_per_run.append(run_results['Results'])
+        time_series = self.plan_time_series(results_per_run)
+        requests = [req for ts_url in time_series for req in self.ts_requests(ts_url)]
+        summary = {
+            'runs':len(run_list),
+            'failed':failed,
+            'time_series':time_series,
+            'requests':requests,
+            'total_requests':1+len(run_list)+len(requests)+5
+        }
+        self.log('%d runs, %d time series, %d time series requests (~%d requests in total)'%(
+            len(run_list),len(time_series),len(requests),summary['total_requests']))
+        if len(failed):
+            self.log("Couldn't retrieve summary of %d runs: %s"%(len(failed),', '.join(failed)))
+        return summary
 
     def unique_results_across_runs(self,all_results):
         result = {}
         for ts in all_results:
-            generic_url = self.translate_url(ts['TimeSeriesUrl'],run='__all__')
+            # Everything after /runs/<run>/
+            generic_url = ts['TimeSeriesUrl'].split('/',3)[3]
             if not generic_url in result:
                 result[generic_url] = ts
-        return result.values()
+        return list(result.values())
 
     def translate_url(self,orig,run=None,loc=None,elem=None,var=None):
         url = orig.split('/')
@@ -125,14 +535,20 @@ class VeneerRetriever(object):
             url[8] = var
         return '/'.join(url)
 
+    def multi_ts_urls(self,ts_results,run=None):
+        '''
+        List one wildcard (location/__all__) url for each recorder (RecordingElement and RecordingVariable) in ts_results
+        '''
+        recorders = {}
+        for option in ts_results:
+            key = (option['RecordingElement'],option['RecordingVariable'])
+            if not key in recorders:
+                recorders[key] = self.translate_url(option['TimeSeriesUrl'],run=run,loc='__all__')
+        return list(recorders.values())
+
     def retrieve_multi_ts(self,ts_results,run=None):
-        recorders = list(set([(r['RecordingElement'],r['RecordingVariable']) for r in ts_results]))
-        for r in recorders:
-            for option in ts_results:
-                if option['RecordingElement'] == r[0] and option['RecordingVariable'] == r[1]:
-                    url = self.translate_url(option['TimeSeriesUrl'],run=run,loc='__all__')
-                    self.retrieve_ts(url)
-                    break
+        for url in self.multi_ts_urls(ts_results,run):
+            self.retrieve_ts(url)
 
     def retrieve_across_runs(self,results_set):
         for option in results_set:
@@ -140,58 +556,164 @@ class VeneerRetriever(object):
             self.retrieve_ts(url)
 
     def retrieve_this_daily(self,ts_url):
+        if self._pruned(ts_url)[0]: return False
         if self.retrieve_daily: return True
 
+        return self._daily_rules.matches(self._series_key(ts_url))
+
+    def _series_key(self,ts_url):
+        '''
+        Return the (NetworkElement,RecordingElement,RecordingVariable) of a time series url, from the run summaries
+        '''
         splits = ts_url.split('/')
-        run = splits[2]
-        loc = splits[4]
-        ele = splits[6]
-        var = splits[8]
-
-        for exception in self.retrieve_daily_for:
-            matched = True
-            for key,val in exception.items():
-                if key=='NetworkElement' and val!=loc: 
-                    matched=False;
-                    break
-                if key=='RecordingElement' and val!=ele:
-                    matched=False;
-                    break
-                if key=='RecordingVariable' and val!=var:
-                    matched=False;
-                    break
-            if matched: return True
-        return False
+        parts = (splits[4],splits[6],splits[8])
+        return self._series_keys.get(parts,parts)
 
-    def retrieve_ts(self,ts_url):
+    def included(self,result):
+        '''
+        Should the time series for a result (from a run summary) be retrieved, according to include and exclude?
+        '''
+        if self.include is not None and not self.include.matches_result(result):
+            return False
+        return not self.exclude.matches_result(result)
+
+    def ts_urls(self,ts_url):
+        '''
+        List the daily, monthly and/or annual urls to archive for a time series
+        '''
         urls = []
 
         if self.retrieve_this_daily(ts_url):
             urls.append(ts_url)
+        if self._pruned(ts_url)[1]:
+            return urls
         if self.retrieve_monthly:
             urls.append(ts_url + "/aggregated/monthly")
         if self.retrieve_annual:
             urls.append(ts_url + "/aggregated/annual")
+        return urls
+
+    def ts_requests(self,ts_url):
+        '''
+        List the requests, as (url,ext), that retrieve_ts will make for a time series
+        '''
+        urls = self.ts_urls(ts_url)
+        requests = []
+        if self.retrieve_ts_json:
+            if self.derive_aggregates:
+                if len(urls):
+                    requests.append((ts_url,'json'))
+            else:
+                requests += [(url,'json') for url in urls]
+        if self.retrieve_ts_csv:
+            requests += [(url,'csv') for url in urls]
+        return requests
+
+    def retrieve_ts(self,ts_url):
+        urls = self.ts_urls(ts_url)
 
         for url in urls:
-            if self.retrieve_ts_json:
-                self.retrieve_json(url)
+            if self.retrieve_ts_json and not self.derive_aggregates:
+                self._submit_missing(url[1:]+'.json',self.retrieve_json,url)
             if self.retrieve_ts_csv:
-                self.retrieve_csv(url)
+                self._submit_missing(url[1:]+'.csv',self.retrieve_csv,url)
+
+        if self.retrieve_ts_json and self.derive_aggregates:
+            aggregates = [ts for ts in ['monthly','annual'] if getattr(self,'retrieve_'+ts)]
+            if self._pruned(ts_url)[1]:
+                aggregates = []
+            save_daily = self.retrieve_this_daily(ts_url)
+            paths = [ts_url[1:]+'/aggregated/%s.json'%ts for ts in aggregates]
+            if save_daily:
+                paths.append(ts_url[1:]+'.json')
+            if len(paths) and not all(self._is_complete(p) for p in paths):
+                self._submit(self.retrieve_ts_and_aggregates,ts_url,aggregates,save_daily)
+            elif len(paths):
+                self.skipped += len(paths)
+
+    def retrieve_ts_and_aggregates(self,ts_url,aggregates,save_daily=True):
+        '''
+        Retrieve a daily time series and write the aggregates (eg ['monthly','annual']) computed from it
+        '''
+        ts = self.retrieve_json(ts_url,save=save_daily)
+        if ts is None:
+            return
+        for timestep in aggregates:
+            aggregated = aggregate_time_series(ts,timestep)
+            self.save_data(ts_url[1:]+'/aggregated/'+timestep,json.dumps(aggregated).encode('utf-8'),'json')
     
     def retrieve_variables(self):
         variables = self.retrieve_json("/variables")
         for var in variables:
-            if var['TimeSeries']: self.retrieve_json(var['TimeSeries'])
-            if var['PiecewiseFunction']: self.retrieve_json(var['PiecewiseFunction'])
+            if var['TimeSeries']: self._submit(self.retrieve_json,var['TimeSeries'])
+            if var['PiecewiseFunction']: self._submit(self.retrieve_json,var['PiecewiseFunction'])
 
-    def retrieve_all(self,clean=False):
+    def retrieve_all(self,clean=False,resume=False,verify=False):
+        '''
+        Retrieve everything from the Veneer service and write it to the destination directory.
+
+        clean: If True, remove the destination directory first, if it exists. Otherwise, raise an Exception
+               if the destination exists (unless resuming). (default False)
+
+        resume: If True, update an existing (possibly incomplete) archive in the destination directory.
+                Time series and icons already written in full (according to the manifest) are not retrieved again,
+                unless they belong to a run that is new or has changed. The run list, run summaries, variables,
+                functions, input sets and network are always retrieved. (default False)
+
+        verify: When resuming, check the SHA1 hash of each existing file, rather than just its size. (default False)
+
+        Where max_workers>1, time series, variable details and icons are retrieved and written in parallel.
+        Reports the number of requests, volume of data and throughput on completion. These are also left in the
+        requests and bytes_retrieved attributes, and cover every resource retrieved (JSON, CSV and icons), but not
+        failed requests.
+        '''
+        to_zip = self.destination.endswith('.zip')
+        if to_zip and resume:
+            raise Exception("Cannot resume archive to a zip file (%s)"%self.destination)
         if os.path.exists(self.destination):
             if clean:
-                shutil.rmtree(self.destination)
-            else:
-                raise Exception("Destination (%s) already exists. Use clean=True to overwrite"%self.destination)
-        self.mkdirs(self.destination)
+                if to_zip:
+                    os.remove(self.destination)
+                else:
+                    shutil.rmtree(self.destination)
+            elif not resume:
+                raise Exception("Destination (%s) already exists. Use clean=True to overwrite or resume=True to update"%self.destination)
+        if to_zip:
+            self._zip = _ZipWriter(self.destination)
+        else:
+            self.mkdirs(self.destination)
+        self._reset_stats()
+        self._verify = verify
+        if resume:
+            self._load_manifest()
+        else:
+            self._manifest = {}
+            self._set_prune_rules([])
+        self._open_manifest()
+        start = time.time()
+        if self.max_workers>1:
+            from concurrent.futures import ThreadPoolExecutor
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        try:
+            self._retrieve_all()
+            self._wait()
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+            self._pending = []
+            self._close_manifest()
+            if self._zip is not None:
+                self._zip.close()
+                self._zip = None
+        elapsed = time.time()-start
+        self.log('Retrieved %d resources (%.1f MB) in %.1fs: %.1f requests/s, %.2f MB/s'%(
+            self.requests,self.bytes_retrieved/1e6,elapsed,self.requests/max(elapsed,1e-6),
+            self.bytes_retrieved/1e6/max(elapsed,1e-6)))
+        if self.skipped:
+            self.log('Skipped %d files already retrieved'%self.skipped)
+
+    def _retrieve_all(self):
         self.retrieve_runs()
         self.retrieve_json("/functions")
         self.retrieve_variables()
@@ -203,13 +725,111 @@ class VeneerRetriever(object):
             #retrieve_json(f['id'])
             if not f['properties']['feature_type'] == 'node': continue
             if f['properties']['icon'] in icons_retrieved: continue
-            self.retrieve_resource(f['properties']['icon'],'png')
+            self._submit_missing(f['properties']['icon'][1:]+'.png',self.retrieve_resource,f['properties']['icon'],'png')
             icons_retrieved.append(f['properties']['icon'])
 
+SERIES_KEYS=['NetworkElement','RecordingElement','RecordingVariable']
+
+def _encode_rule(rule):
+    '''
+    Rule (see SeriesRules) in a form that can be written as JSON
+    '''
+    return {k:({'regex':v.pattern,'flags':v.flags} if hasattr(v,'match') else v) for k,v in rule.items()}
+
+def _decode_rule(rule):
+    return {k:(re.compile(v['regex'],v['flags']) if isinstance(v,dict) else v) for k,v in rule.items()}
+
+def _series_keys(results):
+    '''
+    Map the (location,element,variable) parts of time series urls to the (NetworkElement,RecordingElement,
+    RecordingVariable) fields of the corresponding results. The url parts aren't always the same as the fields.
+
+    Wildcard (location/__all__) urls map to a NetworkElement of '__all__'.
+    '''
+    keys = {}
+    for result in results:
+        parts = result['TimeSeriesUrl'].split('/')
+        key = tuple(result.get(k,'') for k in SERIES_KEYS)
+        keys[(parts[4],parts[6],parts[8])] = key
+        keys[('__all__',parts[6],parts[8])] = ('__all__',)+key[1:]
+    return keys
+
+class SeriesRules(object):
+    '''
+    Rules for selecting time series by NetworkElement, RecordingElement and RecordingVariable.
+
+    Each rule is a dictionary with any of those keys. Values are either glob style patterns (eg 'Flow*', or
+    just 'Flow' for an exact match) or compiled regular expressions (eg re.compile('.*Flow$')). A rule matches
+    a time series when every value in the rule matches. An empty rule ({}) matches everything.
+
+    Patterns are matched against whole field values, as for fnmatch.fnmatchcase, so * and ? match any character,
+    including /. Values without * or ? are exact matches, even if they contain [ or ].
+
+    Rules always match the fields of results (from run summaries), whether they are used to select time series to
+    retrieve (VeneerRetriever include, exclude and retrieve_daily_for) or to prune (PruneVeneer). Where only a time
+    series url or file is available, the fields are looked up from the run summaries (see _series_keys).
+    Keys other than those above are ignored, with a warning.
+
+    Rules are compiled once, and the outcome for each distinct (element,variable) combination is cached.
+    '''
+    def __init__(self,rules):
+        self.rules = list(rules)
+        self._compiled = [self._compile(r) for r in self.rules]
+        self._cache = {}
+
+    def __len__(self):
+        return len(self.rules)
+
+    def _compile(self,rule):
+        invalid_keys = set(rule.keys()) - set(SERIES_KEYS)
+        if len(invalid_keys):
+            warnings.warn("Ignoring unknown time series keys: %s"%(str(invalid_keys)))
+
+        tests = []
+        for pos,key in enumerate(SERIES_KEYS):
+            if not key in rule:
+                continue
+            val = rule[key]
+            if hasattr(val,'match'):
+                tests.append((pos,lambda v,pattern=val: pattern.match(v) is not None))
+            elif any(c in val for c in '*?'):
+                tests.append((pos,lambda v,pattern=re.compile(fnmatch.translate(val)): pattern.match(v) is not None))
+            else:
+                tests.append((pos,lambda v,val=val: v==val))
+        return tests
+
+    def matches(self,key):
+        '''
+        Does any rule match key, a tuple of (NetworkElement,RecordingElement,RecordingVariable)?
+        '''
+        if not key in self._cache:
+            self._cache[key] = any(all(test(key[pos]) for pos,test in rule) for rule in self._compiled)
+        return self._cache[key]
+
+    def matches_result(self,result):
+        '''
+        Does any rule match a result from a run summary (with NetworkElement, RecordingElement and RecordingVariable)?
+        '''
+        return self.matches(tuple(result.get(k,'') for k in SERIES_KEYS))
+
 class PruneVeneer(object):
+    '''
+    Remove time series from an archive written by VeneerRetriever (either a directory or a .zip file)
+
+    Use remove_variable and remove_element to set up removal rules, then prune to apply them all.
+    Rule values may include glob style wildcards (eg 'Flow*') or be compiled regular expressions. See SeriesRules.
+
+    With dry_run=True, prune reports what would be removed without changing the archive.
+
+    Where the archive has a manifest (written by VeneerRetriever), the removals and the rules are recorded in it,
+    so that VeneerRetriever.retrieve_all(resume=True) doesn't retrieve the pruned time series again.
+    '''
     def __init__(self,path,dry_run=False):
         self.path = path
+        self.dry_run = dry_run
         self.removals = []
+        self._zip = path.endswith('.zip')
+        self._updated = {}
 
     def remove_variable(self,v,daily=True,aggregate=True):
         self.removals.append(({'RecordingVariable':v},dict(daily=daily,aggregate=aggregate)))
@@ -217,54 +837,168 @@ class PruneVeneer(object):
     def remove_element(self,e,daily=True,aggregate=True):
         self.removals.append(({'RecordingElement':e},dict(daily=daily,aggregate=aggregate)))
 
-    def glob(self,f,recursive=False):
-        fn = os.path.join(self.path,f)
-        return glob(fn,recursive=recursive)
+    def _list_files(self):
+        '''
+        List every file in the archive, as a /-separated path relative to the archive root
+        '''
+        if self._zip:
+            with zipfile.ZipFile(self.path) as archive:
+                return archive.namelist()
+        files = []
+        for directory,_,filenames in os.walk(self.path):
+            relative = os.path.relpath(directory,self.path).replace(os.sep,'/')
+            prefix = '' if relative=='.' else relative+'/'
+            files += [prefix+f for f in filenames]
+        return files
+
+    def _run_summaries(self,files):
+        '''
+        Read the summary of each run in the archive. Returns a dictionary of run number -> summary
+        '''
+        summaries = {}
+        for path in files:
+            parts = path.split('/')
+            if len(parts)==2 and parts[0]=='runs' and parts[1].endswith('.json') and parts[1][:-5].isdigit():
+                summaries[int(parts[1][:-5])] = self._read_json(path)
+        return summaries
+
+    def _index_time_series(self,files,keys):
+        '''
+        Index the time series files in the archive by (NetworkElement,RecordingElement,RecordingVariable), using
+        keys (see _series_keys) to map from the location, element and variable in each path.
+
+        Returns a dictionary of key -> (list of daily files,list of aggregate files)
+        '''
+        index = {}
+        for path in files:
+            parts = path.split('/')
+            if len(parts)<8 or parts[0]!='runs' or parts[2]!='location' or parts[4]!='element' or parts[6]!='variable':
+                continue
+            daily = len(parts)==8
+            if daily:
+                if not parts[7].endswith('.json'):
+                    continue
+                parts[7] = parts[7][:-5]
+            key = (parts[3],parts[5],parts[7])
+            entry = index.setdefault(keys.get(key,key),([],[]))
+            entry[0 if daily else 1].append(path)
+        return index
 
     def prune(self):
-        files_to_remove = []
-        files_to_deindex = []
-        ts_template = 'runs/*/location/%s/element/%s/variable/%s'
-        for r,opt in self.removals:
-            loc=r.get('NetworkElement','*')
-            ele=r.get('RecordingElement','*')
-            var=r.get('RecordingVariable','*')
-            search = ts_template%(loc,ele,var)
-            #print(search)
-            if opt['daily']:
-                matches = self.glob(search+'.json')
-                files_to_remove += matches
+        '''
+        Apply all removal rules to the archive, in a single pass over an index of the time series files.
+
+        Results are removed from run summaries when a rule removes both their daily and aggregated time series.
+
+        Returns a report: A dictionary with the files to remove ('remove') and the time series urls to remove
+        from each run summary ('deindex': run number -> list of urls). When dry_run is set, nothing is changed.
+        '''
+        files = self._list_files()
+        summaries = self._run_summaries(files)
+        keys = {}
+        for summary in summaries.values():
+            keys.update(_series_keys(summary['Results']))
+
+        files_to_remove = set()
+        rules = [(SeriesRules([r]),opt) for r,opt in self.removals]
+        for key,(daily,aggregate) in self._index_time_series(files,keys).items():
+            for rule,opt in rules:
+                if not rule.matches(key):
+                    continue
+                if opt['daily']:
+                    files_to_remove.update(daily)
                 if opt['aggregate']:
-                    files_to_deindex += matches
-            if opt['aggregate']:
-                files_to_remove += self.glob(search+'/**',recursive=True)
+                    files_to_remove.update(aggregate)
+
+        deindex = {}
+        for run,summary in summaries.items():
+            for result in summary['Results']:
+                key = tuple(result.get(k,'') for k in SERIES_KEYS)
+                if any(opt['daily'] and opt['aggregate'] and rule.matches(key) for rule,opt in rules):
+                    deindex.setdefault(run,[]).append(result['TimeSeriesUrl'])
+
+        report = {'remove':sorted(files_to_remove),'deindex':deindex}
+        print('Found %d files to remove'%len(files_to_remove))
+        print('Found %d time series to de-index from %d runs'%(sum(len(v) for v in deindex.values()),len(deindex)))
+        if self.dry_run:
+            print('Dry run: Archive not modified')
+            return report
 
-        print('Found %d files and folders to remove'%len(files_to_remove))
-        print('Found %d time series to de-index'%len(files_to_deindex))
         print('Cleaning up run files')
-        self.clean_up_results_files(files_to_deindex)
+        for run,urls in deindex.items():
+            self.clean_up_run(run,urls)
         print('Removing time series files')
+        if self._zip:
+            self.rewrite_zip(files_to_remove)
+            return report
         for f in files_to_remove:
-            if os.path.isfile(f):
-                os.remove(f)
+            fn = os.path.join(self.path,f)
+            if os.path.isfile(fn):
+                os.remove(fn)
+        self._update_manifest(files_to_remove)
         print('Pruning empty directories')
-        os.system('find %s -type d -empty -delete'%self.path)
-
-    def clean_up_results_files(self,files):
-        files_per_run = {}
-        for fn in files:
-            relative = fn[len(self.path):]
-            run = int(relative.split('/')[2])
-            if not run in files_per_run:
-                files_per_run[run] = []
-            files_per_run[run].append(relative[:-5])
-        for run,files in files_per_run.items():
-            self.clean_up_run(run,files)
-        
+        self.remove_empty_directories()
+        return report
+
+    def _update_manifest(self,removed):
+        '''
+        Record removed files, updated run summaries and the removal rules in the manifest, if there is one
+        '''
+        fn = os.path.join(self.path,MANIFEST)
+        updated = self._updated
+        self._updated = {}
+        if not os.path.exists(fn):
+            return
+        with open(fn,'a') as f:
+            for path in sorted(removed):
+                f.write(json.dumps({'file':path,'removed':True})+'\n')
+            for path,data in updated.items():
+                f.write(json.dumps({'file':path,'size':len(data),'sha1':hashlib.sha1(data).hexdigest()})+'\n')
+            for rule,opt in self.removals:
+                f.write(json.dumps({'prune':dict(rule=_encode_rule(rule),**opt)})+'\n')
+
+    def remove_empty_directories(self):
+        for directory,subdirs,files in os.walk(self.path,topdown=False):
+            if directory==self.path:
+                continue
+            if not len(os.listdir(directory)):
+                os.rmdir(directory)
+
+    def rewrite_zip(self,removed):
+        '''
+        Rewrite the zip file without the removed files, and with any updated run files
+        '''
+        tmp = self.path + '.tmp'
+        with zipfile.ZipFile(self.path) as src, zipfile.ZipFile(tmp,'w',zipfile.ZIP_DEFLATED) as dest:
+            for info in src.infolist():
+                if info.filename in removed:
+                    continue
+                if info.filename in self._updated:
+                    dest.writestr(info.filename,self._updated[info.filename])
+                else:
+                    dest.writestr(info,src.read(info))
+        os.replace(tmp,self.path)
+        self._updated = {}
+
+    def _read_json(self,path):
+        if self._zip:
+            with zipfile.ZipFile(self.path) as archive:
+                return json.loads(archive.read(path).decode('utf-8'))
+        with open(os.path.join(self.path,path)) as f:
+            return json.load(f)
+
     def clean_up_run(self,run_number,files):
-        run_fn = os.path.join(self.path,'runs','%d.json'%run_number)
-        run = json.load(open(run_fn))
+        files = set(files)
+        run_fn = 'runs/%d.json'%run_number
+        run = self._read_json(run_fn)
         len_before = len(run['Results'])
         run['Results'] = [res for res in run['Results'] if not res['TimeSeriesUrl'] in files]
-        
-        json.dump(run,open(run_fn,'w'))
\ No newline at end of file
+        if len(run['Results'])==len_before:
+            return
+
+        data = json.dumps(run).encode('utf-8')
+        self._updated[run_fn] = data
+        if self._zip:
+            return
+        with open(os.path.join(self.path,'runs','%d.json'%run_number),'wb') as f:
+            f.write(data)
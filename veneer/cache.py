@@ -0,0 +1,138 @@
+import hashlib
+import os
+import shutil
+import threading
+from collections import OrderedDict
+
+DEFAULT_CACHE_SIZE=256*1024*1024
+
+def run_number(url):
+    '''
+    Return the run number referenced by a Veneer url (eg /runs/3/location/...) or None if the url
+    doesn't refer to a specific, numbered run (eg /runs/latest/..., /runs/__all__/... or /network)
+    '''
+    parts = url.split('/')
+    if len(parts)<3 or parts[1]!='runs' or not parts[2].isdigit():
+        return None
+    return int(parts[2])
+
+class ResultCache(object):
+    '''
+    Client side cache of responses from Veneer, for results of specific runs.
+
+    Responses are cached in memory, up to a maximum total size (in bytes), with the least recently used
+    responses discarded first. Optionally, responses are also written to disk (in a directory dedicated to
+    the cache), where they can be reused between sessions and by multiple processes.
+
+    Entries are keyed on host, port, run number, run identity and url. Only urls that refer to a particular run
+    number are cached, as the results of a given run don't change until the run is dropped. As run numbers are
+    reused once earlier runs are dropped, the run identity (eg a hash of the name and date of the run) ensures
+    results of a different run with the same number aren't reused.
+
+    Typically used through a Veneer client, which invalidates entries when runs are dropped or created:
+
+    v = Veneer(cache=ResultCache(max_bytes=1024**3,directory='veneer_cache'))
+    '''
+    def __init__(self,max_bytes=DEFAULT_CACHE_SIZE,directory=None):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def size(self):
+        '''
+        Total size, in bytes, of responses held in memory
+        '''
+        return self._size
+
+    def _server_dir(self,host,port):
+        return os.path.join(self.directory,'%s_%s'%(host,str(port)))
+
+    def _filename(self,key):
+        host,port,run,identity,url = key
+        digest = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        return os.path.join(self._server_dir(host,port),str(run),identity,digest)
+
+    def _remember(self,key,data):
+        if len(data)>self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._size -= len(self._entries.pop(key))
+            self._entries[key] = data
+            self._size += len(data)
+            while self._size > self.max_bytes:
+                _,evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def get(self,key):
+        '''
+        Return the cached response (bytes) for key (a tuple of host,port,run,run identity,url) or None if not cached
+        '''
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+                return data
+
+        if self.directory is None:
+            return None
+
+        fn = self._filename(key)
+        if not os.path.exists(fn):
+            return None
+        with open(fn,'rb') as f:
+            data = f.read()
+        self._remember(key,data)
+        return data
+
+    def put(self,key,data):
+        '''
+        Cache the response (bytes) for key (a tuple of host,port,run,run identity,url)
+        '''
+        self._remember(key,data)
+
+        if self.directory is None:
+            return
+        fn = self._filename(key)
+        directory = os.path.dirname(fn)
+        if not os.path.exists(directory):
+            os.makedirs(directory,exist_ok=True)
+        tmp_fn = '%s.%d.tmp'%(fn,threading.get_ident())
+        with open(tmp_fn,'wb') as f:
+            f.write(data)
+        os.replace(tmp_fn,fn)
+
+    def invalidate(self,host,port,run=None):
+        '''
+        Discard cached responses from a given server, either for a particular run number or,
+        if run is None, for all runs.
+        '''
+        with self._lock:
+            for key in [k for k in self._entries if k[0]==host and k[1]==port and (run is None or k[2]==run)]:
+                self._size -= len(self._entries.pop(key))
+
+        if self.directory is None:
+            return
+        directory = self._server_dir(host,port)
+        if run is not None:
+            directory = os.path.join(directory,str(run))
+        shutil.rmtree(directory,ignore_errors=True)
+
+    def clear(self):
+        '''
+        Discard all cached responses, in memory and on disk
+        '''
+        with self._lock:
+            self._entries = OrderedDict()
+            self._size = 0
+
+        if self.directory is None or not os.path.exists(self.directory):
+            return
+        for server in os.listdir(self.directory):
+            shutil.rmtree(os.path.join(self.directory,server),ignore_errors=True)
@@ -0,0 +1,133 @@
+try:
+    import httplib as hc
+except:
+    import http.client as hc
+
+import select
+import threading
+import time
+
+IDEMPOTENT_METHODS=['GET','HEAD','PUT','DELETE','OPTIONS']
+
+try:
+    _CONNECTION_ERRORS = (hc.HTTPException,ConnectionError)
+except NameError:
+    import socket
+    _CONNECTION_ERRORS = (hc.HTTPException,socket.error)
+
+def _is_dropped(conn):
+    '''
+    Check whether an idle connection has been closed by the server.
+
+    An idle keep-alive socket should never be readable - if it is, the server has either closed it or
+    sent something unexpected. Either way, it can't be reused.
+    '''
+    sock = conn.sock
+    if sock is None:
+        return True
+    try:
+        readable,_,_ = select.select([sock],[],[],0.0)
+    except (ValueError,OSError):
+        return True
+    return len(readable)>0
+
+class ConnectionPool(object):
+    '''
+    A pool of persistent (keep-alive) HTTP connections to a single Veneer server.
+
+    Used by the Veneer client so that a series of requests (eg retrieving thousands of time series) reuse
+    a small number of TCP connections rather than establishing a new connection for every request.
+
+    Parameters:
+
+    host, port: Location of the Veneer service
+
+    size: Maximum number of connections open at once. Requests beyond this will block until a connection
+          is returned to the pool. (default 4)
+
+    idle_timeout: Number of seconds after which an unused connection is closed rather than reused. (default 30)
+
+    reconnect: If True (default), retry a request once on a new connection when a reused connection has been
+               reset by the server. Only applied for idempotent requests (GET, PUT, DELETE, etc)
+    '''
+    def __init__(self,host,port,size=4,idle_timeout=30.0,reconnect=True):
+        self.host = host
+        self.port = port
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.reconnect = reconnect
+        self._idle = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def _connect(self):
+        return hc.HTTPConnection(self.host,port=self.port)
+
+    def _checkout(self):
+        '''
+        Return a tuple of (connection,reused)
+        '''
+        now = time.time()
+        with self._lock:
+            while len(self._idle):
+                conn,last_used = self._idle.pop()
+                if (now-last_used) > self.idle_timeout or _is_dropped(conn):
+                    conn.close()
+                    continue
+                return conn,True
+        return self._connect(),False
+
+    def _checkin(self,conn):
+        with self._lock:
+            self._idle.append((conn,time.time()))
+
+    def request(self,method,url,body=None,headers={},reader=None):
+        '''
+        Issue a request and read the response in full.
+
+        Returns a tuple of (response,body), where response is the (fully read) HTTPResponse object,
+        and body is the response body as bytes.
+
+        reader: Optional function to consume the response. If provided, reader is called with the
+                HTTPResponse (a readable stream) and its return value is returned in place of body.
+        '''
+        retry = self.reconnect and (method.upper() in IDEMPOTENT_METHODS)
+        self._slots.acquire()
+        try:
+            conn,reused = self._checkout()
+            while True:
+                try:
+                    conn.request(method,url,body,headers=headers)
+                    resp = conn.getresponse()
+                    if reader is None:
+                        data = resp.read()
+                    else:
+                        data = reader(resp)
+                        resp.read()
+                    break
+                except _CONNECTION_ERRORS:
+                    conn.close()
+                    if not (retry and reused):
+                        raise
+                    conn,reused = self._connect(),False
+                except:
+                    conn.close()
+                    raise
+
+            if resp.will_close:
+                conn.close()
+            else:
+                self._checkin(conn)
+            return resp,data
+        finally:
+            self._slots.release()
+
+    def clear(self):
+        '''
+        Close all idle connections
+        '''
+        with self._lock:
+            idle = self._idle
+            self._idle = []
+        for conn,_ in idle:
+            conn.close()
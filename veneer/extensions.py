@@ -9,6 +9,90 @@ def _node_id(node):
         return node['id']
     return node
 
+class NetworkTopology(object):
+    '''
+    Connections between the features of a network, built in a single pass over the features.
+
+    Holds the features by id, the links into and out of each node, the nodes at each end of each link and
+    the catchments of each link, so that each can be found without searching the list of features.
+    '''
+    def __init__(self,features):
+        self.features = features
+        self.refresh()
+
+    def refresh(self):
+        '''
+        Rebuild the topology from the features, eg after features have been modified in place
+        '''
+        features = self.features
+        self.size = len(features)
+        self.by_id = {}
+        self.links_from = {}
+        self.links_to = {}
+        self.catchments = {}
+        for f in features:
+            self.by_id[f['id']] = f
+            props = f['properties']
+            f_type = props.get('feature_type')
+            if f_type=='link':
+                self.links_from.setdefault(props['from_node'],[]).append(f)
+                self.links_to.setdefault(props['to_node'],[]).append(f)
+            elif f_type=='catchment':
+                self.catchments.setdefault(props['link'],[]).append(f)
+
+    def current(self,features):
+        '''
+        True if the topology was built from features (and it hasn't changed length since)
+        '''
+        return self.features is features and self.size==len(features)
+
+    def feature(self,feature_id):
+        if not feature_id in self.by_id:
+            raise Exception('No feature with id %s in network'%str(feature_id))
+        return self.by_id[feature_id]
+
+    def node(self,node_or_link,end):
+        '''
+        Return the id of a node, or of the node at one end ('from_node' or 'to_node') of a link
+        '''
+        source = self.feature(_node_id(node_or_link))
+        if source['properties']['feature_type']=='node':
+            return source['id']
+        return source['properties'][end]
+
+    def downstream_links(self,node):
+        return self.links_from.get(node,[])
+
+    def upstream_links(self,node):
+        return self.links_to.get(node,[])
+
+def network_topology(self):
+    '''
+    Return the NetworkTopology of the network, building it the first time it's needed.
+
+    The topology is rebuilt if the list of features is replaced or changes length. If features are modified in
+    place (eg to change connections), call network.refresh_topology()
+    '''
+    features = self['features']
+    topology = getattr(self,'_topology',None)
+    if topology is None or not topology.current(features):
+        topology = NetworkTopology(features)
+        self._topology = topology
+    return topology
+
+def network_refresh_topology(self):
+    '''
+    Rebuild the NetworkTopology of the network from its current features.
+
+    Needed when features are modified in place (eg to change the connections of a link), which topology()
+    can't detect.
+    '''
+    topology = getattr(self,'_topology',None)
+    if topology is None or topology.features is not self['features']:
+        return self.topology()
+    topology.refresh()
+    return topology
+
 def network_downstream_links(self,node_or_link):
     '''
     Find all the links in the network that are immediately downstream of a given node.
@@ -17,15 +101,9 @@ def network_downstream_links(self,node_or_link):
 
     * node_or_link  - the node to search on. Expects the node feature object
     '''
-    features = self['features']
-    source = features.find_by_id(_node_id(node_or_link))[0]
-    if source['properties']['feature_type']=='node':
-        node = source['id']
-    else:
-        node = source['properties']['to_node']
-
-    links = features.find_by_feature_type('link')
-    return links.find_by_from_node(node)
+    topology = self.topology()
+    node = topology.node(node_or_link,'to_node')
+    return SearchableList(topology.downstream_links(node),self['features']._nested)
 
 def network_upstream_links(self,node_or_link):
     '''
@@ -35,15 +113,9 @@ def network_upstream_links(self,node_or_link):
 
     * node_or_link  - the node or link to search on. Expects the node feature object
     '''   
-    features = self['features']
-    source = features.find_by_id(_node_id(node_or_link))[0]
-    if source['properties']['feature_type']=='node':
-        node = source['id']
-    else:
-        node = source['properties']['from_node']
-
-    links = features.find_by_feature_type('link')
-    return links.find_by_to_node(node)
+    topology = self.topology()
+    node = topology.node(node_or_link,'from_node')
+    return SearchableList(topology.upstream_links(node),self['features']._nested)
 
 def network_node_names(self):
     '''
@@ -99,9 +171,9 @@ def network_outlet_nodes(self):
 
     Returns each node as a feature (ie with fields 'geometry' and 'properties')
     '''
-    features = self['features']
-    nodes = features.find_by_feature_type('node')
-    no_downstream = SearchableList([n for n in nodes if len(self.downstream_links(n))==0],nested=['properties'])
+    topology = self.topology()
+    nodes = self['features'].find_by_feature_type('node')
+    no_downstream = SearchableList([n for n in nodes if not len(topology.downstream_links(n['id']))],nested=['properties'])
     return no_downstream.find_by_icon('/resources/WaterUserNodeModel',op='!=')
 
 def network_as_dataframe(self):
@@ -121,6 +193,7 @@ def network_partition(self,key_features,new_prop):
     Features with no downstream key_feature (eg close to outlets) are attributed with their outlet node
     '''
     features = self['features']
+    topology = self.topology()
 
     def attribute_next_down(feature):
         if new_prop in feature['properties']:
@@ -137,7 +210,7 @@ def network_partition(self,key_features,new_prop):
         elif f_type=='link':
             ds_feature_id = feature['properties']['to_node']
         else: # f_type=='node'
-            downstream_links = self.downstream_links(feature)
+            downstream_links = topology.downstream_links(feature['id'])
             if len(downstream_links)==0:
                 # Outlet and we didn't find one of the key features...
                 feature['properties'][new_prop] = feature['properties']['name']
@@ -157,7 +230,7 @@ def network_partition(self,key_features,new_prop):
             # Just one downstream link, usual case
             ds_feature_id = downstream_links[0]['id']
 
-        ds_feature = features.find_by_id(ds_feature_id)[0]
+        ds_feature = topology.feature(ds_feature_id)
         key = attribute_next_down(ds_feature)
         feature['properties'][new_prop] = key
         return key
@@ -166,17 +239,30 @@ def network_partition(self,key_features,new_prop):
         attribute_next_down(f)
 
 def network_upstream_features(self,node):
+    '''
+    Find all the features upstream of a given node (or link): links, their catchments and the nodes
+    upstream of them, working upstream from the nearest.
+    '''
+    topology = self.topology()
     result = []
-    links = self.upstream_links(node)
-    result += links
-    for l in links:
-        catchment = self['features'].find_by_link(l['id'])
-        if catchment is not None:
-            result.append(catchment)
-        
-        upstream_node = self['features'].find_by_id(l['properties']['from_node'])[0]
+    pending = []
+
+    def visit(node_id):
+        links = topology.upstream_links(node_id)
+        result.extend(links)
+        pending.append(iter(links))
+
+    # Depth first, without recursion, for long chains of nodes
+    visit(topology.node(node,'from_node'))
+    while len(pending):
+        l = next(pending[-1],None)
+        if l is None:
+            pending.pop()
+            continue
+        result += topology.catchments.get(l['id'],[])
+        upstream_node = topology.feature(l['properties']['from_node'])
         result.append(upstream_node)
-        result += self.upstream_features(upstream_node['id'])
+        visit(upstream_node['id'])
     return SearchableList(result,nested=['properties'])
 
 def add_network_methods(target):
@@ -5,11 +5,19 @@ except:
     from urllib.request import quote
     import http.client as hc
 
+import hashlib
+import io
 import json
 import re
+import time
+from operator import itemgetter
 from .bulk import VeneerRetriever
+from .cache import run_number
+from .connection import ConnectionPool
+from .streaming import decode_json_stream
 from .server_side import VeneerIronPython
-from .utils import SearchableList,_stringToList,read_veneer_csv,objdict
+from .utils import SearchableList,ResultsIndex,_stringToList,read_veneer_csv,objdict
+import numpy as np
 import pandas as pd
 # Source
 from . import extensions
@@ -18,6 +26,11 @@ PRINT_URLS=False
 PRINT_ALL=False
 PRINT_SCRIPTS=False
 
+VENEER_DATE_FORMAT='%m/%d/%Y %H:%M:%S'
+
+# Seconds for which the list of runs is trusted when identifying cached results
+RUN_LIST_TTL=10.0
+
 def name_time_series(result):
     '''
     Name the retrieved time series based on the full name of the time series (including variable and location)
@@ -84,14 +97,190 @@ def log(text):
     print('\n'.join(_stringToList(text)))
     sys.stdout.flush()
 
+_event_date = itemgetter('Date')
+_event_value = itemgetter('Value')
+
+def _wildcard_url(result):
+    '''
+    The url for retrieving a result, along with the same element and variable at all locations
+    '''
+    url = result['TimeSeriesUrl'].split('/')
+    url[4] = '__all__'
+    return '/'.join(url)
+
+def _chunk_results(matching,chunk_size,slim):
+    '''
+    Split matching results into lists of positions, of up to chunk_size results. With slim, results from the
+    same wildcard request stay together (in order of first appearance), even if there are more than chunk_size.
+    '''
+    if not slim:
+        return [list(range(i,min(i+chunk_size,len(matching)))) for i in range(0,len(matching),chunk_size)]
+
+    from collections import OrderedDict
+    groups = OrderedDict()
+    for i,result in enumerate(matching):
+        groups.setdefault(_wildcard_url(result),[]).append(i)
+
+    chunks = []
+    current = []
+    for group in groups.values():
+        if len(current) and len(current)+len(group)>chunk_size:
+            chunks.append(current)
+            current = []
+        current += group
+    if len(current):
+        chunks.append(current)
+    return chunks
+
 def _veneer_url_safe_id_string(s):
     return s.replace('#','').replace('/','%2F').replace(':','')
 
+def _replace_inf(text):
+    return re.sub('":(-?)INF','":\\1Infinity',text)
+
+def _decode_json(url,body):
+    text = _replace_inf(body.decode('utf-8'))
+    if PRINT_ALL:
+        print(json.loads(text))
+        print("")
+    try:
+        return json.loads(text)
+    except Exception as e:
+        raise Exception('Error parsing response as JSON. Retrieving %s and received:\n%s'%(url,text[:100]))
+
+def _assemble_time_series(matching,responses,name_fn):
+    '''
+    Assemble the responses for each of the matching results into a single DataFrame, naming columns with name_fn
+    '''
+    retrieved={}
+    def name_column(result):
+        col_name = name_fn(result)
+        if col_name in retrieved:
+            i = 1
+            alt_col_name = '%s %d'%(col_name,i)
+            while alt_col_name in retrieved:
+                i += 1
+                alt_col_name = '%s %d'%(col_name,i)
+            col_name = alt_col_name
+        return col_name
+
+    units_store = {}
+    for result,d in zip(matching,responses):
+        if 'Values' in d:
+            # Slim time series, retrieved as part of a wildcard request
+            result.update({k:v for k,v in d.items() if k!='Values'})
+            col_name = name_column(result)
+            retrieved[col_name] = _slim_time_series(d)
+            units_store[col_name] = result['Units']
+            continue
+
+        result.update(d)
+        col_name = name_column(result)
+#            raise Exception("Duplicate column name: %s"%col_name)
+        if 'Events' in d:
+            retrieved[col_name] = d['Events']
+            units_store[col_name] = result['Units']
+        else:
+            all_ts = d['TimeSeries']
+            for ts in all_ts:
+                col_name = name_column(ts)
+                units_store[col_name] = ts['Units']
+                retrieved[col_name] = _slim_time_series(ts)
+            # Multi Time Series!
+
+    result = _create_timeseries_dataframe(retrieved)
+    for k,u in units_store.items():
+        result[k].units = u
+
+    return result
+
+def _slim_time_series(ts):
+    '''
+    Convert a slim time series record (StartDate, EndDate, TimeStep and Values) to a pandas Series
+    '''
+    s = _parse_veneer_date(ts['StartDate'])
+    e = _parse_veneer_date(ts['EndDate'])
+    if ts['TimeStep']=='Daily':
+        f='D'
+    elif ts['TimeStep']=='Monthly':
+        f='M'
+    elif ts['TimeStep']=='Annual':
+        f='A'
+    dates = pd.date_range(s,e,freq=f)
+    return pd.Series(np.asarray(ts['Values'],dtype=np.float64),index=dates)
+
+def _parse_veneer_date(txt):
+    if hasattr(txt,'strftime'):
+        return txt
+    return pd.datetime.strptime(txt,VENEER_DATE_FORMAT)
+
+def _parse_veneer_dates(dates):
+    '''
+    Parse a sequence of Veneer date strings into a DatetimeIndex.
+
+    Equivalent to calling parse_veneer_date on each date, but parses the whole sequence at once.
+    Where the first and last dates show a regular daily series, the index is generated from the
+    start date and length, without parsing the intermediate dates.
+    '''
+    n = len(dates)
+    if n==0:
+        return pd.DatetimeIndex([])
+    if hasattr(dates[0],'strftime'):
+        return pd.DatetimeIndex(dates)
+
+    start = pd.to_datetime(dates[0],format=VENEER_DATE_FORMAT)
+    end = pd.to_datetime(dates[-1],format=VENEER_DATE_FORMAT)
+    if (end-start)==pd.Timedelta(days=n-1):
+        return pd.DatetimeIndex(pd.date_range(start,periods=n,freq='D'),freq=None)
+    return pd.DatetimeIndex(pd.to_datetime(dates,format=VENEER_DATE_FORMAT))
+
+def _events_to_dataframe(data_dict):
+    '''
+    Build a DataFrame from a dictionary of time series that share a common time index.
+
+    Each time series is either a list of events (dictionaries of Date and Value), events in columnar form
+    (a dictionary with a list of Date and an array of Value) or a pandas Series.
+    The index is taken from the first series. Column types are inferred by pandas from the values, so
+    (for example) integer valued series remain integers.
+    '''
+    first = list(data_dict.values())[0]
+    if isinstance(first,pd.Series):
+        index = pd.DatetimeIndex(first.index,freq=None)
+    elif isinstance(first,dict):
+        index = _parse_veneer_dates(first['Date'])
+    else:
+        index = _parse_veneer_dates(list(map(_event_date,first)))
+    data = {}
+    for k,result in data_dict.items():
+        if isinstance(result,pd.Series):
+            values = result.values
+        elif isinstance(result,dict):
+            values = result['Value']
+        else:
+            values = list(map(_event_value,result))
+        if len(values)!=len(index):
+            raise ValueError('Time series %s has %d values. Expected %d'%(k,len(values),len(index)))
+        data[k] = values
+    return pd.DataFrame(data=data,index=index,columns=list(data_dict.keys()))
+
+def _create_timeseries_dataframe(data_dict,common_index=True):
+    if len(data_dict) == 0:
+        df = pd.DataFrame()
+    elif common_index:
+        df = _events_to_dataframe(data_dict)
+    else:
+        from functools import reduce
+        dataFrames = [_events_to_dataframe({k:ts}).rename_axis('Date') for k,ts in data_dict.items()]
+        df = reduce(lambda l,r: l.join(r,how='outer'),dataFrames)
+    extensions._apply_time_series_helpers(df)
+    return df
+
 class Veneer(object):
     '''
     Acts as a high level client to the Veneer web service within eWater Source.
     '''
-    def __init__(self,port=9876,host='localhost',protocol='http',prefix='',live=True):
+    def __init__(self,port=9876,host='localhost',protocol='http',prefix='',live=True,
+                 pool_size=4,idle_timeout=30.0,reconnect=True,cache=None):
         '''
         Instantiate a new Veneer client.
 
@@ -102,6 +291,21 @@ class Veneer(object):
         prefix: path prefix for all queries. Useful if Veneer is running behind some kind of proxy
 
         live: Connecting to a live Veneer service or a statically served copy of the results? Default: True
+              For a static copy on disk, use protocol='file' and set prefix to the directory, or to a .zip
+              file written by VeneerRetriever.
+
+        pool_size: Maximum number of persistent (keep-alive) connections held open to the Veneer service. Default: 4
+
+        idle_timeout: Seconds after which an unused connection is closed rather than reused. Default: 30
+
+        reconnect: Retry a request on a new connection if a reused connection was reset by the server. Default: True
+
+        cache: Optional veneer.cache.ResultCache, used to avoid retrieving results of an unchanged run more than once.
+               Cached results are discarded when runs are dropped (drop_run, drop_all_runs) or created (run_model).
+               Cached results are also identified by the name and date of their run (from the list of runs, which is
+               re-read every RUN_LIST_TTL seconds), so results are not reused when a run number is reused (eg after
+               runs are dropped from Source or by another client).
+               A cache may be shared by several Veneer clients. Default: None (no caching)
         '''
         self.port=port
         self.host=host
@@ -115,12 +319,22 @@ class Veneer(object):
             if protocol=='file':
                 self.base_url = '%s://%s'%(protocol,prefix)
             self.data_ext='.json'
+        self._archive = None
+        if protocol=='file' and prefix.endswith('.zip'):
+            import zipfile
+            self._archive = zipfile.ZipFile(prefix)
+        self._pool = ConnectionPool(self.host,self.port,size=pool_size,
+                                    idle_timeout=idle_timeout,reconnect=reconnect)
+        self.cache = cache
+        self._run_identities = None
         self.model = VeneerIronPython(self)
 
     def shutdown(self):
         '''
         Stop the Veneer server (and shutdown the command line if applicable)
         '''
+        # The server is about to close all connections: Don't leave any in the pool
+        self._pool.clear()
         try:
             self.post_json('/shutdown')
         except ConnectionResetError:
@@ -128,33 +342,108 @@ class Veneer(object):
         raise Exception("Connection didn't reset. Shutdown may not have worked")
 
     def _replace_inf(self,text):
-        return re.sub('":(-?)INF','":\\1Infinity',text)
+        return _replace_inf(text)
 
-    def retrieve_json(self,url):
+    def retrieve_json(self,url,stream=False):
         '''
         Retrieve data from the Veneer service at the given url path.
 
         url: Path to required resource, relative to the root of the Veneer service.
+
+        stream: If True, decode the response incrementally as it is received, rather than reading it all into memory
+                first. Recommended for very large responses. When streaming, time series values (Values arrays) are
+                returned as NumPy arrays and time series events (Events arrays) are returned in columnar form,
+                as a dictionary of 'Date' (list) and 'Value' (NumPy array). (default False)
         '''
         query_url = self.prefix+url+self.data_ext
         if PRINT_URLS:
             print("*** %s - %s ***" % (url, query_url))
+
+        cache_key = self._cache_key(url)
+        if cache_key is not None:
+            body = self.cache.get(cache_key)
+            if body is None:
+                code,body = self._retrieve_bytes(query_url)
+                if code==200:
+                    self.cache.put(cache_key,body)
+            if stream:
+                return self._decode_json_stream(url,io.BytesIO(body))
+            return self._decode_json(url,body)
+
+        if stream:
+            if self.protocol=='file':
+                with self._open_file(query_url) as f:
+                    return self._decode_json_stream(url,f)
+            return self._decode_json_stream(url,None,query_url)
+
+        return self._decode_json(url,self._retrieve_bytes(query_url)[1])
+
+    def _cache_key(self,url):
+        if self.cache is None:
+            return None
+        run = run_number(url)
+        if run is None:
+            return None
+        identity = self._run_identity(run)
+        if identity is None:
+            return None
+        return (self.host,self.port,run,identity,self.prefix+url+self.data_ext)
+
+    def _run_identity(self,run):
+        '''
+        Return a hash identifying the results currently held under a run number (from the name and date of the run),
+        or None if there is no such run.
+
+        Run numbers are positions in the list of runs, so a run number is reused once earlier runs are dropped.
+        '''
+        identities = self._run_identities
+        if identities is None or (time.time()-identities[0])>RUN_LIST_TTL:
+            identities = (time.time(),{})
+            for r in self.retrieve_json('/runs'):
+                details = json.dumps([r.get('RunUrl'),r.get('DateRun'),r.get('Name')]).encode('utf-8')
+                identities[1][run_number(r['RunUrl'])] = hashlib.sha1(details).hexdigest()[:16]
+            self._run_identities = identities
+        return identities[1].get(run)
+
+    def _invalidate_cache(self,run=None):
+        if self.cache is not None:
+            self._run_identities = None
+            self.cache.invalidate(self.host,self.port,run)
+
+    def _retrieve_bytes(self,query_url):
+        '''
+        Return a tuple of (status code,response body as bytes)
+        '''
         if self.protocol=='file':
-            text = open(query_url).read()
-        else:
-            conn = hc.HTTPConnection(self.host,port=self.port)
-            conn.request('GET',quote(query_url))
-            resp = conn.getresponse()
-            text = resp.read().decode('utf-8')
+            with self._open_file(query_url) as f:
+                return 200,f.read()
+        resp,body = self._pool.request('GET',quote(query_url))
+        return resp.getcode(),body
+
+    def _open_file(self,query_url):
+        '''
+        Open a file from a static copy of the results, either in a directory or a zip file
+        '''
+        if self._archive is not None:
+            return self._archive.open(query_url[len(self.prefix):].lstrip('/'))
+        return open(query_url,'rb')
+
+    def _decode_json(self,url,body):
+        return _decode_json(url,body)
+
+    def _decode_json_stream(self,url,stream,query_url=None):
+        try:
+            if stream is None:
+                resp,result = self._pool.request('GET',quote(query_url),reader=decode_json_stream)
+            else:
+                result = decode_json_stream(stream)
+        except ValueError as e:
+            raise Exception('Error parsing response as JSON. Retrieving %s:\n%s'%(url,str(e)))
 
-        text = self._replace_inf(text)
         if PRINT_ALL:
-            print(json.loads(text))
+            print(result)
             print("")
-        try:
-            return json.loads(text)
-        except Exception as e:
-            raise Exception('Error parsing response as JSON. Retrieving %s and received:\n%s'%(url,text[:100]))
+        return result
 
     def retrieve_csv(self,url):
         '''
@@ -167,10 +456,8 @@ class Veneer(object):
         if PRINT_URLS:
             print("*** %s ***" % (url))
 
-        conn = hc.HTTPConnection(self.host,port=self.port)
-        conn.request('GET',quote(url+self.data_ext),headers={"Accept":"text/csv"})
-        resp = conn.getresponse()
-        text = resp.read().decode('utf-8')
+        resp,body = self._pool.request('GET',quote(url+self.data_ext),headers={"Accept":"text/csv"})
+        text = body.decode('utf-8')
 
         result = read_veneer_csv(text)
         if PRINT_ALL:
@@ -201,21 +488,21 @@ class Veneer(object):
         return self.send_json(url,data,'POST',async)
 
     def send(self,url,method,payload=None,headers={},async=False):
-        conn = hc.HTTPConnection(self.host,port=self.port)
-        conn.request(method,url,payload,headers=headers)
         if async:
+            # Caller takes ownership of the connection, so don't take it from the pool
+            conn = hc.HTTPConnection(self.host,port=self.port)
+            conn.request(method,url,payload,headers=headers)
             return conn
-        resp = conn.getresponse()
+
+        resp,body = self._pool.request(method,url,payload,headers=headers)
         code = resp.getcode()
         if code==302:
             return code,resp.getheader('Location')
         elif code==200:
-            resp_body = resp.read().decode('utf-8')
+            resp_body = body.decode('utf-8')
             return code,(json.loads(resp_body) if len(resp_body) else None)
         else:
-            return code,resp.read().decode('utf-8')
-
-        return conn
+            return code,body.decode('utf-8')
 
     def status(self):
         return self.retrieve_json('/')
@@ -288,7 +575,7 @@ class Veneer(object):
                     'RecordAll':[translate(r) for r in enable]}
         self.update_json('/recorders',modifier)
 
-    def run_model(self,params=None,start=None,end=None,async=False,name=None,**kwargs):
+    def run_model(self,params=None,start=None,end=None,async=False,name=None,future=False,**kwargs):
         '''
         Trigger a run of the Source model
 
@@ -304,13 +591,17 @@ class Veneer(object):
 
         name: Name to assign to run in Source results (default None: let Source name using default strategy)
 
+        future: (default False). If True, the method will return immediately with a concurrent.futures.Future,
+                which completes when the simulation has finished. The result of the future is the same as the return
+                value of a synchronous run (code, URL of results set). If the run fails, future.result() raises the
+                error from Source. Use concurrent.futures.as_completed (or wait) to collect runs from several
+                Veneer instances as they finish.
+
         kwargs: optional named parameters to be used to update the params dictionary
 
         In the default behaviour (async=False), this method will return once the Source simulation has finished, and will return
         the URL of the results set in the Veneer service
         '''
-        conn = hc.HTTPConnection(self.host,port=self.port)
-
         if params is None:
             params = {}
 
@@ -324,22 +615,65 @@ class Veneer(object):
         if not name is None:
             params['_RunName'] = name
 
+        payload = json.dumps(params)
+        headers = {'Content-type':'application/json','Accept':'application/json'}
     #   conn.request('POST','/runs',json.dumps({'parameters':params}),headers={'Content-type':'application/json','Accept':'application/json'})
-        conn.request('POST','/runs',json.dumps(params),headers={'Content-type':'application/json','Accept':'application/json'})
         if async:
+            # Run number isn't known until the run completes
+            self._invalidate_cache()
+            conn = hc.HTTPConnection(self.host,port=self.port)
+            conn.request('POST','/runs',payload,headers=headers)
             return conn
 
-        resp = conn.getresponse()
-        code = resp.getcode()
+        if future:
+            return self._run_model_future(payload,headers)
+
+        resp,body = self._pool.request('POST','/runs',payload,headers=headers)
+        return self._run_result(resp.getcode(),resp.getheader('Location'),body)
+
+    def _run_model_future(self,payload,headers):
+        '''
+        Start a run on a dedicated connection and return a Future for its result
+        '''
+        from concurrent.futures import Future
+        import threading
+
+        result = Future()
+        result.set_running_or_notify_cancel()
+        # Run number isn't known until the run completes
+        self._invalidate_cache()
+        conn = hc.HTTPConnection(self.host,port=self.port)
+        conn.request('POST','/runs',payload,headers=headers)
+
+        def wait_for_run():
+            try:
+                resp = conn.getresponse()
+                body = resp.read()
+                result.set_result(self._run_result(resp.getcode(),resp.getheader('Location'),body))
+            except Exception as e:
+                result.set_exception(e)
+            finally:
+                conn.close()
+
+        thread = threading.Thread(target=wait_for_run)
+        thread.daemon = True
+        thread.start()
+        return result
+
+    def _run_result(self,code,location,body):
+        '''
+        Interpret the response to a run request. Returns (code,URL of results set) or raises the error from Source.
+        '''
         if code==302:
-            return code,resp.getheader('Location')
+            self._invalidate_cache(run_number(location))
+            return code,location
         elif code==200:
             return code,None
         elif code==500:
-            error = json.loads(resp.read().decode('utf-8'))
+            error = json.loads(body.decode('utf-8'))
             raise Exception('\n'.join([error['Message'],error['StackTrace']]))
         else:
-            return code,resp.read().decode('utf-8')
+            return code,body.decode('utf-8')
 
     def drop_run(self,run='latest'):
         '''
@@ -348,20 +682,35 @@ class Veneer(object):
         run: Run number to delete. Default ='latest'. Valid values are 'latest' and integers from 1
         '''
         assert self.live_source
-        conn = hc.HTTPConnection(self.host,port=self.port)
-        conn.request('DELETE','/runs/%s'%str(run))
-        resp = conn.getresponse()
+        resp,_ = self._pool.request('DELETE','/runs/%s'%str(run))
+        self._invalidate_cache(run_number('/runs/%s'%str(run)))
         code = resp.getcode()
         return code
 
     def drop_all_runs(self):
         '''
         Tell Source to drop/delete ALL current run results from memory
+
+        Retrieves the run list once and drops each run, latest first, over the pooled (keep-alive) connections.
+        The run list is then checked again, in case runs were added in the meantime.
+
+        Raises an Exception if Source fails to drop a run.
         '''
-        runs = self.retrieve_runs()
-        while len(runs)>0:
-            self.drop_run(int(runs[-1]['RunUrl'].split('/')[-1]))
+        assert self.live_source
+        try:
             runs = self.retrieve_runs()
+            while len(runs)>0:
+                for run in reversed(runs):
+                    resp,_ = self._pool.request('DELETE',run['RunUrl'])
+                    code = resp.getcode()
+                    if code!=200:
+                        raise Exception('Unable to drop run %s: HTTP %d'%(run['RunUrl'],code))
+                remaining = self.retrieve_runs()
+                if len(remaining)>=len(runs):
+                    raise Exception('Unable to drop runs: %d runs remaining'%len(remaining))
+                runs = remaining
+        finally:
+            self._invalidate_cache()
 
     def retrieve_runs(self):
         '''
@@ -371,21 +720,25 @@ class Veneer(object):
         '''
         return self.retrieve_json('/runs')
 
-    def retrieve_run(self,run='latest'):
+    def retrieve_run(self,run='latest',stream=False):
         '''
         Retrieve a results summary for a particular run.
 
-        This will include references to all of the time series results available for the run.
+        This will include references to all of the time series results available for the run, as a ResultsIndex
+        (under the 'Results' key). Passing the result to retrieve_multiple_time_series (as run_data) reuses the
+        indexes for matching criteria, which is much quicker when making many queries against a large run.
 
         run: Run to retrieve. Either 'latest' (default) or an integer run number from 1
+
+        stream: Decode the (potentially very large) results summary incrementally. See retrieve_json. (default False)
         '''
         run = run.split('/')[-1]
         if run=='latest' and not self.live_source:
             all_runs = self.retrieve_json('/runs')
-            result = self.retrieve_json(all_runs[-1]['RunUrl'])
+            result = self.retrieve_json(all_runs[-1]['RunUrl'],stream=stream)
         else:
-            result = self.retrieve_json('/runs/%s'%str(run))
-        result['Results'] = SearchableList(result['Results'])
+            result = self.retrieve_json('/runs/%s'%str(run),stream=stream)
+        result['Results'] = ResultsIndex(result['Results'])
         return result
 
     def network(self):
@@ -646,7 +999,8 @@ class Veneer(object):
         return self.send('/inputSets/%s/run'%(name.replace('%','%25').replace(' ','%20')),'POST')
 
 
-    def retrieve_multiple_time_series(self,run='latest',run_data=None,criteria={},timestep='daily',name_fn=name_element_variable):
+    def retrieve_multiple_time_series(self,run='latest',run_data=None,criteria={},timestep='daily',name_fn=name_element_variable,
+                                      max_workers=1,slim=False,stream=False,urls=None,chunk_size=None):
         """
         Retrieve multiple time series from a run according to some criteria.
 
@@ -678,83 +1032,165 @@ class Veneer(object):
           * veneer.name_element_variable (DEFAULT: users the name of the network element and the name of the variable)
           * veneer.name_for_location (just use the name of the network element)
           * veneer.name_for_variable (just use the name of the variable)
+
+        max_workers: Number of time series to retrieve concurrently (default 1: retrieve one at a time).
+        The number of requests in flight to the Veneer service at any one time is also limited by the
+        pool_size of the Veneer client.
+
+        slim: If True, request time series from Veneer using location wildcards (location/__all__), which Veneer
+        answers in the compact (slim) format of a start date, end date and array of values. One request is made for
+        all matching time series of a given element and variable, as long as most of the series returned by that
+        request are wanted. Other time series are retrieved individually. (default False)
+
+        stream: Decode each response incrementally, placing time series values directly into NumPy arrays.
+        Reduces peak memory use for long time series and large wildcard requests. See retrieve_json. (default False)
+
+        urls: List of time series to retrieve, as TimeSeriesUrl from the results of one or more runs
+        (eg '/runs/1/location/Outlet/element/Downstream Flow Volume/variable/Flow'), in place of run, run_data and
+        criteria. The results summary of each run is retrieved to identify the time series. (default None)
+
+        chunk_size: Retrieve the time series in batches of around this many series, converting the responses of each
+        batch to a compact form before retrieving the next. Limits the number of raw responses held in memory at once.
+        With slim=True, the series from a single wildcard request are kept in one batch. (default None: one batch)
         """
         if timestep=="daily":
             suffix = ""
         else:
             suffix = "/aggregated/%s"%timestep
 
+        if urls is not None:
+            matching,all_results = self._results_for_urls(urls,stream)
+            return self._retrieve_results_time_series(matching,all_results,suffix,name_fn,max_workers,slim,stream,chunk_size)
+
         if run_data is None:
-            run_data = self.retrieve_run(run)
+            run_data = self.retrieve_run(run,stream=stream)
 
-        retrieved={}
-        def name_column(result):
-            col_name = name_fn(result)
-            if col_name in retrieved:
-                i = 1
-                alt_col_name = '%s %d'%(col_name,i)
-                while alt_col_name in retrieved:
-                    i += 1
-                    alt_col_name = '%s %d'%(col_name,i)
-                col_name = alt_col_name
-            return col_name
-
-        units_store = {}
-        for result in run_data['Results']:
-            if self.result_matches_criteria(result,criteria):
-                d = self.retrieve_json(result['TimeSeriesUrl']+suffix)
-                result.update(d)
-                col_name = name_column(result)
-#                    raise Exception("Duplicate column name: %s"%col_name)
-                if 'Events' in d:
-                    retrieved[col_name] = d['Events']
-                    units_store[col_name] = result['Units']
-                else:
-                    all_ts = d['TimeSeries']
-                    for ts in all_ts:
-                        col_name = name_column(ts)
-                        units_store[col_name] = ts['Units']
-
-                        vals = ts['Values']
-                        s = self.parse_veneer_date(ts['StartDate'])
-                        e = self.parse_veneer_date(ts['EndDate'])
-                        if ts['TimeStep']=='Daily':
-                            f='D'
-                        elif ts['TimeStep']=='Monthly':
-                            f='M'
-                        elif ts['TimeStep']=='Annual':
-                            f='A'
-                        dates = pd.date_range(s,e,freq=f)
-                        retrieved[col_name] = [{'Date':d,'Value':v} for d,v in zip(dates,vals)]
-                    # Multi Time Series!
-
-        result = self._create_timeseries_dataframe(retrieved)
-        for k,u in units_store.items():
-            result[k].units = u
+        matching = ResultsIndex._of(run_data['Results']).matching(criteria)
+        return self._retrieve_results_time_series(matching,run_data['Results'],suffix,name_fn,max_workers,slim,stream,
+                                                  chunk_size)
 
-        return result
+    def _results_for_urls(self,urls,stream=False):
+        '''
+        Return the results summaries for a list of time series urls, and all the results of their runs
+        '''
+        run_urls = []
+        for url in urls:
+            run_url = '/'.join(url.split('/')[:3])
+            if not run_url in run_urls:
+                run_urls.append(run_url)
+        all_results = []
+        for run_url in run_urls:
+            all_results += list(self.retrieve_run(run_url,stream=stream)['Results'])
+
+        by_url = {r['TimeSeriesUrl']:r for r in all_results}
+        missing = [url for url in urls if not url in by_url]
+        if len(missing):
+            raise Exception('%d time series not found in results, including %s'%(len(missing),missing[0]))
+        return [by_url[url] for url in urls],all_results
+
+    def _retrieve_results_time_series(self,matching,all_results,suffix,name_fn,max_workers,slim,stream,chunk_size=None):
+        '''
+        Retrieve the time series for each of the matching results and assemble them into a single DataFrame.
+
+        See retrieve_multiple_time_series and _retrieve_slim_time_series
+        '''
+        if chunk_size is None:
+            chunks = [list(range(len(matching)))]
+        else:
+            chunks = _chunk_results(matching,chunk_size,slim)
+
+        responses = [None]*len(matching)
+        for chunk in chunks:
+            results = [matching[i] for i in chunk]
+            if slim:
+                retrieved = self._retrieve_slim_time_series(results,all_results,suffix,max_workers,stream)
+            else:
+                retrieved = self._retrieve_many_json([result['TimeSeriesUrl']+suffix for result in results],max_workers,stream)
+            for i,d in zip(chunk,retrieved):
+                responses[i] = d if chunk_size is None else self._compact_time_series(d)
+        return _assemble_time_series(matching,responses,name_fn)
+
+    def _compact_time_series(self,d):
+        '''
+        Convert a list of events, in a time series response, to a pandas Series, which is much smaller than the
+        decoded JSON
+        '''
+        events = d.get('Events')
+        if not isinstance(events,list):
+            return d
+        d = dict(d)
+        dates = self.parse_veneer_dates(list(map(_event_date,events)))
+        d['Events'] = pd.Series(list(map(_event_value,events)),index=dates)
+        return d
+
+    def _retrieve_many_json(self,urls,max_workers=1,stream=False):
+        '''
+        Retrieve a list of urls, in order, with up to max_workers requests in flight at once.
+
+        Returns an iterator over the responses, in the same order as urls.
+        '''
+        if max_workers<=1 or len(urls)<2:
+            return (self.retrieve_json(url,stream) for url in urls)
+
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return iter(list(executor.map(lambda url: self.retrieve_json(url,stream),urls)))
+
+    def _retrieve_slim_time_series(self,matching,all_results,suffix='',max_workers=1,stream=False):
+        '''
+        Retrieve the time series for each of the matching results, using wildcard (location/__all__)
+        requests where possible.
+
+        A wildcard request is used for a given element and variable when at least half of the time series
+        it would return (based on all_results) are in matching. The remaining time series are retrieved
+        individually.
+
+        Returns a list, in the same order as matching, with either the slim time series record (including
+        a Values array) or the response from retrieving the individual time series.
+        '''
+        from collections import OrderedDict
+
+        def key(result):
+            return (result['NetworkElement'],result['RecordingElement'],result['RecordingVariable'])
+
+        available = {}
+        for result in all_results:
+            url = _wildcard_url(result)
+            available[url] = available.get(url,0) + 1
+
+        requested = OrderedDict()
+        for result in matching:
+            requested.setdefault(_wildcard_url(result),[]).append(result)
+
+        wildcards = [url for url,results in requested.items() if 2*len(results) >= available.get(url,0)]
+        found = {}
+        for url,d in zip(wildcards,self._retrieve_many_json([url+suffix for url in wildcards],max_workers,stream)):
+            for ts in d.get('TimeSeries',[]):
+                if 'Values' in ts:
+                    found[(url,)+key(ts)] = ts
+
+        lookup = [(_wildcard_url(result),)+key(result) for result in matching]
+        individual = [result['TimeSeriesUrl']+suffix for result,k in zip(matching,lookup) if not k in found]
+        individual = self._retrieve_many_json(individual,max_workers,stream)
+        return [found[k] if k in found else next(individual) for k in lookup]
 
     def parse_veneer_date(self,txt):
-        if hasattr(txt,'strftime'):
-            return txt
-        return pd.datetime.strptime(txt,'%m/%d/%Y %H:%M:%S')
+        return _parse_veneer_date(txt)
+
+    def parse_veneer_dates(self,dates):
+        '''
+        Parse a sequence of Veneer date strings into a DatetimeIndex.
+
+        Equivalent to calling parse_veneer_date on each date, but parses the whole sequence at once.
+        '''
+        return _parse_veneer_dates(dates)
 
     def convert_dates(self,events):
-        return [{'Date':self.parse_veneer_date(e['Date']),'Value':e['Value']} for e in events]
+        dates = self.parse_veneer_dates([e['Date'] for e in events])
+        return [{'Date':d,'Value':e['Value']} for d,e in zip(dates,events)]
 
     def _create_timeseries_dataframe(self,data_dict,common_index=True):
-        if len(data_dict) == 0:
-            df = pd.DataFrame()
-        elif common_index:
-            index = [self.parse_veneer_date(event['Date']) for event in list(data_dict.values())[0]]
-            data = {k:[event['Value'] for event in result] for k,result in data_dict.items()}
-            df = pd.DataFrame(data=data,index=index)
-        else:
-            from functools import reduce
-            dataFrames = [pd.DataFrame(self.convert_dates(ts)).set_index('Date').rename(columns={'Value':k}) for k,ts in data_dict.items()]
-            df = reduce(lambda l,r: l.join(r,how='outer'),dataFrames)
-        extensions._apply_time_series_helpers(df)
-        return df
+        return _create_timeseries_dataframe(data_dict,common_index)
 
 def read_sdt(fn):
     ts = pd.read_table(fn,sep=' +',engine='python',names=['Year','Month','Day','Val'])
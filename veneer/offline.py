@@ -0,0 +1,277 @@
+'''
+Offline access to model results, from a local, indexed archive.
+
+create_archive writes the runs held by a Veneer service, along with the network, functions, variables and
+other information about the model, to a single SQLite file. OfflineVeneer then serves the same queries
+(retrieve_run, retrieve_multiple_time_series, network, functions, variables, etc) from that file, without
+a running Source model. Criteria on the results index are answered from the indexes in the archive,
+rather than by scanning the list of results.
+
+Example:
+
+v = Veneer()
+create_archive(v,'scenario_a.db',criteria={'RecordingVariable':'Downstream Flow Volume'})
+
+offline = OfflineVeneer('scenario_a.db')
+flows = offline.retrieve_multiple_time_series(criteria={'NetworkElement':'Outlet'})
+network = offline.network()
+'''
+import json
+import os
+import re
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+from .general import Veneer,name_element_variable
+from .store import INDEX_KEYS,_column_name,_name_columns
+from .utils import ResultsIndex,_literal_prefix,_MAX_CHAR
+from . import extensions
+
+DOCUMENTS=['/','/network','/functions','/variables','/inputSets']
+
+_AGGREGATES={'monthly':'M','annual':'A'}
+
+_SCHEMA='''
+CREATE TABLE documents (url TEXT PRIMARY KEY, body TEXT);
+CREATE TABLE runs (run INTEGER PRIMARY KEY, info TEXT, timestep TEXT, dates BLOB);
+CREATE TABLE results (id INTEGER PRIMARY KEY, run INTEGER, %s, details TEXT);
+CREATE TABLE time_series (id INTEGER PRIMARY KEY, ts_values BLOB);
+CREATE UNIQUE INDEX results_url ON results (TimeSeriesUrl);
+%s
+'''%(','.join('%s TEXT'%k for k in INDEX_KEYS),
+     '\n'.join('CREATE INDEX results_%s ON results (run,%s);'%(k,k) for k in INDEX_KEYS if k!='TimeSeriesUrl'))
+
+def _regexp(pattern,value):
+    return value is not None and re.match(pattern,value) is not None
+
+def create_archive(v,fn,runs=None,criteria={},timestep='daily',documents=DOCUMENTS,**kwargs):
+    '''
+    Archive results and model information from a Veneer service to a single SQLite file, for use with OfflineVeneer.
+
+    v: Veneer client to retrieve from
+
+    fn: Destination filename. Must not already exist
+
+    runs: List of run numbers to archive. Default: None (all runs)
+
+    criteria: Which time series to archive from each run. See Veneer.retrieve_multiple_time_series. Default: {} (all)
+
+    timestep: Timestep of archived time series ('daily', 'monthly' or 'annual'). Monthly and annual totals can
+              be derived, when reading, from daily time series.
+
+    documents: Other resources to archive (eg '/network', '/functions'). Variables are archived along with their
+               time series and piecewise functions.
+
+    kwargs: Passed to Veneer.retrieve_multiple_time_series (eg max_workers, slim, stream)
+
+    Returns the filename.
+    '''
+    if os.path.exists(fn):
+        raise Exception("Destination (%s) already exists"%fn)
+
+    db = sqlite3.connect(fn)
+    try:
+        db.executescript(_SCHEMA)
+
+        def save_document(url,doc):
+            db.execute('INSERT OR REPLACE INTO documents VALUES (?,?)',(url,json.dumps(doc)))
+
+        for url in documents:
+            try:
+                doc = v.retrieve_json(url)
+            except Exception:
+                continue
+            save_document(url,doc)
+            if url=='/variables':
+                for var in doc:
+                    for key in ['TimeSeries','PiecewiseFunction']:
+                        if var.get(key):
+                            save_document(var[key],v.retrieve_json(var[key]))
+
+        run_list = v.retrieve_runs()
+        if runs is not None:
+            run_list = [r for r in run_list if int(r['RunUrl'].split('/')[-1]) in runs]
+        for r in run_list:
+            _archive_run(db,v,int(r['RunUrl'].split('/')[-1]),criteria,timestep,**kwargs)
+        save_document('/runs',run_list)
+        db.commit()
+    finally:
+        db.close()
+    return fn
+
+def _archive_run(db,v,run,criteria,timestep,**kwargs):
+    run_data = v.retrieve_run(str(run))
+    originals = run_data['Results'].matching(criteria)
+    matching = [dict(r) for r in originals]
+    data = v.retrieve_multiple_time_series(run_data={'Results':matching},
+                                           timestep=timestep,name_fn=_column_name,**kwargs)
+    if len(matching)!=len(data.columns):
+        raise Exception('Expected %d time series for run %d. Received %d'%(len(matching),run,len(data.columns)))
+
+    info = {k:val for k,val in run_data.items() if k!='Results'}
+    dates = np.asarray(data.index.values,dtype='datetime64[ns]')
+    db.execute('INSERT INTO runs VALUES (?,?,?,?)',(run,json.dumps(info),timestep,dates.tobytes()))
+
+    insert = 'INSERT INTO results (run,%s,details) VALUES (?,%s,?)'%(','.join(INDEX_KEYS),','.join('?'*len(INDEX_KEYS)))
+    for orig,retrieved,col in zip(originals,matching,data.columns):
+        # Retrieval fills in details (eg Units) from each time series
+        details = dict(orig,**{k:retrieved[k] for k in INDEX_KEYS if k in retrieved})
+        cursor = db.execute(insert,[run]+[details.get(k) for k in INDEX_KEYS]+[json.dumps(details)])
+        values = np.ascontiguousarray(data[col].values,dtype=np.float64)
+        db.execute('INSERT INTO time_series VALUES (?,?)',(cursor.lastrowid,values.tobytes()))
+
+class OfflineVeneer(Veneer):
+    '''
+    Read only Veneer client, serving results and model information from an archive written by create_archive.
+
+    Supports the retrieval methods of Veneer (eg retrieve_run, retrieve_multiple_time_series, network,
+    functions, variables), for whatever was archived. Methods that modify the model, or run it, will fail.
+    '''
+    def __init__(self,fn):
+        '''
+        Open an archive.
+
+        fn: Filename of archive, as written by create_archive
+        '''
+        if not os.path.exists(fn):
+            raise Exception("Archive (%s) not found"%fn)
+        super(OfflineVeneer,self).__init__(protocol='file',live=False)
+        self.fn = fn
+        self._db = sqlite3.connect(fn)
+        self._db.create_function('REGEXP',2,_regexp)
+
+    def close(self):
+        self._db.close()
+
+    def retrieve_json(self,url,stream=False):
+        '''
+        Retrieve a resource from the archive, by its url in the Veneer service.
+        '''
+        if re.match('^/runs/[^/]+$',url):
+            return self.retrieve_run(url)
+
+        row = self._db.execute('SELECT body FROM documents WHERE url=?',(url,)).fetchone()
+        if row is None:
+            raise Exception('%s not available in archive (%s)'%(url,self.fn))
+        return json.loads(row[0])
+
+    def send(self,url,method,payload=None,headers={},async=False):
+        raise Exception('Cannot %s %s: Archive (%s) is read only'%(method,url,self.fn))
+
+    def run_model(self,*args,**kwargs):
+        raise Exception('Cannot run model from archive (%s)'%self.fn)
+
+    def _run_number(self,run):
+        run = str(run).split('/')[-1]
+        if run=='latest':
+            run = self._db.execute('SELECT MAX(run) FROM runs').fetchone()[0]
+            if run is None:
+                raise Exception('No runs in archive (%s)'%self.fn)
+        return int(run)
+
+    def retrieve_run(self,run='latest',stream=False):
+        '''
+        Retrieve the results summary for a particular run from the archive.
+
+        run: Run to retrieve. Either 'latest' (default) or an integer run number from 1
+        '''
+        run = self._run_number(run)
+        row = self._db.execute('SELECT info FROM runs WHERE run=?',(run,)).fetchone()
+        if row is None:
+            raise Exception('Run %d not available in archive (%s)'%(run,self.fn))
+        result = json.loads(row[0])
+        details = self._db.execute('SELECT details FROM results WHERE run=? ORDER BY id',(run,))
+        result['Results'] = ResultsIndex([json.loads(d) for (d,) in details])
+        return result
+
+    def _find_results(self,run,criteria):
+        '''
+        Return (id,run,details) for each result in run matching criteria, using the indexes on the results table
+        '''
+        clauses = ['run=?']
+        params = [self._run_number(run)]
+        remaining = {}
+        for key,pattern in criteria.items():
+            if not key in INDEX_KEYS or hasattr(pattern,'match'):
+                # Compiled patterns can't be passed to SQLite: Check them against the details of each result
+                remaining[key] = pattern
+                continue
+            prefix,literal = _literal_prefix(pattern)
+            if len(prefix):
+                clauses.append('%s>=? AND %s<?'%(key,key))
+                params += [prefix,prefix+_MAX_CHAR]
+            if not literal:
+                clauses.append('%s REGEXP ?'%key)
+                params.append(pattern)
+
+        query = 'SELECT id,run,details FROM results WHERE %s ORDER BY id'%' AND '.join(clauses)
+        rows = [(i,r,json.loads(d)) for i,r,d in self._db.execute(query,params)]
+        return [row for row in rows if self.result_matches_criteria(row[2],remaining)]
+
+    def _lookup_results(self,urls):
+        rows = {}
+        for i in range(0,len(urls),500):
+            chunk = urls[i:i+500]
+            query = 'SELECT id,run,details,TimeSeriesUrl FROM results WHERE TimeSeriesUrl IN (%s)'%','.join('?'*len(chunk))
+            for ts_id,run,details,url in self._db.execute(query,chunk):
+                rows[url] = (ts_id,run,json.loads(details))
+        missing = [u for u in urls if not u in rows]
+        if len(missing):
+            raise Exception('%d time series not available in archive (%s), including %s'%(len(missing),self.fn,missing[0]))
+        return [rows[u] for u in urls]
+
+    def _read_values(self,ids):
+        values = {}
+        for i in range(0,len(ids),500):
+            chunk = ids[i:i+500]
+            query = 'SELECT id,ts_values FROM time_series WHERE id IN (%s)'%','.join('?'*len(chunk))
+            for ts_id,blob in self._db.execute(query,chunk):
+                values[ts_id] = np.frombuffer(blob,dtype=np.float64)
+        return [values[i] for i in ids]
+
+    def retrieve_multiple_time_series(self,run='latest',run_data=None,criteria={},timestep='daily',
+                                      name_fn=name_element_variable,**kwargs):
+        """
+        Retrieve multiple time series from an archived run according to some criteria.
+
+        Return all time series in a single Pandas DataFrame with date time index.
+
+        Parameters are as for Veneer.retrieve_multiple_time_series. Where run_data is not provided, criteria are
+        matched using the indexes in the archive. Other options (eg max_workers) are accepted and ignored.
+
+        timestep should either match the timestep of the archived time series, or be 'monthly' or 'annual',
+        where daily time series were archived. Monthly and annual values are SUMS, as in Veneer.
+        """
+        if run_data is None:
+            rows = self._find_results(run,criteria)
+        else:
+            matching = ResultsIndex._of(run_data['Results']).matching(criteria)
+            rows = self._lookup_results([r['TimeSeriesUrl'] for r in matching])
+
+        if not len(rows):
+            return self._create_timeseries_dataframe({})
+
+        archived = {}
+        for r in set(row[1] for row in rows):
+            ts,dates = self._db.execute('SELECT timestep,dates FROM runs WHERE run=?',(r,)).fetchone()
+            archived[r] = (ts,pd.DatetimeIndex(np.frombuffer(dates,dtype='datetime64[ns]')))
+
+        results = [details for _,_,details in rows]
+        names = _name_columns(results,name_fn)
+        retrieved = {}
+        for name,(_,r,_),values in zip(names,rows,self._read_values([row[0] for row in rows])):
+            retrieved[name] = pd.Series(values,index=archived[r][1])
+        df = self._create_timeseries_dataframe(retrieved,common_index=len(archived)==1)
+
+        archived_timestep = archived[rows[0][1]][0]
+        if timestep!=archived_timestep:
+            if archived_timestep!='daily' or not timestep in _AGGREGATES:
+                raise Exception('Archive (%s) holds %s time series. Cannot provide %s'%(self.fn,archived_timestep,timestep))
+            df = df.resample(_AGGREGATES[timestep]).sum()
+            extensions._apply_time_series_helpers(df)
+
+        for name,details in zip(names,results):
+            df[name].units = details.get('Units')
+        return df
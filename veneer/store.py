@@ -0,0 +1,205 @@
+'''
+Columnar, on-disk storage of model results.
+
+Writes the time series from a run to a single compressed Parquet or Feather (Arrow IPC) file, along with
+the metadata for each time series from the run's results index (NetworkElement, RecordingElement,
+RecordingVariable, Units, etc). Stored runs can then be queried, a few columns at a time, without
+retrieving the results from Veneer or re-parsing individual JSON files.
+
+Requires pyarrow (pip install veneer-py[store]).
+
+Example:
+
+v = Veneer()
+save_run(v,'scenario_a.parquet',criteria={'RecordingVariable':'Downstream Flow Volume'})
+
+stored = load_run('scenario_a.parquet')
+stored.results.find_by_NetworkElement('Outlet')
+flows = stored.retrieve_multiple_time_series(criteria={'NetworkElement':'Outlet'})
+'''
+import json
+
+from .utils import ResultsIndex
+from . import extensions
+
+METADATA_KEY=b'veneer'
+DATE_COLUMN='Date'
+INDEX_KEYS=['NetworkElement','RecordingElement','RecordingVariable','FunctionalUnit',
+            'TimeSeriesName','TimeSeriesUrl','Units']
+
+def _pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        raise ImportError('Storing results requires pyarrow. Install with: pip install veneer-py[store]')
+    return pyarrow
+
+def _format(fn,format=None):
+    if format is not None:
+        return format
+    if fn.endswith('.feather') or fn.endswith('.arrow'):
+        return 'feather'
+    return 'parquet'
+
+def _column_name(result):
+    return result['TimeSeriesUrl']
+
+def _name_columns(results,name_fn):
+    '''
+    Name a column for each result using name_fn, adding a numeric suffix to any duplicate names
+    '''
+    names = []
+    taken = set()
+    for r in results:
+        name = name_fn(r)
+        if name in taken:
+            i = 1
+            while ('%s %d'%(name,i)) in taken:
+                i += 1
+            name = '%s %d'%(name,i)
+        names.append(name)
+        taken.add(name)
+    return names
+
+def write_results(fn,data,results,run_info={},compression='zstd',format=None):
+    '''
+    Write a DataFrame of time series to a columnar file, along with the metadata for each column.
+
+    fn: Destination filename. Written as Feather (Arrow IPC) if the extension is .feather or .arrow,
+        otherwise as Parquet (unless format is specified)
+
+    data: DataFrame of time series, with a date index
+
+    results: List of dictionaries, one per column of data, with the metadata for that column
+             (eg from the Results of a run).
+
+    run_info: Dictionary of additional information about the run (eg Name, DateRun)
+
+    compression: Compression codec to use (eg 'zstd', 'snappy', 'lz4'). Default: 'zstd'
+
+    format: 'parquet' or 'feather'. Default: Determine from filename
+    '''
+    pa = _pyarrow()
+
+    if len(results)!=len(data.columns):
+        raise Exception('Expected metadata for %d columns. Received %d'%(len(data.columns),len(results)))
+
+    frame = data.copy()
+    frame.columns = [str(c) for c in frame.columns]
+    frame.index.name = DATE_COLUMN
+    frame = frame.reset_index()
+    table = pa.Table.from_pandas(frame,preserve_index=False)
+
+    metadata = {
+        'run':run_info,
+        'columns':[dict(r,Column=c) for r,c in zip(results,data.columns)]
+    }
+    schema_metadata = dict(table.schema.metadata or {})
+    schema_metadata[METADATA_KEY] = json.dumps(metadata).encode('utf-8')
+    table = table.replace_schema_metadata(schema_metadata)
+
+    if _format(fn,format)=='feather':
+        import pyarrow.feather as feather
+        feather.write_feather(table,fn,compression=compression)
+    else:
+        import pyarrow.parquet as pq
+        pq.write_table(table,fn,compression=compression)
+    return fn
+
+def save_run(v,fn,run='latest',criteria={},timestep='daily',compression='zstd',format=None,**kwargs):
+    '''
+    Retrieve time series from a run and write them, as a single columnar dataset, to fn.
+
+    v: Veneer client to retrieve results from
+
+    fn: Destination filename (.parquet, .feather or .arrow)
+
+    run, criteria, timestep: Which run and time series to retrieve. See Veneer.retrieve_multiple_time_series
+
+    compression, format: See write_results
+
+    kwargs: Passed to Veneer.retrieve_multiple_time_series (eg max_workers, slim, stream)
+
+    Returns the filename.
+    '''
+    run_data = v.retrieve_run(run)
+    matching = [dict(r) for r in run_data['Results'].matching(criteria)]
+    data = v.retrieve_multiple_time_series(run_data={'Results':matching},
+                                           timestep=timestep,name_fn=_column_name,**kwargs)
+    # Retrieval fills in details (eg Units) from each time series
+    results = [{k:r[k] for k in INDEX_KEYS if k in r} for r in matching]
+    run_info = {k:val for k,val in run_data.items() if k!='Results'}
+    run_info['TimeStep'] = timestep
+    return write_results(fn,data,results,run_info,compression,format)
+
+class StoredRun(object):
+    '''
+    Results of a run, stored in a columnar file by save_run or write_results.
+
+    Only the metadata is read when opening the file. Time series are read, by column, on request.
+
+    Properties:
+
+    * results - a ResultsIndex of the metadata for each time series (as in the Results of Veneer.retrieve_run)
+    * run_info - a dictionary of information about the run
+    '''
+    def __init__(self,fn,format=None):
+        self.fn = fn
+        self.format = _format(fn,format)
+        metadata = json.loads(self._schema().metadata[METADATA_KEY].decode('utf-8'))
+        self.run_info = metadata['run']
+        self.results = ResultsIndex(metadata['columns'])
+
+    def _schema(self):
+        pa = _pyarrow()
+        if self.format=='feather':
+            import pyarrow.ipc as ipc
+            with pa.memory_map(self.fn) as source:
+                return ipc.open_file(source).schema
+        import pyarrow.parquet as pq
+        return pq.read_schema(self.fn)
+
+    def _read(self,columns):
+        columns = [DATE_COLUMN] + [c for c in columns if c!=DATE_COLUMN]
+        if self.format=='feather':
+            import pyarrow.feather as feather
+            return feather.read_table(self.fn,columns=columns,memory_map=True)
+        import pyarrow.parquet as pq
+        return pq.read_table(self.fn,columns=columns,memory_map=True)
+
+    def time_series(self,columns):
+        '''
+        Read particular columns (as named in the Column field of results) into a DataFrame with a date index
+        '''
+        df = self._read(columns).to_pandas().set_index(DATE_COLUMN)
+        df.index.name = None
+        extensions._apply_time_series_helpers(df)
+        return df
+
+    def retrieve_multiple_time_series(self,criteria={},name_fn=None):
+        '''
+        Read the time series matching criteria into a single DataFrame.
+
+        criteria: Dictionary of regular expressions on the metadata fields (eg RecordingVariable, NetworkElement).
+                  See Veneer.retrieve_multiple_time_series
+
+        name_fn: Function for naming the columns of the DataFrame from the metadata for each time series.
+                 Default: veneer.name_element_variable
+        '''
+        from .general import name_element_variable
+        if name_fn is None:
+            name_fn = name_element_variable
+
+        matching = self.results.matching(criteria)
+        df = self.time_series([r['Column'] for r in matching])
+
+        df.columns = _name_columns(matching,name_fn)
+        return df
+
+def load_run(fn,format=None):
+    '''
+    Open a run stored with save_run or write_results.
+
+    Returns a StoredRun, which reads the time series lazily, by column.
+    '''
+    return StoredRun(fn,format)
@@ -0,0 +1,405 @@
+'''
+Incremental decoding of large JSON responses from Veneer.
+
+The standard path in Veneer.retrieve_json reads the entire response into a string, substitutes the
+non-standard INF tokens and then parses the string. For very large responses (eg the results index of a
+big model, or wildcard time series requests), this means holding several copies of the payload in memory.
+
+StreamingJSONDecoder reads the response a chunk at a time and converts the numeric arrays in time series
+responses directly into NumPy arrays. Other values that fit within a block of the response (eg each entry in
+the Results of a run) are decoded, a block at a time, by the standard json decoder. Only the structure around
+them, numeric arrays and values that the json module can't decode (eg those including INF) are tokenised here.
+'''
+import codecs
+import json
+import re
+import warnings
+from array import array
+
+import numpy as np
+
+NUMERIC_ARRAYS=['Values']
+EVENT_ARRAYS=['Events']
+CHUNK_SIZE=1<<16
+BLOCK_SIZE=1<<14
+
+_TOKEN = re.compile(r'''\s*(?:
+    (?P<punct>[\[\]{},:])
+   |"(?P<string>[^"\\]*(?:\\.[^"\\]*)*)"
+   |(?P<number>-?(?:INF|Infinity|NaN|\d+(?:\.\d+)?(?:[eE][-+]?\d+)?))(?=[\s,\]}])
+   |(?P<literal>true|false|null)(?=[\s,\]}])
+)''',re.VERBOSE)
+
+_EVENT = re.compile(r'\s*\{\s*"Date"\s*:\s*"([^"\\]*)"\s*,\s*"Value"\s*:\s*([^,}\s]+)\s*\}')
+
+_SPACE = re.compile(r'\s*')
+_WHITESPACE = (' ','\n','\r','\t')
+
+_LITERALS = {'true':True,'false':False,'null':None}
+
+_SPECIAL_NUMBERS = {
+    'INF':float('inf'),
+    '-INF':float('-inf'),
+    'Infinity':float('inf'),
+    '-Infinity':float('-inf'),
+    'NaN':float('nan')
+}
+
+def _unescape(text):
+    if '\\' in text:
+        return json.loads('"%s"'%text)
+    return text
+
+def _number(text):
+    if text in _SPECIAL_NUMBERS:
+        return _SPECIAL_NUMBERS[text]
+    if '.' in text or 'e' in text or 'E' in text:
+        return float(text)
+    return int(text)
+
+def _event_value(text):
+    if text=='null':
+        return float('nan')
+    return float(_SPECIAL_NUMBERS.get(text,text))
+
+def _numeric_array(text):
+    '''
+    Parse the comma separated contents of a JSON array of numbers into a float64 NumPy array.
+
+    null entries become NaN
+    '''
+    text = text.strip()
+    if not len(text):
+        return np.empty(0,dtype=np.float64)
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        try:
+            return np.fromstring(text,dtype=np.float64,sep=',')
+        except (ValueError,DeprecationWarning):
+            pass
+    return np.array([v.strip().replace('null','nan') for v in text.split(',')],dtype=np.float64)
+
+class _TokenStream(object):
+    '''
+    Tokenise a binary stream of UTF-8 encoded JSON, reading it a chunk at a time.
+    '''
+    def __init__(self,stream,chunk_size):
+        self._stream = stream
+        self._chunk_size = chunk_size
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self._buf = ''
+        self._pos = 0
+        self._eof = False
+
+    def _read(self):
+        if self._eof:
+            return None
+        data = self._stream.read(self._chunk_size)
+        if not data:
+            self._eof = True
+            # Trailing space allows a final number or literal to match
+            return self._decoder.decode(b'',final=True) + ' '
+        return self._decoder.decode(data)
+
+    def _fill(self):
+        text = self._read()
+        if text is None:
+            return False
+        self._buf = self._buf[self._pos:] + text
+        self._pos = 0
+        return True
+
+    def next(self):
+        while True:
+            m = _TOKEN.match(self._buf,self._pos)
+            if m is not None:
+                self._pos = m.end()
+                return m
+            if not self._fill():
+                raise ValueError('Unexpected end of JSON input at: %s'%self._buf[self._pos:self._pos+50].strip())
+
+    def peek(self):
+        '''
+        Return the next non-whitespace character, without consuming it, or None at the end of the input
+        '''
+        while True:
+            self._pos = _SPACE.match(self._buf,self._pos).end()
+            if self._pos<len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill():
+                return None
+
+    def match(self,pattern,terminator):
+        '''
+        Match pattern at the current position, once the buffer holds text up to the next terminator.
+        Consumes and returns the match, or returns None (consuming nothing) if the pattern doesn't match.
+        '''
+        while self._buf.find(terminator,self._pos)<0:
+            if not self._fill():
+                break
+        m = pattern.match(self._buf,self._pos)
+        if m is not None:
+            self._pos = m.end()
+        return m
+
+    def take(self,char):
+        '''
+        Consume and return the raw text up to the next occurrence of char, a chunk at a time.
+
+        Returns a tuple of (text,done). Where char isn't in the current buffer, text runs up to the last comma
+        in the buffer and done is False. char itself is consumed but not returned.
+        '''
+        while True:
+            i = self._buf.find(char,self._pos)
+            if i>=0:
+                text = self._buf[self._pos:i]
+                self._pos = i+1
+                return text,True
+            i = self._buf.rfind(',',self._pos)
+            if i>=0:
+                text = self._buf[self._pos:i]
+                self._pos = i+1
+                return text,False
+            if not self._fill():
+                raise ValueError('Unexpected end of JSON input. Expected %s'%char)
+
+    def _ensure(self,block_size):
+        # Read ahead so that at least block_size characters are buffered, unless at the end of the input
+        while (len(self._buf)-self._pos)<=block_size:
+            if not self._fill():
+                break
+
+    def _scan(self,scan,pos,markers):
+        '''
+        Decode the value at pos, with scan (the scan_once of a json.JSONDecoder), if it ends within the buffer and
+        doesn't include any of markers. Returns (value,end) or None
+        '''
+        buf = self._buf
+        try:
+            value,end = scan(buf,pos)
+        except (StopIteration,ValueError):
+            return None
+        if end>=len(buf) and not self._eof:
+            # Possibly incomplete (eg a long number)
+            return None
+        for m in markers:
+            if buf.find(m,pos,end)>=0:
+                return None
+        return value,end
+
+    def _first_marker(self,markers):
+        '''
+        Position of the first of markers in the buffer (from the current position), or the end of the buffer
+        '''
+        found = [i for i in (self._buf.find(m,self._pos) for m in markers) if i>=0]
+        return min(found) if len(found) else len(self._buf)
+
+    def decode_block(self,scan,block_size,markers):
+        '''
+        Decode the next value with the json module, if it ends within block_size characters and doesn't include
+        any of markers (eg keys that need special handling). Returns a tuple containing the value, or None
+        (consuming nothing) if the value can't be decoded this way.
+        '''
+        if self.peek() is None:
+            return None
+        self._ensure(block_size)
+        found = self._scan(scan,self._pos,markers)
+        if found is None:
+            return None
+        self._pos = found[1]
+        return (found[0],)
+
+    def decode_elements(self,scan,block_size,markers):
+        '''
+        Decode consecutive elements of an array, with the json module, as for decode_block. Stops at the end of the
+        array or at the first element that can't be decoded this way.
+
+        Returns a tuple of (list of elements,done), where done is True if the end of the array was reached.
+        Otherwise the stream is left at the start of the next element.
+        '''
+        values = []
+        if self.peek() is None:
+            return values,False
+        # Hot loop, for (eg) the many entries in the Results of a run: Kept to local variables, with the position
+        # of the first marker found once for each buffer
+        buf,pos = self._buf,self._pos
+        marker = self._first_marker(markers)
+        while True:
+            if (len(buf)-pos)<=block_size and not self._eof:
+                self._pos = pos
+                self._ensure(block_size)
+                buf,pos = self._buf,self._pos
+                marker = self._first_marker(markers)
+            try:
+                value,end = scan(buf,pos)
+            except (StopIteration,ValueError):
+                break
+            if end>=len(buf) and not self._eof:
+                # Possibly incomplete (eg a long number)
+                break
+            if end>marker:
+                break
+            values.append(value)
+
+            pos = end
+            if buf[pos:pos+1] in _WHITESPACE:
+                pos = _SPACE.match(buf,pos).end()
+            c = buf[pos:pos+1]
+            if c==']':
+                self._pos = pos+1
+                return values,True
+            if c!=',':
+                raise ValueError('Expected one of ,] in JSON input. Found %s'%c)
+            pos += 1
+            if buf[pos:pos+1] in _WHITESPACE:
+                pos = _SPACE.match(buf,pos).end()
+        self._pos = pos
+        return values,False
+
+    def at_end(self):
+        while True:
+            if len(self._buf[self._pos:].strip()):
+                return False
+            self._buf = ''
+            self._pos = 0
+            if not self._fill():
+                return True
+
+class StreamingJSONDecoder(object):
+    '''
+    Decode JSON from a binary stream (eg an HTTP response or open file) without reading it all into memory.
+
+    Handles the INF and -INF tokens that Veneer uses for infinite values.
+
+    Arrays stored under one of the numeric_arrays keys (default: Values) are returned as float64 NumPy
+    arrays.
+
+    Arrays stored under one of the event_arrays keys (default: Events) are returned in columnar form, as
+    a dictionary with a list of 'Date' strings and a float64 NumPy array of 'Value'.
+
+    Other values of up to block_size characters (eg each entry in the Results of a run) are decoded by the
+    json module, which is much quicker than tokenising them here.
+    '''
+    def __init__(self,numeric_arrays=NUMERIC_ARRAYS,event_arrays=EVENT_ARRAYS,chunk_size=CHUNK_SIZE,
+                 block_size=BLOCK_SIZE):
+        self.numeric_arrays = numeric_arrays
+        self.event_arrays = event_arrays
+        self.chunk_size = chunk_size
+        self.block_size = block_size
+        self._scan = json.JSONDecoder().scan_once
+        self._markers = ['"%s"'%k for k in list(numeric_arrays)+list(event_arrays)]
+
+    def decode(self,stream):
+        tokens = _TokenStream(stream,self.chunk_size)
+        result = self._value(tokens)
+        if not tokens.at_end():
+            raise ValueError('Unexpected content after JSON value')
+        return result
+
+    def _value(self,tokens,key=None):
+        if not (key in self.numeric_arrays or key in self.event_arrays):
+            found = tokens.decode_block(self._scan,self.block_size,self._markers)
+            if found is not None:
+                return found[0]
+        return self._parse(tokens,tokens.next(),key)
+
+    def _parse(self,tokens,m,key=None):
+        punct = m.group('punct')
+        if punct is None:
+            kind = m.lastgroup
+            if kind=='string':
+                return _unescape(m.group('string'))
+            if kind=='number':
+                return _number(m.group('number'))
+            return _LITERALS[m.group('literal')]
+
+        if punct=='{':
+            return self._parse_object(tokens)
+        if punct=='[':
+            if key in self.numeric_arrays:
+                return self._parse_numeric_array(tokens)
+            if key in self.event_arrays:
+                return self._parse_events(tokens)
+            return self._parse_array(tokens)
+        raise ValueError('Unexpected %s in JSON input'%punct)
+
+    def _expect(self,tokens,options):
+        m = tokens.next()
+        punct = m.group('punct')
+        if punct is None or not punct in options:
+            raise ValueError('Expected one of %s in JSON input. Found %s'%(options,m.group(0).strip()))
+        return punct
+
+    def _parse_object(self,tokens):
+        result = {}
+        m = tokens.next()
+        if m.group('punct')=='}':
+            return result
+        while True:
+            if m.lastgroup!='string':
+                raise ValueError('Expected property name in JSON input. Found %s'%m.group(0).strip())
+            key = _unescape(m.group('string'))
+            self._expect(tokens,':')
+            result[key] = self._value(tokens,key)
+            if self._expect(tokens,',}')=='}':
+                return result
+            m = tokens.next()
+
+    def _parse_array(self,tokens):
+        result = []
+        if tokens.peek()==']':
+            tokens.next()
+            return result
+        while True:
+            values,done = tokens.decode_elements(self._scan,self.block_size,self._markers)
+            result += values
+            if done:
+                return result
+            # Element that the json module can't decode here: Parse it in full
+            result.append(self._parse(tokens,tokens.next()))
+            if self._expect(tokens,',]')==']':
+                return result
+
+    def _parse_numeric_array(self,tokens):
+        # Parse the numbers a chunk at a time, rather than holding the text of the whole array
+        parts = []
+        while True:
+            text,done = tokens.take(']')
+            parts.append(_numeric_array(text))
+            if done:
+                break
+        if len(parts)==1:
+            return parts[0]
+        return np.concatenate(parts)
+
+    def _parse_events(self,tokens):
+        # Events are parsed one at a time, as the response is read, into a list of dates and an array of values
+        dates = []
+        values = array('d')
+        if tokens.peek()==']':
+            tokens.next()
+        else:
+            while True:
+                m = tokens.match(_EVENT,'}')
+                if m is not None:
+                    dates.append(m.group(1))
+                    values.append(_event_value(m.group(2)))
+                else:
+                    # Unexpected layout (eg different key order or additional keys). Parse the event in full
+                    event = self._value(tokens)
+                    dates.append(event.get('Date'))
+                    values.append(float('nan') if event.get('Value') is None else event['Value'])
+                if self._expect(tokens,',]')==']':
+                    break
+        return {
+            'Date':dates,
+            'Value':np.frombuffer(values,dtype=np.float64) if len(values) else np.empty(0,dtype=np.float64)
+        }
+
+def decode_json_stream(stream,**kwargs):
+    '''
+    Decode JSON from a binary stream using a StreamingJSONDecoder.
+
+    kwargs are passed to the StreamingJSONDecoder constructor.
+    '''
+    return StreamingJSONDecoder(**kwargs).decode(stream)
@@ -1,5 +1,7 @@
+import numpy as np
 import pandas as pd
 import re
+from bisect import bisect_left
 
 CANARY_METHODS = [
     '_ipython_canary_method_should_not_exist_',
@@ -64,6 +66,7 @@ class SearchableList(object):
       * find_by_X(Y) to find all entries in the list where property X is equal to Y
       * group_by_X() to return a Python dictionary with keys being the unique values of property X and entries
                      being a list of original list entries with matching X values
+      * group_by(['X','Z']) to group by several properties at once, with keys being tuples of values
       * _unique_values(X) return a set of unique values of property X
       * _all_values(X) return a list of all values of property X (a simple select)
       * _select(['X','Y']) to select particular properties
@@ -78,10 +81,114 @@ class SearchableList(object):
     grouped['link'] is a list of links
     grouped['node'] is a list of nodes
     grouped['catchment'] is a list of catchments
+
+    Equality searches (find_by_X(Y)) use a hash index of property X, built the first time X is searched.
+    Indexes are rebuilt if the list is replaced or changes length. If entries are modified in place,
+    call _reset_indexes().
+
+    Use where() to build a lazy Query, which combines several conditions and evaluates them in one pass:
+
+    links = the_list.where(feature_type='link').where('name','Reach','STARTS')
+    long_links = links.where('length',1000,'>')
+
+    For repeated filtering of large lists, use columnar() to get a ColumnarList, which answers the same
+    queries with vectorised operations over per-property columns.
     '''
     def __init__(self,the_list,nested=[]):
-        self._list = the_list
         self._nested = nested
+        self._list = the_list
+
+    @property
+    def _list(self):
+        return self._entries
+
+    @_list.setter
+    def _list(self,the_list):
+        self._entries = the_list
+        self._reset_indexes()
+
+    def _reset_indexes(self):
+        self._indexes = {}
+        self._indexed_length = None
+
+    def _index(self,key):
+        '''
+        Return a dictionary of value -> positions in the list, for property key (including nested properties),
+        or None if the values can't be indexed (eg lists)
+        '''
+        if self._indexed_length!=len(self._entries):
+            self._reset_indexes()
+            self._indexed_length = len(self._entries)
+        if key in self._indexes:
+            return self._indexes[key]
+
+        index = {}
+        try:
+            for i,entry in enumerate(self._entries):
+                if key in entry:
+                    index.setdefault(entry[key],[]).append(i)
+                for nested in self._nested:
+                    if not nested in entry: continue
+                    if not key in entry[nested]: continue
+                    positions = index.setdefault(entry[nested][key],[])
+                    if not len(positions) or positions[-1]!=i:
+                        positions.append(i)
+        except TypeError:
+            # Unhashable values
+            index = None
+        self._indexes[key] = index
+        return index
+
+    def _find(self,key,val,op):
+        if op=='=':
+            index = self._index(key)
+            if index is not None:
+                try:
+                    return [self._entries[i] for i in index.get(val,[])]
+                except TypeError:
+                    pass
+        return [e for e in self._entries if self._search_all(key,val,e,op)]
+
+    def _filter(self,key,val,op):
+        return SearchableList(self._find(key,val,op),self._nested)
+
+    def columnar(self):
+        '''
+        Return a ColumnarList of the same entries, for vectorised filtering
+        '''
+        return ColumnarList(self._list,self._nested)
+
+    def where(self,*condition,**criteria):
+        '''
+        Start a lazy Query over the list. See Query.where
+        '''
+        return Query(self).where(*condition,**criteria)
+
+    def _query(self,predicates):
+        '''
+        Return a generator of entries matching all of predicates (tuples of key,value,op).
+
+        Candidates are narrowed using the hash indexes for equality predicates, then checked against the
+        remaining predicates in one pass.
+        '''
+        positions = None
+        remaining = []
+        for key,val,op in predicates:
+            index = self._index(key) if op=='=' else None
+            try:
+                found = None if index is None else index.get(val,[])
+            except TypeError:
+                found = None
+            if found is None:
+                remaining.append((key,val,op))
+            elif positions is None:
+                positions = set(found)
+            else:
+                positions.intersection_update(found)
+
+        entries = self._entries
+        candidates = entries if positions is None else (entries[i] for i in sorted(positions))
+        return (e for e in candidates if all(self._search_all(k,v,e,op) for k,v,op in remaining))
 
     def __repr__(self):
         return self._list.__repr__()
@@ -96,7 +203,7 @@ class SearchableList(object):
         return self._list.__iter__()
 
     def __reversed__(self):
-        return SearchableList(reversed(self._list))
+        return SearchableList(list(reversed(self._list)),self._nested)
 
     def __contains__(self,item):
         return self._list.__contains__(item)
@@ -111,7 +218,7 @@ class SearchableList(object):
         if op=='>=':
             return entry>=test
         if op=='<':
-            return entry>test
+            return entry<test
         if op=='<=':
             return entry<=test
         if op=='LIKE':
@@ -130,12 +237,41 @@ class SearchableList(object):
             if self._match(entry[nested][key],val,op): return True
         return False
 
-    def _nested_retrieve(self,key,entry):
+    def _nested_retrieve(self,key,entry,default=None):
         if (key in entry): return entry[key]
         for nested in self._nested:
             if not nested in entry: continue
             if key in entry[nested]: return entry[nested][key]
-        return None
+        return default
+
+    def group_by(self,keys):
+        '''
+        Group entries by the value of one or more properties, in a single pass over the list.
+
+        keys: Property name, or list of property names
+
+        Returns a GroupedDictionary with keys being the values of the property (or tuples of values, for a list
+        of properties) and entries being SearchableLists of the matching entries.
+
+        As with find_by_X(None), entries without the property (or without any one of the properties) are left
+        out. Their value is still None (or has None in place of each missing value), so that key is still
+        present, though its group only holds entries where the property is explicitly None.
+        '''
+        single = not isinstance(keys,(list,tuple))
+        if single:
+            keys = [keys]
+
+        missing = object()
+        groups = {}
+        for entry in self._list:
+            values = tuple(self._nested_retrieve(k,entry,missing) for k in keys)
+            found = not any(v is missing for v in values)
+            if not found:
+                values = tuple(None if v is missing else v for v in values)
+            group = groups.setdefault(values[0] if single else values,[])
+            if found:
+                group.append(entry)
+        return GroupedDictionary({k:SearchableList(v,self._nested) for k,v in groups.items()})
 
     def _unique_values(self,key):
         return set(self._all_values(key))
@@ -161,17 +297,17 @@ class SearchableList(object):
         FIND_PREFIX='find_by_'
         if name.startswith(FIND_PREFIX):
             field_name = name[len(FIND_PREFIX):]
-            return lambda x,op='=': SearchableList(list(filter(lambda y: self._search_all(field_name,x,y,op),self._list)),self._nested)
+            return lambda x,op='=': self._filter(field_name,x,op)
 
         FIND_ONE_PREFIX='find_one_by_'
         if name.startswith(FIND_ONE_PREFIX):
             field_name = name[len(FIND_ONE_PREFIX):]
-            return lambda x,op='=': list(filter(lambda y: self._search_all(field_name,x,y,op),self._list))[0]
+            return lambda x,op='=': self._find(field_name,x,op)[0]
 
         GROUP_PREFIX='group_by_'
         if name.startswith(GROUP_PREFIX):
             field_name = name[len(GROUP_PREFIX):]
-            return lambda: GroupedDictionary({k:self.__getattr__(FIND_PREFIX+field_name)(k) for k in self._unique_values(field_name)})
+            return lambda: self.group_by(field_name)
 
         find_suffixes = {
             '_like':'LIKE',
@@ -181,13 +317,337 @@ class SearchableList(object):
         for suffix,op in find_suffixes.items():
             if name.endswith(suffix):
                 field_name = name[0:-len(suffix)]
-                return lambda x: SearchableList(list(filter(lambda y: self._search_all(field_name,x,y,op),self._list)),self._nested)
+                return lambda x: self._filter(field_name,x,op)
         raise AttributeError(name + ' not allowed')
 
 
     def as_dataframe(self):
         return pd.DataFrame(self._list)
 
+class ColumnarList(SearchableList):
+    '''
+    SearchableList backed by per-property columns.
+
+    The entries are flattened once, into a column for each top level property and a column for each property
+    held under a nested key (such as 'properties' in network features), so that a property appearing at several
+    levels (eg 'type' in the feature and in its geometry) keeps each of its values. Columns hold the original
+    values (as objects), along with the positions of the entries that have the property.
+
+    Filters (find_by_X, with any op, X_like, X_startswith, X_endswith) are then evaluated as vectorised
+    operations on the columns for X, combined as for SearchableList (an entry matches if any of its values
+    for X match). The result of a filter is another ColumnarList, sharing the same entries and columns with a
+    narrower mask, so chained filters don't copy or rescan the list.
+
+    Create with SearchableList.columnar(). Entries should not be modified after the columns are built.
+    '''
+    def __init__(self,the_list,nested=[],_columns=None,_mask=None):
+        self._nested = nested
+        self._source = the_list if isinstance(the_list,list) else list(the_list)
+        self._columns = self._flatten(self._source) if _columns is None else _columns
+        self._mask = np.ones(len(self._source),dtype=bool) if _mask is None else _mask
+        self._selected = None
+        self._reset_indexes()
+
+    def _flatten(self,entries):
+        '''
+        Return a dictionary of (nested key or None,property) -> (positions,values), where positions are the
+        entries with the property and values is an object Series of their values
+        '''
+        positions = {}
+        values = {}
+        def add(path,i,v):
+            positions.setdefault(path,[]).append(i)
+            values.setdefault(path,[]).append(v)
+
+        for i,entry in enumerate(entries):
+            for k,v in entry.items():
+                add((None,k),i,v)
+            for nested in self._nested:
+                if isinstance(entry.get(nested),dict):
+                    for k,v in entry[nested].items():
+                        add((nested,k),i,v)
+        return {path:(np.array(positions[path],dtype=np.intp),pd.Series(values[path],dtype=object))
+                for path in positions}
+
+    def _paths(self,key):
+        '''
+        Columns for key, in the order used by _nested_retrieve: The top level property, then each nested key
+        '''
+        return [p for p in [(None,key)]+[(n,key) for n in self._nested] if p in self._columns]
+
+    @property
+    def _list(self):
+        if self._selected is None:
+            self._selected = [self._source[i] for i in np.flatnonzero(self._mask)]
+        return self._selected
+
+    def __len__(self):
+        return int(self._mask.sum())
+
+    def columnar(self):
+        return self
+
+    def _query(self,predicates):
+        result = self
+        for key,val,op in predicates:
+            result = result._filter(key,val,op)
+        return result._list
+
+    def _compare(self,column,val,op):
+        if op=='LIKE':
+            return column.str.contains(val,regex=False,na=False).values.astype(bool)
+        if op=='STARTS':
+            return column.str.startswith(val,na=False).values.astype(bool)
+        if op=='ENDS':
+            return column.str.endswith(val,na=False).values.astype(bool)
+
+        # Compare the values as objects, using Python comparisons, so that (eg) None matches None
+        values = column.values
+        comparisons = {
+            '=':values.__eq__,
+            '!=':values.__ne__,
+            '>':values.__gt__,
+            '>=':values.__ge__,
+            '<':values.__lt__,
+            '<=':values.__le__
+        }
+        if not op in comparisons:
+            raise Exception('Unknown operation')
+        result = np.asarray(comparisons[op](val))
+        if result.shape!=values.shape:
+            raise ValueError('Cannot compare %s element-wise'%str(val))
+        return result.astype(bool)
+
+    def _column_mask(self,key,val,op):
+        mask = np.zeros(len(self._source),dtype=bool)
+        for path in self._paths(key):
+            positions,column = self._columns[path]
+            mask[positions[self._compare(column,val,op)]] = True
+        return mask
+
+    def _filter_mask(self,key,val,op):
+        try:
+            return self._mask & self._column_mask(key,val,op)
+        except (TypeError,ValueError,AttributeError):
+            # Mixed or non-string values in column (or a value that can't be compared): Check each entry
+            mask = np.zeros(len(self._source),dtype=bool)
+            for i in np.flatnonzero(self._mask):
+                mask[i] = self._search_all(key,val,self._source[i],op)
+            return mask
+
+    def _find(self,key,val,op):
+        return [self._source[i] for i in np.flatnonzero(self._filter_mask(key,val,op))]
+
+    def _filter(self,key,val,op):
+        return ColumnarList(self._source,self._nested,self._columns,self._filter_mask(key,val,op))
+
+    def _values(self,paths):
+        '''
+        Return an object array of the value of each entry (selected or not) from the first of paths it has
+        '''
+        result = np.full(len(self._source),None,dtype=object)
+        found = np.zeros(len(self._source),dtype=bool)
+        for path in paths:
+            positions,column = self._columns[path]
+            missing = ~found[positions]
+            result[positions[missing]] = column.values[missing]
+            found[positions[missing]] = True
+        return result
+
+    def _all_values(self,key):
+        return self._values(self._paths(key))[self._mask].tolist()
+
+    def _select(self,keys,transforms={}):
+        if len(transforms):
+            return super(ColumnarList,self)._select(keys,transforms)
+        if len(keys)==1:
+            return self._all_values(keys[0])
+        selected = {k:self._values(self._paths(k))[self._mask] for k in keys}
+        return SearchableList([{k:selected[k][i] for k in keys} for i in range(len(self))])
+
+    def as_dataframe(self):
+        '''
+        Return the selected entries as a DataFrame, with a column for each property (including nested properties).
+
+        Where a property appears at more than one level (eg 'type' in a network feature and in its geometry),
+        the nested columns are named with the nested key (eg 'geometry.type').
+        '''
+        selected = np.flatnonzero(self._mask)
+        keys = [k for n,k in self._columns if n is None and not k in self._nested]
+        names = {}
+        for nested,key in self._columns:
+            if nested is None:
+                if not key in self._nested:
+                    names[(nested,key)] = key
+            elif key in keys or sum(1 for n,k in self._columns if k==key and n is not None)>1:
+                names[(nested,key)] = '%s.%s'%(nested,key)
+            else:
+                names[(nested,key)] = key
+
+        data = {}
+        for path,name in names.items():
+            column = self._values([path])[selected]
+            present = np.isin(selected,self._columns[path][0])
+            if present.any():
+                data[name] = pd.Series(column,dtype=object).infer_objects()
+        return pd.DataFrame(data)
+
+class Query(object):
+    '''
+    Lazy query over a SearchableList, created with SearchableList.where.
+
+    Conditions are collected by where() and only evaluated, in a single pass, when the query is iterated, or
+    when select(), group() or first() is called. Equality conditions use the hash indexes of the list.
+
+    For example:
+
+    links = network['features'].where(feature_type='link')
+    from_n = links.where(from_node=n).select(['name','id'])
+    big = links.where('length',1000,'>').first()
+    '''
+    def __init__(self,source,predicates=()):
+        self._source = source
+        self._predicates = tuple(predicates)
+
+    def where(self,*condition,**criteria):
+        '''
+        Return a new query with additional conditions.
+
+        condition: Optionally, a property name, value to compare and comparison (as for find_by_X, default '='),
+                   given as positional arguments, eg where('length',1000,'>')
+
+        criteria: Any number of property=value conditions, using equality. Every keyword argument is a property
+                  name (including key, value and op)
+        '''
+        if not len(condition) in (0,2,3):
+            raise TypeError('where() takes a property name, value and optional comparison')
+        predicates = list(self._predicates)
+        if len(condition):
+            key,value,op = (tuple(condition)+('=',))[:3]
+            predicates.append((key,value,op))
+        predicates += [(k,v,'=') for k,v in criteria.items()]
+        return Query(self._source,predicates)
+
+    def __iter__(self):
+        return iter(self._source._query(self._predicates))
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return self.evaluate().__repr__()
+
+    def evaluate(self):
+        '''
+        Run the query, returning a SearchableList of matching entries
+        '''
+        return SearchableList(list(self),self._source._nested)
+
+    def select(self,keys,transforms={}):
+        '''
+        Run the query and select particular properties of the matching entries. See SearchableList._select
+        '''
+        return self.evaluate()._select(keys,transforms)
+
+    def group(self,keys):
+        '''
+        Run the query and group the matching entries. See SearchableList.group_by
+        '''
+        return self.evaluate().group_by(keys)
+
+    def first(self):
+        '''
+        Return the first matching entry, or None if there are no matches. Stops at the first match.
+        '''
+        return next(iter(self),None)
+
+# Largest code point: Upper bound for text starting with a given prefix
+_MAX_CHAR=u'\U0010ffff'
+_REGEX_SPECIAL=set('.^$*+?{}[]\\|()')
+
+def _literal_prefix(pattern):
+    '''
+    Return the literal text that any match of pattern (using re.match) must start with,
+    and whether the pattern is entirely literal.
+
+    Compiled patterns aren't inspected: They have no literal prefix.
+    '''
+    if hasattr(pattern,'match') or '|' in pattern:
+        return '',False
+    if pattern.startswith('^'):
+        pattern = pattern[1:]
+    prefix = ''
+    for c in pattern:
+        if c in _REGEX_SPECIAL:
+            if c in '*?{' and len(prefix):
+                # Quantifier applies to the last literal character
+                prefix = prefix[:-1]
+            return prefix,False
+        prefix += c
+    return prefix,True
+
+class ResultsIndex(SearchableList):
+    '''
+    SearchableList of the time series results of a run, indexed for matching criteria.
+
+    Use matching(criteria) to find the results where each field matches a regular expression (using re.match),
+    as in Veneer.retrieve_multiple_time_series. Patterns may be strings or compiled regular expressions.
+
+    The index (value -> positions) of a field, from SearchableList, is built the first time it is used in criteria. Literal patterns
+    (eg 'Outlet') are then answered with a range lookup on the sorted, unique values of the field. Other patterns
+    are tested once against each unique value. The matches for each field and pattern are kept, so repeating a
+    query (eg one per observation in a PEST run) doesn't revisit the results.
+    '''
+    def __init__(self,the_list,nested=[]):
+        super(ResultsIndex,self).__init__(list(the_list),nested)
+
+    @staticmethod
+    def _of(results):
+        if isinstance(results,ResultsIndex):
+            return results
+        return ResultsIndex(results)
+
+    def _reset_indexes(self):
+        super(ResultsIndex,self)._reset_indexes()
+        self._sorted_values = {}
+        self._matches = {}
+
+    def _positions(self,key,pattern):
+        index = self._index(key)
+        if not (key,pattern) in self._matches:
+            if index is None:
+                self._matches[(key,pattern)] = set(i for i,r in enumerate(self._list)
+                                                   if isinstance(r.get(key),str) and re.match(pattern,r[key]))
+                return self._matches[(key,pattern)]
+            if not key in self._sorted_values:
+                self._sorted_values[key] = sorted(v for v in index if isinstance(v,str))
+            values = self._sorted_values[key]
+            prefix,literal = _literal_prefix(pattern)
+            candidates = values[bisect_left(values,prefix):bisect_left(values,prefix+_MAX_CHAR)]
+            if not literal:
+                compiled = pattern if hasattr(pattern,'match') else re.compile(pattern)
+                candidates = [v for v in candidates if compiled.match(v)]
+            positions = set()
+            for v in candidates:
+                positions.update(index[v])
+            self._matches[(key,pattern)] = positions
+        return self._matches[(key,pattern)]
+
+    def matching(self,criteria):
+        '''
+        Return a list of the results matching all criteria, in their original order.
+
+        criteria: Dictionary of regular expressions on the fields of each result (eg NetworkElement,
+                  RecordingVariable). An empty dictionary matches all results.
+        '''
+        positions = None
+        for key,pattern in criteria.items():
+            found = self._positions(key,pattern)
+            positions = found if positions is None else positions & found
+        if positions is None:
+            return list(self._list)
+        return [self._list[i] for i in sorted(positions)]
+
 class DeferredCall(object):
   def __init__(self,parameter,delimiter):
     if parameter: